@@ -0,0 +1,89 @@
+# bench_records.py
+# Keshdagi yozuvlar: eski lug'atlar (get_all_records) va yangi __slots__ yozuvlar (get_all_values).
+#
+#   python benchmarks/bench_records.py [--rows 100000] [--repeat 3]
+#
+# Har ikki usul bir xil jadval qiymatlaridan (API javobi) boshlaydi; API so'rovining o'zi o'lchanmaydi.
+# "load" — qiymatlardan tayyor keshgacha ketgan vaqt, "peak" — yuklash paytidagi eng katta xotira,
+# "kept" — yuklashdan keyin keshning o'zi egallagan xotira (tracemalloc bo'yicha).
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gspread.utils import numericise_all, to_records  # noqa: E402
+
+from records import CLIENT_COLUMNS, parse_clients  # noqa: E402
+
+DESTINATIONS = ["Toshkent", "Samarqand", "Buxoro", "Andijon", "Namangan", "Farg'ona", "Qarshi", "Nukus"]
+
+
+def make_values(rows, seed=1):
+    rnd = random.Random(seed)
+    values = [list(CLIENT_COLUMNS)]
+    for i in range(rows):
+        values.append([
+            str(100000 + i), "PP%d" % (i // 200), str(rnd.randint(1, 40)),
+            ("%.2f" % rnd.uniform(0.1, 9)).replace(".", ","), str(rnd.randint(5, 900)),
+            rnd.choice(DESTINATIONS), "%02d.%02d.2024" % (rnd.randint(1, 28), rnd.randint(1, 12)),
+            "https://example.com/img/%d.jpg" % i if i % 10 == 0 else "", "",
+        ])
+    return values
+
+
+def load_old(values):
+    # what SheetsStorage.load_clients did: gspread's get_all_records, then one dict per client
+    records = to_records(values[0], [numericise_all(row) for row in values[1:]])
+    clients = {}
+    for row in records:
+        cid = str(row.get("id", "")).strip()
+        if not cid:
+            continue
+        clients[cid] = {col: row.get(col, "") for col in CLIENT_COLUMNS[1:]}
+    return clients
+
+
+def load_new(values):
+    return parse_clients(values)
+
+
+def measure(load, values, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        cache = load(values)
+        best = min(best, time.perf_counter() - start)
+        del cache
+    gc.collect()
+    tracemalloc.start()
+    cache = load(values)
+    kept, peak = tracemalloc.get_traced_memory()
+    gc.collect()
+    kept = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return best, peak, kept, len(cache)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+    values = make_values(args.rows)
+
+    print("%-26s %9s %9s %9s" % ("", "load ms", "peak MB", "kept MB"))
+    for name, load in (("dicts (get_all_records)", load_old), ("records (get_all_values)", load_new)):
+        seconds, peak, kept, n = measure(load, values, args.repeat)
+        assert n == args.rows
+        print("%-26s %9.0f %9.1f %9.1f" % (name, seconds * 1000, peak / 2 ** 20, kept / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main()
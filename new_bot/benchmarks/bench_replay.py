@@ -0,0 +1,238 @@
+# bench_replay.py
+# Haqiqiy handlerlar ustida odatiy trafikni qayta o'ynatish: mijoz qidiruvlari, admin kiritishi, ro'yxatlar.
+#
+#   python benchmarks/bench_replay.py [--seconds 10] [--users 30] [--admins 5] [--latency 0.2]
+#                                     [--error-rate 0.02] [--api-latency 0.03] [--backend sheets]
+#                                     [--branches 1]
+#
+# Google Sheets o'rniga xotiradagi soxta jadval (kechikish va kvota xatolari bilan), Telegram o'rniga
+# lokal soxta Bot API serveri ishlatiladi, shuning uchun hech qanday kalit kerak emas.
+# Har bir operatsiya turi alohida bosqichda o'lchanadi (API chaqiruvlarini operatsiyaga bog'lash uchun),
+# oxirida hammasi aralash holda. Natija: o'tkazuvchanlik, kechikish persentillari (botning javob berish
+# vaqti, foydalanuvchi yozayotgan pauzalarsiz) va
+# bitta operatsiyaga to'g'ri keladigan Sheets / Bot API chaqiruvlari.
+#
+# --branches N: ma'lumot N ta soxta jadvalga (filialga) partiya kodi prefiksi bo'yicha bo'linadi
+# (PA.., PB.., ...); har bir jadvalning o'z kechikishi va kvota xatolari bor.
+#
+# Har qanday tezlik o'zgarishini deploydan oldin shu bilan avvalgi natija bilan solishtiring.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeBotAPI, FakeSpreadsheet, install_fake_google  # noqa: E402
+
+TOKEN = "123456:FAKE-TOKEN"
+ADMIN_BASE = 900_000
+BRANCH_LETTERS = "ABCDEFGHIJ"
+branch_count = 1  # set from --branches
+
+
+def party_code(i):
+    # with several branches the second letter is the branch prefix: PA0, PB1, PC2, ...
+    if branch_count == 1:
+        return "PP%d" % i
+    return "P%s%d" % (BRANCH_LETTERS[i % branch_count], i)
+_update_ids = itertools.count(1)
+
+
+def message(uid, text):
+    return {"update_id": next(_update_ids), "message": {
+        "message_id": next(_update_ids), "date": int(time.time()), "text": text,
+        "chat": {"id": uid, "type": "private"}, "from": {"id": uid, "is_bot": False, "first_name": "u"}}}
+
+
+def callback(uid, data):
+    return {"update_id": next(_update_ids), "callback_query": {
+        "id": str(next(_update_ids)), "chat_instance": "1", "data": data,
+        "from": {"id": uid, "is_bot": False, "first_name": "u"},
+        "message": {"message_id": 1, "date": int(time.time()), "text": "list",
+                    "chat": {"id": uid, "type": "private"}}}}
+
+
+# ---------- operations: each is a list of updates one user sends in a row ----------
+def client_lookup(lb, uid, rnd, n_clients):
+    return [message(uid, "🔍 Mijoz yukini tekshirish"), message(uid, str(rnd.randrange(n_clients)))]
+
+
+def party_lookup(lb, uid, rnd, n_clients):
+    return [message(uid, "🔍 Partiya bo‘yicha qidirish"), message(uid, party_code(rnd.randrange(n_clients // 50 or 1)))]
+
+
+def add_client(lb, uid, rnd, n_clients, _ids=itertools.count(10_000_000)):
+    cid = str(next(_ids))
+    answers = ["👤 Mijoz qo'shish", cid, party_code(1 + rnd.randrange(branch_count)),
+               "2", "0.5", "40", "Toshkent", "01.01.2024", "-"]
+    return [message(uid, text) for text in answers]
+
+
+def list_view(lb, uid, rnd, n_clients):
+    return [message(uid, "📋 Barcha mijozlar"),
+            callback(uid, lb.ListPage(view="clients", page=1).pack()),
+            callback(uid, lb.ListPage(view="clients", page=2).pack())]
+
+
+OPERATIONS = {  # name -> (build, admin only, weight in the mixed phase)
+    "client_lookup": (client_lookup, False, 60),
+    "party_lookup": (party_lookup, False, 25),
+    "add_client": (add_client, True, 5),
+    "list_view": (list_view, True, 10),
+}
+
+
+def sheets_calls(sheets):
+    total = Counter()
+    for sheet in sheets:
+        total.update(sheet.calls())
+    return total
+
+
+async def phase(lb, args, names, fake_api, sheets):
+    """Run `names` for args.seconds; returns (latencies by op, failures, elapsed, sheets calls, api calls)."""
+    rnd = random.Random(42)
+    stop = time.monotonic() + args.seconds
+    latencies, failures = defaultdict(list), Counter()
+    sheets_before, api_before = sheets_calls(sheets), Counter(fake_api.calls)
+
+    async def user(uid, admin):
+        choices = [n for n in names if OPERATIONS[n][1] == admin] or names
+        await asyncio.sleep(rnd.random() * args.think)
+        while time.monotonic() < stop:
+            name = rnd.choices(choices, [OPERATIONS[n][2] for n in choices])[0]
+            spent = 0.0  # time the bot took to answer, without the user's typing pauses
+            try:
+                for step, raw in enumerate(OPERATIONS[name][0](lb, uid, rnd, args.clients)):
+                    if step:
+                        await asyncio.sleep(args.typing)
+                    started = time.monotonic()
+                    update = lb.types.Update.model_validate(raw, context={"bot": lb.bot})
+                    await lb.dp.feed_update(lb.bot, update)
+                    spent += time.monotonic() - started
+                latencies[name].append(spent)
+            except Exception as e:
+                failures["%s: %s" % (name, type(e).__name__)] += 1
+            await asyncio.sleep(rnd.expovariate(1 / args.think) if args.think else 0)
+
+    has_admin_ops = any(OPERATIONS[n][1] for n in names)
+    has_user_ops = any(not OPERATIONS[n][1] for n in names)
+    users = [user(1000 + i, False) for i in range(args.users if has_user_ops else 0)]
+    users += [user(ADMIN_BASE + i, True) for i in range(args.admins if has_admin_ops else 0)]
+    started = time.monotonic()
+    await asyncio.gather(*users)
+    await asyncio.sleep(args.latency * 2 + lb.SHEETS_WRITE_WINDOW)  # let batched writes land
+    return (latencies, failures, time.monotonic() - started,
+            sheets_calls(sheets) - sheets_before, Counter(fake_api.calls) - api_before)
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def report(title, latencies, failures, elapsed, sheets_calls, api_calls):
+    total = sum(len(v) for v in latencies.values())
+    print("\n== %s: %d operations in %.1fs (%.1f ops/s)" % (title, total, elapsed, total / elapsed))
+    print("%-14s %6s %8s %8s %8s %8s" % ("operation", "count", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        print("%-14s %6d %8.0f %8.0f %8.0f %8.0f" % (
+            name, len(values), percentile(values, 0.5) * 1000, percentile(values, 0.95) * 1000,
+            percentile(values, 0.99) * 1000, values[-1] * 1000))
+    if failures:
+        print("failures:      ", dict(failures))
+    per_op = lambda counter: ", ".join("%s %.2f" % (k, v / max(1, total)) for k, v in sorted(counter.items()))  # noqa: E731
+    print("sheets calls/op:", per_op(sheets_calls) or "-")
+    print("bot api calls/op:", per_op(api_calls) or "-")
+
+
+async def run(args, sheets):
+    fake_api = FakeBotAPI(TOKEN, latency=args.api_latency)
+    os.environ["TELEGRAM_API_URL"] = await fake_api.start()
+    import logistic_bot as lb
+
+    try:
+        await lb.events.start()
+        loaded = time.monotonic()
+        await lb.warm_up()
+        print("data ready in %.2fs: %d branches, %d parties, %d clients" % (
+            time.monotonic() - loaded, len(lb.storages), len(lb.parties), len(lb.clients)))
+        # quota errors only once the first snapshot is in: warm_up would just retry them
+        for sheet in sheets:
+            for ws in sheet.worksheets.values():
+                ws.error_rate = args.error_rate
+        for name in args.only or OPERATIONS:
+            report(name, *await phase(lb, args, [name], fake_api, sheets))
+        if not args.only:
+            report("mixed", *await phase(lb, args, list(OPERATIONS), fake_api, sheets))
+        reload_started = time.monotonic()
+        await lb.sync_all({})
+        print("\nfull reload of all branches: %.2fs" % (time.monotonic() - reload_started))
+    finally:
+        await fake_api.stop()
+        await lb.events.close()
+        for storage in lb.storages.values():
+            await storage.close()
+        await lb.bot.session.close()
+    errors = Counter()
+    for sheet in sheets:
+        for ws in sheet.worksheets.values():
+            errors.update(ws.errors)
+    print("\ninjected sheets 429s:", dict(errors) or "-")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=float, default=10.0, help="length of each phase")
+    ap.add_argument("--users", type=int, default=30, help="concurrent clients")
+    ap.add_argument("--admins", type=int, default=5, help="concurrent admins")
+    ap.add_argument("--think", type=float, default=3.0, help="mean pause between a user's operations, s")
+    ap.add_argument("--typing", type=float, default=1.0, help="pause between the steps of one operation, s")
+    ap.add_argument("--clients", type=int, default=5000, help="clients in the fake sheet")
+    ap.add_argument("--latency", type=float, default=0.2, help="simulated Sheets call latency, s")
+    ap.add_argument("--error-rate", type=float, default=0.02, help="share of Sheets calls failing with 429")
+    ap.add_argument("--api-latency", type=float, default=0.03, help="simulated Bot API latency, s")
+    ap.add_argument("--backend", choices=("sheets", "sqlite"), default="sheets")
+    ap.add_argument("--only", nargs="*", choices=list(OPERATIONS), help="run just these operations")
+    ap.add_argument("--branches", type=int, default=1, choices=range(1, len(BRANCH_LETTERS) + 1),
+                    help="spreadsheets the data is split over")
+    args = ap.parse_args()
+
+    global branch_count
+    branch_count = args.branches
+    n_parties = args.clients // 50 or 1
+    sheets = {}
+    for b in range(args.branches):
+        sheets["https://docs.google.com/spreadsheets/d/fake-%d" % b] = FakeSpreadsheet(
+            parties=[[party_code(i), "Yangi"] for i in range(b, n_parties, args.branches)],
+            clients=[[str(i), party_code(i // 50), 1, 0.5, 20, "Toshkent", "01.01.2024", "", ""]
+                     for i in range(args.clients) if (i // 50) % args.branches == b],
+            latency=args.latency,
+        )
+    install_fake_google(sheets)
+    tmp = tempfile.mkdtemp()
+    if args.branches > 1:
+        os.environ["BRANCHES"] = json.dumps([
+            {"name": "b%d" % b, "url": url, "prefixes": ["P" + BRANCH_LETTERS[b]]} for b, url in enumerate(sheets)])
+    else:
+        os.environ["SPREADSHEET_URL"] = next(iter(sheets))
+    os.environ.update(
+        BOT_TOKEN=TOKEN, STORAGE_BACKEND=args.backend, SQLITE_PATH=os.path.join(tmp, "bot.db"),
+        FSM_STORAGE="memory", NOTIFY_DB_PATH=os.path.join(tmp, "n.db"), EVENTLOG_DIR=os.path.join(tmp, "eventlog"),
+        ADMIN_IDS=",".join(str(ADMIN_BASE + i) for i in range(args.admins)),
+    )
+    import logging
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args, list(sheets.values())))
+
+
+if __name__ == "__main__":
+    main()
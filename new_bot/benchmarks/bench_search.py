@@ -0,0 +1,67 @@
+# bench_search.py
+# Partiya/mijoz kodlari bo'yicha "shuni nazarda tutdingizmi?" qidiruvi tezligini o'lchaydi.
+#
+#   python benchmarks/bench_search.py [--keys 100000] [--queries 2000]
+#
+# Tasodifiy raqamli ID lar va "PP123" ko'rinishidagi kodlar bilan indeks quriladi,
+# so'ng xato yozilgan so'rovlar bo'yicha find() va suggest() vaqti o'lchanadi.
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indexes import SearchIndex  # noqa: E402
+
+
+def typo(key: str) -> str:
+    """One random edit: drop, replace or insert a character, or change case and add spaces."""
+    i = random.randrange(len(key))
+    kind = random.choice(("drop", "replace", "insert", "case"))
+    if kind == "drop" and len(key) > 2:
+        return key[:i] + key[i + 1:]
+    if kind == "replace":
+        return key[:i] + random.choice("0123456789") + key[i + 1:]
+    if kind == "insert":
+        return key[:i] + random.choice("0123456789") + key[i:]
+    return " " + key.lower() + " "
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--max-posting", type=int, default=2000)
+    args = parser.parse_args()
+    random.seed(42)
+
+    keys = [str(random.randint(1000, 9999999)) for _ in range(args.keys)]
+    keys += ["PP%d" % i for i in range(min(args.keys, 5000))]
+    index = SearchIndex(max_posting=args.max_posting)
+    start = time.perf_counter()
+    for key in keys:
+        index.add(key)
+    print("build: %d keys in %.2f s" % (len(index), time.perf_counter() - start))
+
+    queries = [(key, typo(key)) for key in random.sample(keys, args.queries)]
+    for name, func in (("find", index.find), ("suggest", index.suggest)):
+        times = []
+        found = 0
+        for key, query in queries:
+            t = time.perf_counter()
+            result = func(query)
+            times.append((time.perf_counter() - t) * 1000)
+            if result == key or (isinstance(result, list) and key in result):
+                found += 1
+        times.sort()
+        print("%-8s mean %.3f ms  p50 %.3f ms  p99 %.3f ms  intended key found: %d%%" % (
+            name, statistics.mean(times), times[len(times) // 2], times[int(len(times) * 0.99)],
+            100 * found // len(queries)))
+
+
+if __name__ == "__main__":
+    main()
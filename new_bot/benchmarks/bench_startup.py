@@ -0,0 +1,74 @@
+# bench_startup.py
+# Ishga tushish vaqti: modul importi, polling boshlanishi va ma'lumotlar tayyor bo'lishi.
+#
+#   python benchmarks/bench_startup.py [--latency 1.0] [--clients 5000]
+#
+# "blocking" qatori eski tartibni ko'rsatadi: Sheets ulanishi, sarlavhalar tekshiruvi va
+# birinchi yuklash polling'dan oldin ketma-ket bajarilardi.
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeSpreadsheet, install_fake_google  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--latency", type=float, default=1.0, help="simulated Sheets call latency, s")
+    ap.add_argument("--clients", type=int, default=5000)
+    args = ap.parse_args()
+
+    ss = FakeSpreadsheet(
+        parties=[[f"PP{i}", "Yangi"] for i in range(args.clients // 50)],
+        clients=[[str(i), f"PP{i // 50}", 1, 0.5, 20, "Toshkent", "2024-01-01", ""] for i in range(args.clients)],
+        latency=args.latency,
+    )
+    install_fake_google(ss)
+    os.environ["STORAGE_BACKEND"] = "sheets"
+
+    t0 = time.perf_counter()
+    import logistic_bot as lb
+    t_import = time.perf_counter() - t0
+
+    marks = {}
+
+    async def fake_polling():
+        marks["polling"] = time.perf_counter() - t0
+        await lb.data_ready.wait()
+        marks["ready"] = time.perf_counter() - t0
+        raise asyncio.CancelledError
+
+    async def fake_server():
+        marks["health"] = time.perf_counter() - t0
+        await asyncio.Event().wait()
+
+    lb.run_bot = fake_polling
+    lb.run_server = fake_server
+    t_main = time.perf_counter() - t0
+    try:
+        asyncio.run(lb.main())
+    except asyncio.CancelledError:
+        pass
+
+    # the old order: everything below ran at import time, before polling
+    t1 = time.perf_counter()
+    lb.open_sheets()
+    for ws in ss.worksheets.values():
+        ws.get_all_records()
+    t_blocking = time.perf_counter() - t1
+
+    # times after main() started; the import (mostly aiogram itself) is the same for both
+    print(f"import              {t_import * 1000:9.1f} ms")
+    print(f"health endpoint up  {(marks['health'] - t_main) * 1000:9.1f} ms")
+    print(f"polling started     {(marks['polling'] - t_main) * 1000:9.1f} ms")
+    print(f"data ready          {(marks['ready'] - t_main) * 1000:9.1f} ms")
+    print(f"blocking (old order) {t_blocking * 1000:8.1f} ms  before polling could start")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# bench_storage.py
+# Admin yozuvlari davomida mijoz qidiruvlari javob vaqtini o'lchaydi.
+#
+#   python benchmarks/bench_storage.py [--latency 0.5] [--writes 20] [--lookups 400]
+#
+# "sync" rejimi eski xatti-harakatni takrorlaydi (gspread to'g'ridan-to'g'ri event loop'da),
+# "async" rejimi SheetsRepository orqali ishlaydi.
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sheets import SheetsRepository  # noqa: E402
+from benchmarks.fakes import FakeWorksheet  # noqa: E402
+
+CLIENT_HEADER = ["id", "party", "mesta", "kub", "kg", "destination", "date", "image"]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+async def run(mode, latency, writes, lookups, interval):
+    ws = FakeWorksheet("clients", CLIENT_HEADER, latency=latency)
+    repo = SheetsRepository(max_workers=4, timeout=30)
+    clients = {str(i): {"party": "PP1"} for i in range(1000)}
+
+    async def admin_writer():
+        for i in range(writes):
+            row = [f"n{i}", "PP1", 1, 1, 1, "Toshkent", "2024-01-01", ""]
+            if mode == "sync":
+                ws.append_row(row)
+            else:
+                async with repo.lock(ws):
+                    await repo.call(ws.append_row, row)
+            await asyncio.sleep(0)
+
+    latencies = []
+
+    async def lookup(i, scheduled):
+        # what a handler does: dict lookup, then reply (simulated as one loop turn)
+        clients.get(str(i % 1000))
+        await asyncio.sleep(0)
+        latencies.append(time.perf_counter() - scheduled)
+
+    async def user_traffic():
+        tasks = []
+        start = time.perf_counter()
+        for i in range(lookups):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(lookup(i, scheduled)))
+        await asyncio.gather(*tasks)
+
+    await asyncio.gather(admin_writer(), user_traffic())
+    repo.shutdown()
+    return latencies
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--latency", type=float, default=0.5, help="simulated Sheets call latency, s")
+    ap.add_argument("--writes", type=int, default=20)
+    ap.add_argument("--lookups", type=int, default=400)
+    ap.add_argument("--interval", type=float, default=0.01, help="seconds between user lookups")
+    args = ap.parse_args()
+
+    for mode in ("sync", "async"):
+        lat = asyncio.run(run(mode, args.latency, args.writes, args.lookups, args.interval))
+        ms = [x * 1000 for x in lat]
+        print(
+            f"{mode:5}  lookups={len(ms)}  p50={statistics.median(ms):8.2f}ms  "
+            f"p99={percentile(ms, 99):8.2f}ms  max={max(ms):8.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# bench_throttle.py
+# Suiiste'mol (flood) ostida botning barqarorligini o'lchaydi.
+#
+#   python benchmarks/bench_throttle.py [--seconds 10] [--abusers 5] [--users 30] [--no-limits]
+#
+# Bir nechta "abuser" sekundiga 20 tadan xabar yuboradi, oddiy foydalanuvchilar esa har 3 soniyada
+# mijoz kodini tekshiradi. Soxta Telegram API haqiqiy limitlarni qo'llaydi: bir soniyada 30 tadan
+# ko'p xabar yoki bitta chatga ketma-ket ko'p xabar yuborilsa 429 (retry_after) qaytaradi va
+# shu vaqt davomida barcha so'rovlarni rad etadi. --no-limits cheklovlarsiz holatni ko'rsatadi.
+
+import argparse
+import asyncio
+import datetime
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeSpreadsheet, install_fake_google  # noqa: E402
+
+
+class FakeTelegram:
+    """Bot API stand-in with Telegram's flood limits and a fixed latency."""
+
+    def __init__(self, latency=0.02, global_rate=30, chat_burst=5, ban=3):
+        self.latency = latency
+        self.global_rate = global_rate
+        self.chat_burst = chat_burst
+        self.ban = ban
+        self.recent = deque()  # send times within the last second
+        self.per_chat = {}
+        self.banned_until = 0.0
+        self.stats = Counter()
+
+    async def __call__(self, bot, method, timeout=None):
+        from aiogram.exceptions import TelegramRetryAfter
+        from aiogram.types import Chat, Message
+
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            if now < self.banned_until:
+                self.stats["429"] += 1
+                raise TelegramRetryAfter(method=method, message="Too Many Requests",
+                                         retry_after=int(self.banned_until - now) + 1)
+            while self.recent and now - self.recent[0] > 1.0:
+                self.recent.popleft()
+            chat = self.per_chat.setdefault(chat_id, deque())
+            while chat and now - chat[0] > 1.0:
+                chat.popleft()
+            if len(self.recent) >= self.global_rate or len(chat) >= self.chat_burst:
+                # over the global limit the whole bot is paused, as Telegram does
+                if len(self.recent) >= self.global_rate:
+                    self.banned_until = now + self.ban
+                self.stats["429"] += 1
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=self.ban)
+            self.recent.append(now)
+            chat.append(now)
+            self.stats["sent"] += 1
+        return Message(message_id=1, date=datetime.datetime.now(),
+                       chat=Chat(id=chat_id or 0, type="private"), text="ok")
+
+
+def update(uid, text, seq=[0]):
+    from aiogram.types import Update
+
+    seq[0] += 1
+    return Update.model_validate({"update_id": seq[0], "message": {
+        "message_id": seq[0], "date": 0, "text": text,
+        "chat": {"id": uid, "type": "private"}, "from": {"id": uid, "is_bot": False, "first_name": "u"}}})
+
+
+async def run(lb, args):
+    telegram = FakeTelegram()
+    lb.bot.session.make_request = telegram
+    await lb.warm_up()
+    stop = time.monotonic() + args.seconds
+    latencies, failures = [], Counter()
+    pending = set()
+
+    def feed(uid, text):
+        task = asyncio.create_task(lb.dp.feed_update(lb.bot, update(uid, text)))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        return task
+
+    async def abuser(uid):
+        while time.monotonic() < stop:
+            feed(uid, "🔍 Mijoz yukini tekshirish")
+            await asyncio.sleep(1 / 20)
+
+    async def user(uid):
+        await asyncio.sleep(uid % 30 / 10)  # spread the users over the period
+        while time.monotonic() < stop:
+            started = time.monotonic()
+            try:
+                await feed(uid, "🔍 Mijoz yukini tekshirish")
+                await feed(uid, str(uid % 100))
+                latencies.append(time.monotonic() - started)
+            except Exception as e:
+                failures[type(e).__name__] += 1
+            await asyncio.sleep(max(0.0, 3.0 - (time.monotonic() - started)))
+
+    await asyncio.gather(*[abuser(1_000_000 + i) for i in range(args.abusers)],
+                         *[user(10 + i) for i in range(args.users)])
+    if pending:
+        await asyncio.wait(pending, timeout=30)
+    return telegram.stats, latencies, failures
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=float, default=10.0)
+    ap.add_argument("--abusers", type=int, default=5)
+    ap.add_argument("--users", type=int, default=30)
+    ap.add_argument("--no-limits", action="store_true", help="disable flood control to compare")
+    args = ap.parse_args()
+
+    install_fake_google(FakeSpreadsheet(
+        parties=[["PP1", "Yangi"]],
+        clients=[[str(i), "PP1", 1, 0.5, 20, "Toshkent", "2024-01-01", "", ""] for i in range(100)],
+    ))
+    tmp = tempfile.mkdtemp()
+    os.environ.update(FSM_STORAGE="memory", NOTIFY_DB_PATH=os.path.join(tmp, "n.db"), ADMIN_IDS="")
+    if args.no_limits:
+        os.environ.update(THROTTLE_RATE="0", TELEGRAM_RATE="1000000")
+    import logging
+    logging.disable(logging.ERROR)
+    import logistic_bot as lb
+
+    stats, latencies, failures = asyncio.run(run(lb, args))
+    lookups = len(latencies) + sum(failures.values())
+    print("mode:            %s" % ("no limits" if args.no_limits else "flood control"))
+    print("messages sent:   %d (%.1f/s)" % (stats["sent"], stats["sent"] / args.seconds))
+    print("429 answers:     %d" % stats["429"])
+    print("user lookups:    %d ok, %d failed %s" % (len(latencies), sum(failures.values()), dict(failures)))
+    if latencies:
+        latencies.sort()
+        print("lookup latency:  p50 %.2fs  p99 %.2fs  max %.2fs" % (
+            statistics.median(latencies), latencies[int(len(latencies) * 0.99)], latencies[-1]))
+    throttled = {k: int(v) for k, v in lb.THROTTLED._values.items()}
+    print("throttled:       %s" % (throttled or "-"))
+    if not lookups:
+        print("no user lookups completed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# bench_writes.py
+# Admin ommaviy kiritishi: har bir yozuv alohida API chaqiruvi vs SheetWriter batch'lari.
+#
+#   python benchmarks/bench_writes.py [--latency 0.3] [--ops 200]
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sheets import RowIndex, SheetsRepository, SheetWriter  # noqa: E402
+from benchmarks.fakes import FakeWorksheet  # noqa: E402
+
+CLIENT_HEADER = ["id", "party", "mesta", "kub", "kg", "destination", "date", "image"]
+
+
+def make_ops(n):
+    # mostly new clients, plus a few corrections of the same cell and some deletes
+    ops = [("append", str(i)) for i in range(n)]
+    ops += [("update", str(i % 10)) for i in range(n // 4)]
+    ops += [("delete", str(i)) for i in range(0, n, 10)]
+    return ops
+
+
+async def per_call(ws, ops):
+    repo = SheetsRepository(max_workers=4)
+    index = RowIndex()
+    index.rebuild([])
+    for kind, key in ops:
+        async with repo.lock(ws):
+            if kind == "append":
+                await repo.call(ws.append_row, [key, "PP1", 1, 1, 1, "Toshkent", "2024-01-01", ""])
+                index.appended(key, len(index._keys) + index.first_row)
+            elif kind == "update":
+                await repo.call(ws.update_cell, index.get(key), 2, "PP2")
+            else:
+                row = index.get(key)
+                await repo.call(ws.delete_rows, row)
+                index.deleted(row)
+    repo.shutdown()
+
+
+async def batched(ws, ops, window):
+    repo = SheetsRepository(max_workers=4)
+    index = RowIndex()
+    index.rebuild([])
+    writer = SheetWriter(repo, ws, index, "id", window=window)
+    tasks = []
+    for kind, key in ops:
+        if kind == "append":
+            coro = writer.append(key, [key, "PP1", 1, 1, 1, "Toshkent", "2024-01-01", ""])
+        elif kind == "update":
+            coro = writer.update(key, 2, "PP2")
+        else:
+            coro = writer.delete(key)
+        tasks.append(asyncio.create_task(coro))
+        await asyncio.sleep(0.001)  # admins typing fast, not all at once
+    await asyncio.gather(*tasks)
+    await writer.stop()
+    repo.shutdown()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--latency", type=float, default=0.3, help="simulated Sheets call latency, s")
+    ap.add_argument("--ops", type=int, default=200)
+    ap.add_argument("--window", type=float, default=0.3)
+    args = ap.parse_args()
+    ops = make_ops(args.ops)
+
+    for name in ("per-call", "batched"):
+        ws = FakeWorksheet("clients", CLIENT_HEADER, latency=args.latency)
+        start = time.perf_counter()
+        if name == "per-call":
+            asyncio.run(per_call(ws, ops))
+        else:
+            asyncio.run(batched(ws, ops, args.window))
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:8}  ops={len(ops)}  time={elapsed:7.2f}s  throughput={len(ops) / elapsed:8.1f} ops/s  "
+            f"api_calls={sum(ws.calls.values())}  rows_left={len(ws._values) - 1}"
+        )
+
+
+if __name__ == "__main__":
+    main()
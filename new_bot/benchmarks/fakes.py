@@ -0,0 +1,255 @@
+# fakes.py
+# Benchmarklar uchun xotiradagi soxta gspread worksheet va soxta Telegram Bot API serveri.
+# Har bir Sheets chaqiruvi haqiqiy Sheets kabi `latency` soniya davomida bloklaydi va
+# `error_rate` ehtimol bilan kvota xatosi (429) beradi.
+
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+
+import requests
+from gspread.exceptions import APIError
+from gspread.utils import a1_to_rowcol
+
+
+def quota_error() -> APIError:
+    """The APIError gspread raises when the per-minute quota is used up."""
+    response = requests.Response()
+    response.status_code = 429
+    response._content = json.dumps({"error": {
+        "code": 429, "status": "RESOURCE_EXHAUSTED",
+        "message": "Quota exceeded for quota metric 'Read requests' of service 'sheets.googleapis.com'",
+    }}).encode()
+    return APIError(response)
+
+
+def _cell_text(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return "" if value is None else str(value)
+
+
+class FakeWorksheet:
+    """Minimal in-memory stand-in for gspread.Worksheet."""
+
+    def __init__(self, title, header, rows=(), latency=0.0, sheet_id=0, error_rate=0.0, seed=0):
+        self.title = title
+        self.id = sheet_id
+        self.spreadsheet = _FakeSpreadsheet(self)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.errors = Counter()
+        self._random = random.Random(seed)
+        self._values = [list(header)] + [list(r) for r in rows]
+        self._lock = threading.Lock()
+
+    def _api(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors[name] += 1
+            raise quota_error()
+
+    def get_all_records(self):
+        self._api("get_all_records")
+        with self._lock:
+            header = self._values[0]
+            return [dict(zip(header, row)) for row in self._values[1:]]
+
+    def get_all_values(self):
+        self._api("get_all_values")
+        with self._lock:
+            # the API returns cell text, every row padded to the widest one
+            width = max((len(row) for row in self._values), default=0)
+            return [[_cell_text(v) for v in row] + [""] * (width - len(row)) for row in self._values]
+
+    def row_values(self, row):
+        self._api("row_values")
+        with self._lock:
+            return list(self._values[row - 1]) if row <= len(self._values) else []
+
+    def clear(self):
+        self._api("clear")
+        with self._lock:
+            self._values = []
+
+    def append_row(self, values, **kwargs):
+        self._api("append_row")
+        with self._lock:
+            self._values.append(list(values))
+            row = len(self._values)
+        # same shape as the Sheets API values.append response
+        return {"updates": {"updatedRange": f"{self.title}!A{row}:H{row}"}}
+
+    def append_rows(self, values, **kwargs):
+        self._api("append_rows")
+        with self._lock:
+            first = len(self._values) + 1
+            self._values.extend(list(v) for v in values)
+            last = len(self._values)
+        return {"updates": {"updatedRange": f"{self.title}!A{first}:H{last}"}}
+
+    def batch_update(self, data, **kwargs):
+        self._api("batch_update")
+        with self._lock:
+            for item in data:
+                row, col = a1_to_rowcol(item["range"].split(":")[0])
+                for r, line in enumerate(item["values"]):
+                    for c, value in enumerate(line):
+                        self._set(row + r, col + c, value)
+
+    def delete_rows(self, start_index, end_index=None):
+        self._api("delete_rows")
+        end_index = end_index or start_index
+        with self._lock:
+            del self._values[start_index - 1:end_index]
+
+    def update(self, values, range_name="A1", **kwargs):
+        self._api("update")
+        row, col = a1_to_rowcol(range_name.split(":")[0])
+        with self._lock:
+            for r, line in enumerate(values):
+                for c, value in enumerate(line):
+                    self._set(row + r, col + c, value)
+
+    def update_cell(self, row, col, value):
+        self._api("update_cell")
+        with self._lock:
+            self._set(row, col, value)
+
+    def _set(self, row, col, value):
+        line = self._values[row - 1]
+        line.extend([""] * (col - len(line)))
+        line[col - 1] = value
+
+
+class _FakeSpreadsheet:
+    """Only what SheetWriter uses: structural batch_update with deleteDimension."""
+
+    def __init__(self, ws):
+        self._ws = ws
+
+    def batch_update(self, body):
+        ws = self._ws
+        ws._api("spreadsheet.batch_update")
+        with ws._lock:
+            for req in body["requests"]:
+                rng = req["deleteDimension"]["range"]
+                del ws._values[rng["startIndex"]:rng["endIndex"]]
+
+
+class FakeSpreadsheet:
+    """Stand-in for gspread.Spreadsheet holding the bot's two worksheets."""
+
+    def __init__(self, parties=(), clients=(), latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.modified = "2024-01-01T00:00:00.000Z"
+        self.worksheets = {
+            "parties": FakeWorksheet("parties", ["code", "status"], parties, latency, sheet_id=1,
+                                     error_rate=error_rate, seed=1),
+            "clients": FakeWorksheet("clients", ["id", "party", "mesta", "kub", "kg", "destination", "date", "image",
+                                                 "image_file_id"],
+                                     clients, latency, sheet_id=2, error_rate=error_rate, seed=2),
+        }
+
+    def calls(self) -> Counter:
+        """API calls so far, summed over both worksheets."""
+        total = Counter()
+        for ws in self.worksheets.values():
+            total.update(ws.calls)
+        return total
+
+    def worksheet(self, title):
+        return self.worksheets[title]
+
+    def add_worksheet(self, title, rows, cols):
+        raise RuntimeError("worksheet %s already exists" % title)
+
+    def get_lastUpdateTime(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.modified
+
+
+def install_fake_google(spreadsheet):
+    """Make logistic_bot.connect_sheets() open `spreadsheet` instead of calling Google.
+
+    `spreadsheet` may also be a dict of URL -> FakeSpreadsheet, one per branch.
+    Call before importing logistic_bot; also sets the env vars it requires.
+    """
+    import os
+    import types
+
+    import gspread
+    from google.oauth2 import service_account
+
+    os.environ.setdefault("BOT_TOKEN", "123456:FAKE-TOKEN")
+    os.environ.setdefault("SPREADSHEET_URL", "https://docs.google.com/spreadsheets/d/fake")
+    os.environ.setdefault("GOOGLE_CREDENTIALS", '{"type": "service_account"}')
+    service_account.Credentials.from_service_account_info = staticmethod(lambda info, scopes=None: None)
+    open_by_url = spreadsheet.__getitem__ if isinstance(spreadsheet, dict) else (lambda url: spreadsheet)
+    gspread.authorize = lambda creds: types.SimpleNamespace(open_by_url=open_by_url)
+
+
+class FakeBotAPI:
+    """A local HTTP server speaking enough of the Bot API for the bot's handlers.
+
+    Point the bot at it with TELEGRAM_API_URL=<base_url>. Every request waits
+    `latency` seconds and is counted per method; sent messages get increasing
+    ids and echo their chat and text, which is all the handlers look at.
+    """
+
+    def __init__(self, token: str, latency: float = 0.0, port: int = 0):
+        self.token = token
+        self.latency = latency
+        self.port = port
+        self.calls = Counter()
+        self.base_url = ""
+        self._ids = itertools.count(1)
+        self._runner = None
+
+    async def start(self) -> str:
+        from aiohttp import web
+
+        app = web.Application(client_max_size=20 * 1024 ** 2)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = "http://127.0.0.1:%d" % port
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request):
+        import asyncio
+
+        from aiohttp import web
+
+        method = request.match_info["method"]
+        if request.match_info["token"] != self.token:
+            return web.json_response({"ok": False, "error_code": 401, "description": "Unauthorized"}, status=401)
+        params = await request.post()
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return {"id": int(self.token.split(":")[0]), "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        if method.startswith("send") or method.startswith("edit"):
+            chat_id = int(params.get("chat_id") or 0)
+            return {"message_id": int(params.get("message_id") or next(self._ids)), "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                    "text": params.get("text", "")}
+        return True
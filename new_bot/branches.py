@@ -0,0 +1,108 @@
+# branches.py
+# Bir nechta filial: har biri o'z Google Sheets jadvali (yoki bitta jadvaldagi o'z varaqlari) bilan.
+# Yangi partiya kod prefiksi bo'yicha filialga tushadi; filial adminlari faqat o'z filiali
+# ma'lumotlarini o'zgartira oladi. BRANCHES berilmasa — bitta jadval, avvalgidek.
+
+import json
+import os
+from typing import Dict, List, Optional
+
+
+class Branch:
+    """One shard of the data: where it is stored, which party codes go to it, who may edit it."""
+
+    __slots__ = ("name", "url", "parties_sheet", "clients_sheet", "prefixes", "admins", "sqlite_path")
+
+    def __init__(self, name: str, url: Optional[str], parties_sheet: str = "parties", clients_sheet: str = "clients",
+                 prefixes=(), admins=(), sqlite_path: str = ""):
+        self.name = name
+        self.url = url
+        self.parties_sheet = parties_sheet
+        self.clients_sheet = clients_sheet
+        self.prefixes = tuple(p.strip().upper() for p in prefixes if p.strip())
+        self.admins = frozenset(str(a).strip() for a in admins if str(a).strip())
+        self.sqlite_path = sqlite_path
+
+    def __repr__(self):
+        return "Branch(%r)" % self.name
+
+
+def _branch_sqlite_path(default_path: str, name: str) -> str:
+    root, ext = os.path.splitext(default_path)
+    return "%s-%s%s" % (root, name, ext or ".db")
+
+
+def parse_branches(value: str, default_url: Optional[str], default_sqlite_path: str) -> List[Branch]:
+    """Branches from the BRANCHES env var, a JSON list such as
+
+        [{"name": "toshkent", "url": "https://docs.google.com/...", "prefixes": ["PP", "TK"], "admins": "123,456"},
+         {"name": "samarqand", "prefixes": ["SM"], "parties_sheet": "parties_sm", "clients_sheet": "clients_sm"}]
+
+    "url" defaults to SPREADSHEET_URL, so branches may also be worksheet pairs of one spreadsheet.
+    Empty -> one unnamed branch with SPREADSHEET_URL: the single-spreadsheet setup.
+    Raises ValueError if the list is malformed or two branches would share a worksheet.
+    """
+    if not value.strip():
+        return [Branch("", default_url, sqlite_path=default_sqlite_path)]
+    try:
+        items = json.loads(value)
+    except json.JSONDecodeError as e:
+        raise ValueError("BRANCHES is not valid JSON: %s" % e) from e
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        raise ValueError("BRANCHES must be a non-empty JSON list of objects")
+    branches, names, sheets = [], set(), set()
+    for item in items:
+        name = str(item.get("name", "")).strip()
+        if not name or name in names:
+            raise ValueError("every branch needs a unique \"name\" (got %r)" % name)
+        admins = item.get("admins", ())
+        if isinstance(admins, str):
+            admins = admins.split(",")
+        prefixes = item.get("prefixes", ())
+        if isinstance(prefixes, str):
+            prefixes = prefixes.split(",")
+        branch = Branch(
+            name, item.get("url") or default_url,
+            parties_sheet=item.get("parties_sheet", "parties"), clients_sheet=item.get("clients_sheet", "clients"),
+            prefixes=prefixes, admins=admins,
+            sqlite_path=item.get("sqlite_path") or (
+                default_sqlite_path if len(items) == 1 else _branch_sqlite_path(default_sqlite_path, name)),
+        )
+        for sheet in ((branch.url, branch.parties_sheet), (branch.url, branch.clients_sheet)):
+            if sheet in sheets:
+                raise ValueError("branch %s: worksheet %s is already used by another branch" % (name, sheet[1]))
+            sheets.add(sheet)
+        names.add(name)
+        branches.append(branch)
+    return branches
+
+
+class BranchRouter:
+    """Which branch a new party code belongs to, and which branch an admin is limited to."""
+
+    def __init__(self, branches: List[Branch]):
+        self.branches: Dict[str, Branch] = {b.name: b for b in branches}
+        self.default = branches[0].name  # for codes no prefix matches
+        owners: Dict[str, str] = {}
+        for b in branches:
+            for prefix in b.prefixes:
+                if owners.setdefault(prefix, b.name) != b.name:
+                    raise ValueError("prefix %s is given to both %s and %s" % (prefix, owners[prefix], b.name))
+        # longest prefix first, so "PPX" wins over "PP"
+        self._prefixes = sorted(owners.items(), key=lambda item: -len(item[0]))
+        self._admins: Dict[str, str] = {}
+        for b in branches:
+            for admin in b.admins:
+                if self._admins.setdefault(admin, b.name) != b.name:
+                    raise ValueError("admin %s is listed in two branches" % admin)
+
+    def by_prefix(self, code: str) -> Optional[str]:
+        code = (code or "").strip().upper()
+        for prefix, name in self._prefixes:
+            if code.startswith(prefix):
+                return name
+        return None
+
+    def admin_branch(self, user_id) -> Optional[str]:
+        """Branch a branch admin is limited to; None for everyone else (ADMIN_IDS see all branches)."""
+        return self._admins.get(str(user_id))
@@ -0,0 +1,263 @@
+# eventlog.py
+# O'zgarishlar jurnali: status o'zgarishlari, mijoz/partiya qo'shish va o'chirish, kim qilgani.
+# Faqat oxiriga yoziladigan segment fayllarda saqlanadi va partiya/mijoz bo'yicha indekslanadi,
+# shuning uchun partiya tarixini ko'rsatish va xato o'chirishni qaytarish mumkin.
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("logistic-bot.eventlog")
+
+# record = length (4 bytes) + crc32 of the payload (4 bytes) + payload (compact JSON array)
+_HEADER = struct.Struct("<II")
+_SEGMENT_SUFFIX = ".seg"
+_OFFSET_BITS = 40  # position = segment number << 40 | byte offset
+
+
+class Event:
+    __slots__ = ("seq", "ts", "admin", "kind", "key", "party", "data")
+
+    def __init__(self, seq: int, ts: float, admin: Optional[int], kind: str, key: str, party: str, data: dict):
+        self.seq = seq
+        self.ts = ts
+        self.admin = admin  # Telegram id of the admin; None for edits made in the sheet itself
+        self.kind = kind  # party_add, party_status, party_delete, client_add, client_delete
+        self.key = key  # party code or client id
+        self.party = party  # the party it concerns (for client events: the client's party)
+        self.data = data  # what is needed to undo it: old/new status, the deleted client's fields, ...
+
+    def payload(self) -> bytes:
+        return json.dumps([self.seq, round(self.ts, 3), self.admin, self.kind, self.key, self.party, self.data],
+                          ensure_ascii=False, separators=(",", ":")).encode()
+
+    @classmethod
+    def from_payload(cls, payload: bytes) -> "Event":
+        return cls(*json.loads(payload))
+
+
+class EventLog:
+    """Append-only event log in segment files of at most `segment_bytes`
+    (also the limit for one record, so it must not shrink between runs).
+
+    The files are never rewritten. Only a record cut short by a crash
+    (short read or bad crc at the very end of the last segment) is cut off on start;
+    the cut bytes are kept next to the segment in a ``.torn`` file.
+    Damage anywhere else, or a gap in the sequence numbers, stops indexing there
+    and makes the log read-only: the intact prefix can still be read, but appends
+    raise, so nothing after the damage is overwritten or numbered twice.
+    In memory there is one 8-byte file position per event, plus per-party and
+    per-client lists of sequence numbers. Event bodies are read from disk when asked for.
+    All file work runs on one dedicated thread. Each append is flushed to the OS;
+    `fsync=True` also forces it to disk.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 4 * 1024 * 1024, fsync: bool = False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="eventlog")
+        self._positions = array("Q")  # seq - 1 -> position
+        self._by_party: Dict[str, array] = {}
+        self._by_client: Dict[str, array] = {}
+        self._segments: List[int] = []  # segment numbers, oldest first
+        self._fds: Dict[int, int] = {}  # read descriptors
+        self._out = None  # file object of the segment being written
+        self._out_size = 0
+        self._damage: Optional[str] = None  # why the log is read-only
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    @property
+    def last_seq(self) -> int:
+        return len(self._positions)
+
+    @property
+    def read_only(self) -> bool:
+        return self._damage is not None
+
+    async def start(self):
+        await self._run(self._open)
+        logger.info("Event log: %d events in %d segments", self.last_seq, len(self._segments))
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+    async def append(self, kind: str, key: str, party: str, data: dict, admin: Optional[int] = None) -> Event:
+        return (await self._run(self._append, [(kind, key, party, data)], admin))[0]
+
+    async def append_many(self, items: List[Tuple[str, str, str, dict]], admin: Optional[int] = None) -> List[Event]:
+        """Several (kind, key, party, data) events in one write."""
+        return await self._run(self._append, items, admin)
+
+    async def get(self, seq: int) -> Optional[Event]:
+        if not 1 <= seq <= self.last_seq:
+            return None
+        return (await self._run(self._read, [seq]))[0]
+
+    async def party_history(self, party: str, limit: int = 0) -> List[Event]:
+        """Last `limit` (0 = all) party_* events of a party, oldest first."""
+        return await self._history(self._by_party.get(party), limit)
+
+    async def client_history(self, cid: str, limit: int = 0) -> List[Event]:
+        return await self._history(self._by_client.get(cid), limit)
+
+    async def recent(self, limit: int) -> List[Event]:
+        first = max(1, self.last_seq - limit + 1)
+        return await self._run(self._read, range(first, self.last_seq + 1))
+
+    async def since(self, seq: int, limit: int) -> List[Event]:
+        """Events seq, seq+1, ... (at most `limit`), oldest first."""
+        last = min(self.last_seq, seq + limit - 1)
+        return await self._run(self._read, range(max(1, seq), last + 1))
+
+    async def _history(self, seqs: Optional[array], limit: int) -> List[Event]:
+        if not seqs:
+            return []
+        return await self._run(self._read, list(seqs[-limit:] if limit else seqs))
+
+    # ----- blocking helpers (run on the event log thread) -----
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, "%08d%s" % (number, _SEGMENT_SUFFIX))
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        numbers = sorted(int(name[:-len(_SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                         if name.endswith(_SEGMENT_SUFFIX) and name[:-len(_SEGMENT_SUFFIX)].isdigit())
+        for i, number in enumerate(numbers):
+            path = self._segment_path(number)
+            self._segments.append(number)
+            good_end, problem = self._scan(number)
+            if problem is None:
+                continue
+            if problem == "torn" and i == len(numbers) - 1:
+                self._set_aside(path, good_end)
+                break
+            # Not a crash mid-append: keep every byte for inspection and stop here, since
+            # appending after the damage would give new events numbers that already exist.
+            self._damage = "%s after byte %d: %s" % (path, good_end,
+                                                     "record cut short" if problem == "torn" else problem)
+            logger.error("Event log is read-only: %s; events after it are not indexed (%d segments skipped)",
+                         self._damage, len(numbers) - 1 - i)
+            return
+        if not self._segments:
+            self._segments.append(1)
+        self._out = open(self._segment_path(self._segments[-1]), "ab")
+        self._out_size = self._out.tell()
+
+    def _set_aside(self, path: str, good_end: int):
+        """Move the bytes after `good_end` to a .torn file and cut them off the segment.
+        A record cut short by a crash is garbage, but if the cut was misjudged the
+        events are still there to recover by hand."""
+        torn = "%s.%d-%d.torn" % (path, good_end, time.time())
+        with open(path, "r+b") as f:
+            f.seek(good_end)
+            tail = f.read()
+            with open(torn, "wb") as out:
+                out.write(tail)
+                out.flush()
+                os.fsync(out.fileno())
+            f.truncate(good_end)
+        logger.warning("Event log: partly written record at the end of %s moved to %s (%d bytes)",
+                       path, torn, len(tail))
+
+    def _scan(self, number: int) -> Tuple[int, Optional[str]]:
+        """Index every intact record of a segment. Returns where the intact part ends and
+        what stopped the scan there: None (end of file), "torn" (a record cut short at the
+        end of the file, as a crash mid-write leaves it) or a description of the damage."""
+        offset = 0
+        path = self._segment_path(number)
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(_HEADER.size)
+                if not header:
+                    return offset, None
+                if len(header) < _HEADER.size:
+                    return offset, "torn"
+                length, crc = _HEADER.unpack(header)
+                if length > self.segment_bytes:
+                    # no record is that long (see _append): the length itself is damaged
+                    return offset, "bad record length %d" % length
+                payload = f.read(length)
+                if len(payload) < length:
+                    return offset, "torn"
+                end = offset + _HEADER.size + length
+                if zlib.crc32(payload) != crc:
+                    return offset, "torn" if end == size else "bad checksum"
+                event = Event.from_payload(payload)
+                if event.seq != self.last_seq + 1:
+                    return offset, "expected event %d, found %d" % (self.last_seq + 1, event.seq)
+                self._index(event, number << _OFFSET_BITS | offset)
+                offset = end
+
+    def _index(self, event: Event, position: int):
+        self._positions.append(position)
+        index = self._by_party if event.kind.startswith("party_") else self._by_client
+        index.setdefault(event.key, array("I")).append(event.seq)
+
+    def _append(self, items, admin) -> List[Event]:
+        if self._out is None:
+            raise RuntimeError("event log is read-only: %s" % self._damage if self._damage
+                               else "event log is not open")
+        now = time.time()
+        events = [Event(self.last_seq + 1 + i, now, admin, kind, key, party, data)
+                  for i, (kind, key, party, data) in enumerate(items)]
+        payloads = [event.payload() for event in events]
+        # _scan takes a longer record for a damaged length field, so none may be written
+        if any(_HEADER.size + len(payload) > self.segment_bytes for payload in payloads):
+            raise ValueError("event larger than a %d-byte segment" % self.segment_bytes)
+        for event, payload in zip(events, payloads):
+            if self._out_size and self._out_size + _HEADER.size + len(payload) > self.segment_bytes:
+                self._rotate(event.seq)
+            position = self._segments[-1] << _OFFSET_BITS | self._out_size
+            self._out.write(_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._out_size += _HEADER.size + len(payload)
+            self._index(event, position)
+        # one flush for the whole batch: a bulk import is not a write per row
+        self._out.flush()
+        if self.fsync:
+            os.fsync(self._out.fileno())
+        return events
+
+    def _rotate(self, first_seq: int):
+        self._out.flush()
+        if self.fsync:
+            os.fsync(self._out.fileno())
+        self._out.close()
+        self._segments.append(first_seq)
+        self._out = open(self._segment_path(first_seq), "ab")
+        self._out_size = 0
+
+    def _read(self, seqs) -> List[Event]:
+        events = []
+        for seq in seqs:
+            position = self._positions[seq - 1]
+            number, offset = position >> _OFFSET_BITS, position & ((1 << _OFFSET_BITS) - 1)
+            fd = self._fds.get(number)
+            if fd is None:
+                fd = self._fds[number] = os.open(self._segment_path(number), os.O_RDONLY)
+            length, _ = _HEADER.unpack(os.pread(fd, _HEADER.size, offset))
+            events.append(Event.from_payload(os.pread(fd, length, offset + _HEADER.size)))
+        return events
+
+    def _close(self):
+        if self._out is not None:
+            self._out.flush()
+            os.fsync(self._out.fileno())
+            self._out.close()
+            self._out = None
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
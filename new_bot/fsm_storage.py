@@ -0,0 +1,110 @@
+# fsm_storage.py
+# FSM holatlari uchun SQLite storage: bot qayta ishga tushganda ham yarim qolgan
+# "Mijoz qo'shish" kabi suhbatlar yo'qolmaydi.
+
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key     TEXT PRIMARY KEY,
+    state   TEXT,
+    data    TEXT NOT NULL DEFAULT '{}',
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fsm_updated ON fsm(updated);
+"""
+
+
+class SQLiteFSMStorage(BaseStorage):
+    """aiogram FSM storage in a SQLite file.
+
+    Every call is one indexed statement on a dedicated thread (WAL journal,
+    synchronous=NORMAL), so a step of a conversation costs well under a
+    millisecond and survives restarts. Several bot processes on one host can
+    share the file, since nothing is cached in memory.
+    Conversations untouched for `ttl` seconds count as expired. Expired rows are
+    skipped on read and deleted at most once per `gc_interval`.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400.0, gc_interval: float = 600.0,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.path = path
+        self.ttl = ttl
+        self.gc_interval = gc_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm")
+        self._db: Optional[sqlite3.Connection] = None
+        self._last_gc = 0.0
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA busy_timeout=5000")
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    # ----- BaseStorage -----
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._run(self._write, self.key_builder.build(key), "state", value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await self._run(self._read, self.key_builder.build(key))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._run(self._write, self.key_builder.build(key), "data", json.dumps(data, ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await self._run(self._read, self.key_builder.build(key))
+        return json.loads(row[1]) if row else {}
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=False)
+
+    # ----- blocking helpers (run on the FSM thread) -----
+    def _read(self, key: str):
+        cutoff = time.time() - self.ttl
+        return self._conn().execute(
+            "SELECT state, data FROM fsm WHERE key = ? AND updated >= ?", (key, cutoff)).fetchone()
+
+    def _write(self, key: str, column: str, value):
+        db = self._conn()
+        now = time.time()
+        cutoff = now - self.ttl
+        # the column not being written is reset if the row had already expired,
+        # so an old conversation's leftovers never come back to life
+        if column == "state":
+            db.execute("INSERT INTO fsm(key, state, updated) VALUES (?, ?, ?) "
+                       "ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated = excluded.updated, "
+                       "data = CASE WHEN fsm.updated < ? THEN '{}' ELSE fsm.data END",
+                       (key, value, now, cutoff))
+        else:
+            db.execute("INSERT INTO fsm(key, data, updated) VALUES (?, ?, ?) "
+                       "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated = excluded.updated, "
+                       "state = CASE WHEN fsm.updated < ? THEN NULL ELSE fsm.state END",
+                       (key, value, now, cutoff))
+        # a finished conversation (state cleared, no data) needs no row at all
+        db.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+        if now - self._last_gc >= self.gc_interval:
+            self._last_gc = now
+            db.execute("DELETE FROM fsm WHERE updated < ?", (cutoff,))
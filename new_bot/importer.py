@@ -0,0 +1,114 @@
+# importer.py
+# Mijozlarni CSV/XLSX fayldan ommaviy import qilish.
+# Fayl qatorma-qator o'qiladi va tekshiriladi; yaroqli qatorlar bitta paketda yoziladi.
+
+import csv
+import datetime
+from typing import Container, Iterator, List, Sequence, Tuple
+
+from records import CLIENT_COLUMNS, to_number
+
+NUMBER_COLUMNS = ("mesta", "kub", "kg")
+REQUIRED_COLUMNS = ("id", "party")
+
+
+class ImportFormatError(Exception):
+    """The file as a whole can't be imported (wrong type, no header, too many rows)."""
+
+
+class ImportResult:
+    __slots__ = ("accepted", "rejected")
+
+    def __init__(self):
+        self.accepted: List[Tuple[str, dict]] = []  # (client id, record)
+        self.rejected: List[Tuple[int, str]] = []  # (line number in the file, reason)
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, datetime.date):
+        return value.strftime("%d.%m.%Y")
+    return str(value).strip()
+
+
+def _is_number(text: str) -> bool:
+    return isinstance(to_number(text), float)
+
+
+def iter_csv(path: str) -> Iterator[Sequence]:
+    # Excel saves CSV as cp1251 with ";" on Russian/Uzbek Windows, as UTF-8 with "," elsewhere
+    with open(path, "rb") as f:
+        head = f.read(64 * 1024)
+    try:
+        head.decode("utf-8")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # a multi-byte character cut at the end of the sample is still UTF-8
+        encoding = "utf-8-sig" if e.start >= len(head) - 3 else "cp1251"
+    first_line = head.decode(encoding, errors="ignore").splitlines()[0] if head else ""
+    delimiter = ";" if first_line.count(";") > first_line.count(",") else ","
+    with open(path, encoding=encoding, newline="") as f:
+        yield from csv.reader(f, delimiter=delimiter)
+
+
+def iter_xlsx(path: str) -> Iterator[Sequence]:
+    from openpyxl import load_workbook  # here, so CSV imports don't pay for loading it
+    # read_only streams rows from the zip instead of loading the whole workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def read_clients(path: str, existing: Container[str], max_rows: int = 5000) -> ImportResult:
+    """Validate a client table row by row.
+
+    The first non-empty row is the header and must name at least the `id` and
+    `party` columns (any order, any case; unknown columns are ignored). A row is
+    rejected if its id is empty, already in `existing` or repeated in the file,
+    its party is empty, or mesta/kub/kg is not a number. Runs in a worker thread.
+    """
+    rows = iter_xlsx(path) if path.lower().endswith(".xlsx") else iter_csv(path)
+    result = ImportResult()
+    positions = None
+    seen = set()
+    for line, raw in enumerate(rows, start=1):
+        values = [_cell(v) for v in raw]
+        if not any(values):
+            continue
+        if positions is None:
+            names = [v.lower() for v in values]
+            missing = [col for col in REQUIRED_COLUMNS if col not in names]
+            if missing:
+                raise ImportFormatError(
+                    "Birinchi qatorda ustun nomlari bo'lishi kerak: " + ", ".join(CLIENT_COLUMNS))
+            positions = {col: names.index(col) for col in CLIENT_COLUMNS if col in names}
+            continue
+        if len(result.accepted) + len(result.rejected) >= max_rows:
+            raise ImportFormatError(f"Faylda {max_rows} tadan ko'p qator bor. Faylni bo'lib yuboring.")
+        row = {col: values[i] if i < len(values) else "" for col, i in positions.items()}
+        cid = row.pop("id")
+        if not cid:
+            result.rejected.append((line, "ID bo'sh"))
+        elif cid in existing:
+            result.rejected.append((line, f"{cid}: bunday ID allaqachon mavjud"))
+        elif cid in seen:
+            result.rejected.append((line, f"{cid}: ID faylda takrorlangan"))
+        elif not row.get("party"):
+            result.rejected.append((line, f"{cid}: partiya ko'rsatilmagan"))
+        else:
+            bad = [col for col in NUMBER_COLUMNS if row.get(col) and not _is_number(row[col])]
+            if bad:
+                result.rejected.append((line, f"{cid}: son emas: {', '.join(bad)}"))
+            else:
+                seen.add(cid)
+                result.accepted.append((cid, row))
+    if positions is None:
+        raise ImportFormatError("Fayl bo'sh.")
+    return result
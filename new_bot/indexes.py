@@ -0,0 +1,284 @@
+# indexes.py
+# Xotiradagi kesh ustidan qo'shimcha indekslar.
+# Har bir indeks mijoz qo'shilganda/o'chirilganda bosqichma-bosqich yangilanadi,
+# shuning uchun so'rovlar butun `clients` lug'atini aylanib chiqmaydi.
+
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from records import Client
+
+
+def _amount(value) -> float:
+    # records hold parsed floats; an empty or non-numeric cell adds nothing
+    return value if isinstance(value, float) else 0.0
+
+
+class Totals:
+    __slots__ = ("clients", "mesta", "kub", "kg")
+
+    def __init__(self):
+        self.clients = 0
+        self.mesta = 0.0
+        self.kub = 0.0
+        self.kg = 0.0
+
+    def add(self, other: "Totals"):
+        self.clients += other.clients
+        self.mesta += other.mesta
+        self.kub += other.kub
+        self.kg += other.kg
+
+
+def _apply(table: Dict[str, Totals], key: str, clients: int, mesta: float, kub: float, kg: float):
+    totals = table.get(key)
+    if totals is None:
+        totals = table[key] = Totals()
+    totals.clients += clients
+    totals.mesta += mesta
+    totals.kub += kub
+    totals.kg += kg
+    if totals.clients == 0:
+        # drop the entry so float rounding leftovers don't accumulate
+        del table[key]
+
+
+class PartyIndex:
+    """party code -> client ids, plus per-party totals of mesta/kub/kg.
+
+    Each client's contribution is remembered, so replacing or removing a client
+    only subtracts what it added; no request ever scans all clients.
+    """
+
+    def __init__(self):
+        self._members: Dict[str, Set[str]] = {}
+        self._totals: Dict[str, Totals] = {}
+        self._contrib: Dict[str, Tuple[str, float, float, float]] = {}
+
+    def add(self, cid: str, record: Client):
+        self.remove(cid)
+        contrib = (record.party, _amount(record.mesta), _amount(record.kub), _amount(record.kg))
+        self._contrib[cid] = contrib
+        self._members.setdefault(record.party, set()).add(cid)
+        _apply(self._totals, record.party, 1, *contrib[1:])
+
+    def remove(self, cid: str):
+        contrib = self._contrib.pop(cid, None)
+        if contrib is None:
+            return
+        party, mesta, kub, kg = contrib
+        members = self._members.get(party)
+        if members is not None:
+            members.discard(cid)
+            if not members:
+                del self._members[party]
+        _apply(self._totals, party, -1, -mesta, -kub, -kg)
+
+    def clients_of(self, party: str) -> Set[str]:
+        return self._members.get(party, set())
+
+    def summary(self, party: str) -> Optional[Totals]:
+        return self._totals.get(party)
+
+
+_DAY_FIRST = re.compile(r"(\d{1,2})[./-](\d{1,2})[./-](\d{4})")
+_YEAR_FIRST = re.compile(r"(\d{4})[./-](\d{1,2})")
+
+
+def month_of(date: str) -> str:
+    """"05.03.2024", "5/3/2024" or "2024-03-05" -> "2024-03"; "" if there is no month in it."""
+    match = _DAY_FIRST.search(date)
+    if match:
+        year, month = match.group(3), int(match.group(2))
+    else:
+        match = _YEAR_FIRST.search(date)
+        if not match:
+            return ""
+        year, month = match.group(1), int(match.group(2))
+    return "%s-%02d" % (year, month) if 1 <= month <= 12 else ""
+
+
+class StatsIndex:
+    """Client totals per party status, destination and month, for the admin statistics.
+
+    Kept up to date client by client like PartyIndex. Status totals also
+    depend on the party: a status change moves that party's whole total from
+    the old status to the new one in one step. Clients of a party that is not
+    in the parties table count under `unknown_status`.
+    """
+
+    def __init__(self, unknown_status: str):
+        self.unknown_status = unknown_status
+        self.by_status: Dict[str, Totals] = {}
+        self.by_destination: Dict[str, Totals] = {}
+        self.by_month: Dict[str, Totals] = {}  # "2024-03"; "" for rows without a usable date
+        self._by_party: Dict[str, Totals] = {}
+        self._party_status: Dict[str, str] = {}
+        self._contrib: Dict[str, Tuple[str, str, str, float, float, float]] = {}
+
+    def add_client(self, cid: str, record: Client):
+        self.remove_client(cid)
+        contrib = (record.party, record.destination, month_of(record.date),
+                   _amount(record.mesta), _amount(record.kub), _amount(record.kg))
+        self._contrib[cid] = contrib
+        self._apply(contrib, 1)
+
+    def remove_client(self, cid: str):
+        contrib = self._contrib.pop(cid, None)
+        if contrib is not None:
+            self._apply(contrib, -1)
+
+    def set_party(self, code: str, status: str):
+        self._move_party(code, status)
+        self._party_status[code] = status
+
+    def remove_party(self, code: str):
+        self._move_party(code, self.unknown_status)
+        self._party_status.pop(code, None)
+
+    def total(self) -> Totals:
+        total = Totals()
+        for totals in self.by_status.values():
+            total.add(totals)
+        return total
+
+    def months(self, first: str = "", last: str = "9999-12") -> Totals:
+        """Sum over the months first..last ("2024-01".."2024-03"); cost grows with months, not clients."""
+        total = Totals()
+        for month, totals in self.by_month.items():
+            if month and first <= month <= last:
+                total.add(totals)
+        return total
+
+    def _status(self, party: str) -> str:
+        return self._party_status.get(party, self.unknown_status)
+
+    def _move_party(self, code: str, status: str):
+        old = self._status(code)
+        totals = self._by_party.get(code)
+        if totals is None or old == status:
+            return
+        _apply(self.by_status, old, -totals.clients, -totals.mesta, -totals.kub, -totals.kg)
+        _apply(self.by_status, status, totals.clients, totals.mesta, totals.kub, totals.kg)
+
+    def _apply(self, contrib, sign: int):
+        party, destination, month, mesta, kub, kg = contrib
+        amounts = (sign, sign * mesta, sign * kub, sign * kg)
+        _apply(self._by_party, party, *amounts)
+        _apply(self.by_status, self._status(party), *amounts)
+        _apply(self.by_destination, destination, *amounts)
+        _apply(self.by_month, month, *amounts)
+
+
+# Cyrillic letters that look like Latin ones on a phone keyboard ("РР111" -> "pp111")
+_LOOKALIKES = str.maketrans("авекмнорстухіјѕ", "abekmhopctyxijs")
+
+
+def normalize_key(text: str) -> str:
+    """Search form of a party code / client id: NFKC, no whitespace, lower case,
+    Cyrillic look-alikes replaced by Latin letters."""
+    text = unicodedata.normalize("NFKC", str(text))
+    return "".join(text.split()).casefold().translate(_LOOKALIKES)
+
+
+def _trigrams(norm: str) -> Set[str]:
+    padded = "^" + norm + "$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Normalized-key and trigram index over the keys of one cached dict.
+
+    `find` resolves "pp111" or "1111 " to the stored key with one dict lookup.
+    `suggest` ranks keys by shared trigrams; the query's first trigram carries
+    the "^" boundary, so keys starting with the query share all of its grams
+    and are found the same way (prefix search). The best few are reordered by
+    edit distance. Grams common to more than `max_posting` keys are skipped
+    while rarer ones exist. `add`/`remove` keep the index current key by key;
+    benchmarks/bench_search.py measures it at 100k keys.
+    """
+
+    def __init__(self, max_posting: int = 2000):
+        self.max_posting = max_posting
+        self._keys: Dict[str, Set[str]] = {}  # normalized -> original keys
+        self._grams: Dict[str, Set[str]] = {}  # trigram -> normalized keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key: str):
+        norm = normalize_key(key)
+        originals = self._keys.get(norm)
+        if originals is None:
+            self._keys[norm] = {key}
+            for gram in _trigrams(norm):
+                self._grams.setdefault(gram, set()).add(norm)
+        else:
+            originals.add(key)
+
+    def remove(self, key: str):
+        norm = normalize_key(key)
+        originals = self._keys.get(norm)
+        if originals is None:
+            return
+        originals.discard(key)
+        if originals:
+            return
+        del self._keys[norm]
+        for gram in _trigrams(norm):
+            posting = self._grams.get(gram)
+            if posting is not None:
+                posting.discard(norm)
+                if not posting:
+                    del self._grams[gram]
+
+    def find(self, text: str) -> Optional[str]:
+        """The stored key `text` normalizes to, if exactly one key does."""
+        originals = self._keys.get(normalize_key(text))
+        if originals and len(originals) == 1:
+            return next(iter(originals))
+        return None
+
+    def suggest(self, text: str, limit: int = 5, min_score: float = 0.3) -> List[str]:
+        """Up to `limit` stored keys most similar to `text`, best first: keys
+        starting with it, then by edit distance among the best trigram matches."""
+        norm = normalize_key(text)
+        if not norm:
+            return []
+        grams = _trigrams(norm)
+        postings = sorted((self._grams.get(g, frozenset()) for g in grams), key=len)
+        used = [p for p in postings if len(p) <= self.max_posting] or postings[:1]
+        # grams skipped as too common may be shared too, so they lower the bar
+        need = max(1, min(len(used), int(min_score * len(grams) + 0.999) - (len(postings) - len(used))))
+        # A key sharing `need` of the used grams is in at least one of the
+        # len(used) - need + 1 rarest postings: count those, then only add
+        # the other grams for keys already seen (set intersections run in C).
+        split = len(used) - need + 1
+        counts = Counter()
+        for posting in used[:split]:
+            counts.update(posting)
+        if split < len(used):
+            seen = set(counts)
+            for posting in used[split:]:
+                counts.update(seen & posting)
+        shortlist = [cand for cand, n in counts.most_common(limit * 2) if n >= need]
+        ranked = sorted(shortlist, key=lambda cand: (not cand.startswith(norm), edit_distance(norm, cand), cand))
+        out: List[str] = []
+        for cand in ranked:
+            out.extend(sorted(self._keys[cand]))
+            if len(out) >= limit:
+                break
+        return out[:limit]
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance (insert/delete/replace one character = 1)."""
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
@@ -6,17 +6,39 @@ import os
 import json
 import asyncio
 import logging
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from typing import Dict, Any
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional
 
 import gspread
+from aiohttp import web
 from google.oauth2.service_account import Credentials
 
 from aiogram import Bot, Dispatcher, F, types
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import (
+    ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+)
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
+
+from branches import Branch, BranchRouter, parse_branches
+from eventlog import EventLog
+from fsm_storage import SQLiteFSMStorage
+from importer import ImportFormatError, read_clients
+from indexes import PartyIndex, SearchIndex, StatsIndex, Totals, month_of
+from metrics import REGISTRY
+from notify import Broadcaster, NotificationStore
+from paging import PagedList, export_csv
+from sheets import SheetsRepository
+from records import CLIENT_COLUMNS, PARTY_COLUMNS, Client, Party, client_record, client_row, format_number
+from storage import RowNotFound, SheetsMirror, SheetsStorage, SQLiteStorage, Storage
+from throttle import Buckets, SendScheduler, ThrottlingMiddleware
 
 # ---------- Logging ----------
 logging.basicConfig(level=logging.INFO)
@@ -28,18 +50,83 @@ BOT_TOKEN = os.getenv("BOT_TOKEN") or ""
 ADMIN_IDS_ENV = os.getenv("ADMIN_IDS", "").strip()  # e.g. "12345,67890"
 SPREADSHEET_URL = os.getenv("SPREADSHEET_URL") or os.getenv("API_URL")  # prefer SPREADSHEET_URL, fallback API_URL
 GOOGLE_CREDENTIALS = os.getenv("GOOGLE_CREDENTIALS")  # one-line JSON with \\n in private_key
+SHEETS_WORKERS = int(os.getenv("SHEETS_WORKERS", "4"))  # max parallel Google Sheets calls
+SHEETS_TIMEOUT = float(os.getenv("SHEETS_TIMEOUT", "30"))  # seconds before a Sheets call is abandoned
+RELOAD_INTERVAL = int(os.getenv("RELOAD_INTERVAL", "60"))  # full reconciliation with Sheets, seconds
+SHEETS_WRITE_WINDOW = float(os.getenv("SHEETS_WRITE_WINDOW", "0.3"))  # seconds to collect writes into one batch
+# "sheets": Google Sheets is the database (default).
+# "sqlite": local SQLite file is the database, Sheets (if configured) is a replicated export.
+# Use sqlite only with a persistent disk (Render: attach a Disk and point SQLITE_PATH at it).
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sheets").strip().lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "logistic_bot.db")
+# Where half-finished conversations (e.g. "Mijoz qo'shish") are kept:
+# "sqlite" (default, survives restarts), "memory", or a redis:// URL for several bot instances.
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").strip()
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", "fsm_states.db")
+FSM_TTL = int(os.getenv("FSM_TTL", "86400"))  # seconds before an abandoned conversation expires
+# Webhook mode: set WEBHOOK_URL to the public base URL (e.g. https://logistic-bot.onrender.com)
+# and Telegram will POST updates to WEBHOOK_URL + WEBHOOK_PATH. Without it the bot long-polls.
+WEBHOOK_URL = (os.getenv("WEBHOOK_URL") or "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None  # checked against X-Telegram-Bot-Api-Secret-Token
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))  # updates handled concurrently in webhook mode
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))  # beyond this Telegram is told to retry later
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "5000"))  # rows accepted in one uploaded client file
+# Status change notifications: subscriptions and not yet sent messages live in this file
+NOTIFY_DB_PATH = os.getenv("NOTIFY_DB_PATH", "notifications.db")
+NOTIFY_RATE = float(os.getenv("NOTIFY_RATE", "20"))  # messages per second, leaving room for replies
+# Flood control: each user may send THROTTLE_RATE messages/buttons per second on average,
+# THROTTLE_BURST in a row; 0 turns the limit off. TELEGRAM_RATE caps all outgoing messages.
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "5"))
+TELEGRAM_RATE = float(os.getenv("TELEGRAM_RATE", "30"))
+# A self-hosted Bot API server (or the benchmarks' fake one) instead of api.telegram.org
+TELEGRAM_API_URL = (os.getenv("TELEGRAM_API_URL") or "").rstrip("/")
+# Several branches, each with its own spreadsheet or worksheet pair, as a JSON list (see branches.py):
+# new parties go to a branch by code prefix, branch admins edit only their branch. Unset: one spreadsheet.
+BRANCHES_ENV = os.getenv("BRANCHES", "").strip()
+# Audit log of status changes, adds and deletes (who and when): append-only files in this
+# directory. Keep it on a persistent disk, like SQLITE_PATH.
+EVENTLOG_DIR = os.getenv("EVENTLOG_DIR", "eventlog")
+TZ_OFFSET = float(os.getenv("TZ_OFFSET", "5"))  # hours from UTC for times shown in messages (Toshkent: +5)
 
 if not BOT_TOKEN:
     logger.error("BOT_TOKEN environment variable topilmadi. Iltimos BOT_TOKEN ni qo'ying.")
     raise SystemExit("BOT_TOKEN environment variable required")
 
-if not (SPREADSHEET_URL):
+if STORAGE_BACKEND not in ("sheets", "sqlite"):
+    raise SystemExit("STORAGE_BACKEND must be 'sheets' or 'sqlite'")
+
+try:
+    BRANCHES = parse_branches(BRANCHES_ENV, SPREADSHEET_URL, SQLITE_PATH)
+    router = BranchRouter(BRANCHES)
+except ValueError as e:
+    raise SystemExit("BRANCHES: %s" % e)
+
+if STORAGE_BACKEND == "sheets" and not all(b.url for b in BRANCHES):
     logger.error("SPREADSHEET_URL (yoki API_URL) environment variable topilmadi.")
     raise SystemExit("SPREADSHEET_URL (or API_URL) environment variable required")
 
-# Parse admin ids into set of strings for comparison
+# Parse admin ids into set of strings for comparison; these admins see every branch
 ADMIN_IDS = {s.strip() for s in ADMIN_IDS_ENV.split(",") if s.strip()}
 
+# ---------- Metrics ----------
+# Exposed in Prometheus text format on GET /metrics (Sheets call metrics live in sheets.py).
+HANDLER_LATENCY = REGISTRY.histogram("bot_handler_duration_seconds", "Time spent in a handler", ["handler"])
+HANDLER_ERRORS = REGISTRY.counter("bot_handler_errors_total", "Handlers that raised", ["handler"])
+CACHE_LOOKUPS = REGISTRY.counter("bot_cache_lookups_total", "Party/client lookups in the cache", ["kind", "result"])
+RELOAD_LATENCY = REGISTRY.histogram("bot_reload_duration_seconds", "Duration of a full reload of a branch", ["branch"])
+RELOAD_ERRORS = REGISTRY.counter("bot_reload_errors_total", "Tables that failed to load", ["branch", "table"])
+CACHE_ROWS = REGISTRY.gauge("bot_cache_rows", "Rows held in the in-memory cache", ["table"])
+BRANCH_READY = REGISTRY.gauge("bot_branch_ready", "1 once a branch's first snapshot is loaded", ["branch"])
+TELEGRAM_LATENCY = REGISTRY.histogram("telegram_request_duration_seconds", "Bot API request latency", ["method"])
+TELEGRAM_ERRORS = REGISTRY.counter("telegram_request_errors_total", "Failed Bot API requests", ["method"])
+UPDATE_QUEUE_DEPTH = REGISTRY.gauge("bot_update_queue_depth", "Webhook updates waiting for a worker")
+NOTIFICATIONS = REGISTRY.counter("bot_notifications_total", "Status notifications by outcome", ["result"])
+THROTTLED = REGISTRY.counter("bot_throttled_updates_total", "Updates over the flood limit", ["scope", "action"])
+SEND_WAIT = REGISTRY.histogram("telegram_send_wait_seconds", "Time outgoing requests waited for a send slot")
+RETRY_AFTER = REGISTRY.counter("telegram_retry_after_total", "Flood-control (429) answers from Telegram")
+
 # ---------- Google Sheets connection helper ----------
 def load_google_creds_from_env(env_value: str) -> Dict[str, Any]:
     """
@@ -74,7 +161,7 @@ def load_google_creds_from_env(env_value: str) -> Dict[str, Any]:
                 "Ensure you pasted a valid single-line JSON with escaped newlines (\\n) in private_key."
             ) from e
 
-def connect_sheets():
+def connect_sheets(url: str):
     creds_json = GOOGLE_CREDENTIALS
     if not creds_json:
         raise Exception("GOOGLE_CREDENTIALS environment variable topilmadi!")
@@ -90,158 +177,361 @@ def connect_sheets():
     creds = Credentials.from_service_account_info(creds_dict, scopes=scopes)
     client = gspread.authorize(creds)
     # open_by_url expects the spreadsheet URL like https://docs.google.com/spreadsheets/d/<ID>/...
-    sh = client.open_by_url(SPREADSHEET_URL)
+    sh = client.open_by_url(url)
     return sh
 
 # ---------- Initialize Google Sheets ----------
 
-sh = connect_sheets()
-
 # Ensure worksheets exist
-def ensure_worksheets():
+def ensure_worksheets(sh, parties_title="parties", clients_title="clients"):
     try:
-        parties_ws = sh.worksheet("parties")
-        clients_ws = sh.worksheet("clients")
+        parties_ws = sh.worksheet(parties_title)
+        clients_ws = sh.worksheet(clients_title)
     except Exception:
         # create if not exists
         try:
-            sh.add_worksheet("parties", 100, 10)
+            sh.add_worksheet(parties_title, 100, 10)
         except Exception:
             pass
         try:
-            sh.add_worksheet("clients", 100, 20)
+            sh.add_worksheet(clients_title, 100, 20)
         except Exception:
             pass
-        parties_ws = sh.worksheet("parties")
-        clients_ws = sh.worksheet("clients")
+        parties_ws = sh.worksheet(parties_title)
+        clients_ws = sh.worksheet(clients_title)
     return parties_ws, clients_ws
 
-parties_ws, clients_ws = ensure_worksheets()
-
 # If header is missing, initialize headers (safe)
-def ensure_headers():
-    try:
-        parties_data = parties_ws.get_all_records()
-        clients_data = clients_ws.get_all_records()
-    except Exception:
-        parties_ws.clear()
-        clients_ws.clear()
-        parties_ws.append_row(["code", "status"])
-        clients_ws.append_row(["id", "party", "mesta", "kub", "kg", "destination", "date", "image"])
-        return
-
-    # If empty or missing keys, set headers
-    if not parties_data:
-        # check first row values
-        parties_ws.clear()
-        parties_ws.append_row(["code", "status"])
-    if not clients_data:
-        clients_ws.clear()
-        clients_ws.append_row(["id", "party", "mesta", "kub", "kg", "destination", "date", "image"])
-
-ensure_headers()
+def ensure_headers(parties_ws, clients_ws):
+    # Only the header row is read: the full sheets are loaded once, by load_data().
+    for ws, header in ((parties_ws, PARTY_COLUMNS), (clients_ws, CLIENT_COLUMNS)):
+        try:
+            first_row = ws.row_values(1)
+        except Exception:
+            first_row = []
+        if not first_row:
+            ws.clear()
+            ws.append_row(header)
+        elif len(first_row) < len(header) and first_row == header[:len(first_row)]:
+            # sheet created by an older version: add the new columns to the header
+            ws.update([header], "A1")
+
+def open_sheets(branch: Branch):
+    sh = connect_sheets(branch.url)
+    parties_ws, clients_ws = ensure_worksheets(sh, branch.parties_sheet, branch.clients_sheet)
+    ensure_headers(parties_ws, clients_ws)
+    return sh, parties_ws, clients_ws
+
+# All Sheets I/O at runtime goes through a SheetsRepository so handlers never block the event loop.
+# One per branch: each branch gets its own SHEETS_WORKERS calls in flight, and a slow or
+# rate-limited spreadsheet does not hold up the others.
+sheets_repos = {b.name: SheetsRepository(max_workers=SHEETS_WORKERS, timeout=SHEETS_TIMEOUT) for b in BRANCHES}
+
+async def connect_sheets_storage(branch: Branch):
+    repo = sheets_repos[branch.name]
+    sh, parties_ws, clients_ws = await repo.call(open_sheets, branch)
+    return SheetsStorage(repo, sh, parties_ws, clients_ws, window=SHEETS_WRITE_WINDOW, branch=branch.name)
+
+# ---------- Storage backend ----------
+# Nothing touches Google at import time: warm_up() connects the storages and loads
+# the cache in the background while polling and the health endpoint already run.
+# Each branch has its own storage; the cache below holds all of them, and every
+# record knows its branch, so writes go back to the storage it came from.
+storages: Dict[str, Storage] = {}  # branch name -> its storage
+data_ready = asyncio.Event()  # set once the first snapshot of every reachable branch is in the cache
+# branch name -> "connecting", "loading" or "ready"; a branch that cannot be reached
+# stays out of "ready" (and out of the cache) while the others are served
+branch_state: Dict[str, str] = {}
+notifications = NotificationStore(NOTIFY_DB_PATH)
+events = EventLog(EVENTLOG_DIR)
+
+async def create_storage(branch: Branch):
+    if STORAGE_BACKEND == "sqlite":
+        # Sheets is only connected when there is something to export, so the bot
+        # keeps serving from the local file during Google outages.
+        mirror = SheetsMirror(lambda: connect_sheets_storage(branch)) if branch.url else None
+        sqlite_storage = SQLiteStorage(branch.sqlite_path, mirror=mirror, branch=branch.name)
+        await sqlite_storage.start()
+        return sqlite_storage
+    return await connect_sheets_storage(branch)
 
 # ---------- Data management (in-memory cache) ----------
-clients = {}
-parties = {}
-
-def load_data():
-    global clients, parties
-    clients = {}
-    parties = {}
+clients: Dict[str, Client] = {}
+parties: Dict[str, Party] = {}
+UNKNOWN_STATUS = "Noma’lum"  # status of a client whose party is not in the parties table
+party_index = PartyIndex()  # party -> client ids and per-party totals
+stats_index = StatsIndex(UNKNOWN_STATUS)  # totals per status / destination / month for "📊 Statistika"
+party_search = SearchIndex()  # normalized/fuzzy lookup of party codes
+client_search = SearchIndex()  # ... and of client ids
+cache_versions = {"parties": 0, "clients": 0}  # bumped on every change; invalidates rendered list pages
+
+# Every change to the cache goes through these four functions, whether it comes
+# from a bot write or from a reload, so the indexes above stay in step.
+def cache_put_party(code, record: Party):
+    parties[code] = record
+    party_search.add(code)
+    stats_index.set_party(code, record.status)
+    cache_versions["parties"] += 1
+
+def cache_drop_party(code):
+    parties.pop(code, None)
+    party_search.remove(code)
+    stats_index.remove_party(code)
+    cache_versions["parties"] += 1
+
+def cache_put_client(cid, record: Client):
+    clients[cid] = record
+    party_index.add(cid, record)
+    stats_index.add_client(cid, record)
+    client_search.add(cid)
+    cache_versions["clients"] += 1
+
+def cache_drop_client(cid):
+    clients.pop(cid, None)
+    party_index.remove(cid)
+    stats_index.remove_client(cid)
+    client_search.remove(cid)
+    cache_versions["clients"] += 1
+
+def apply_snapshot(current: dict, fresh: dict, put, drop, branch: str = ""):
+    """Bring the rows of `branch` in `current` in line with `fresh` (that branch's
+    table), touching only rows that differ. Returns (changed, clashes): a key that is
+    already cached from another branch's table is left to that branch and counted.
+    Runs without awaiting, so handlers see either the old or the new data, never a mix."""
+    changed = clashes = 0
+    for key in [k for k, record in current.items() if record.branch == branch and k not in fresh]:
+        drop(key)
+        changed += 1
+    for key, record in fresh.items():
+        old = current.get(key)
+        if old is not None and old.branch != branch:
+            clashes += 1
+        elif old != record:
+            put(key, record)
+            changed += 1
+    return changed, clashes
+
+async def load_branch(branch: str) -> bool:
+    """Full read of both tables of one branch. Only used at startup and for periodic
+    reconciliation; the write helpers below keep the cache up to date themselves.
+    Returns False if a table could not be read (the cache keeps the old data)."""
+    storage = storages[branch]
+    label = branch or "-"
+    ok = True
+    start = time.perf_counter()
+    # Each snapshot is applied right after storage returns it, before anything else
+    # can run, so a write that lands after the read is never overwritten by it.
     try:
-        parties_data = parties_ws.get_all_records()
-        for row in parties_data:
-            key = str(row.get("code", "")).strip()
-            if not key:
-                continue
-            parties[key] = {"status": row.get("status", "")}
+        new_parties = await storage.load_parties()
+        # statuses edited directly in the sheet go to the event log too, without an admin
+        edited = [(code, parties[code].status, p.status) for code, p in new_parties.items()
+                  if data_ready.is_set() and code in parties and parties[code].branch == branch
+                  and parties[code].status != p.status]
+        changed, clashes = apply_snapshot(parties, new_parties, cache_put_party, cache_drop_party, branch)
+        logger.info("[%s] parties synced: %d rows, %d changed", label, len(new_parties), changed)
+        if clashes:
+            logger.warning("[%s] %d party codes are also in another branch's table; ignored here", label, clashes)
+        if edited:
+            await record_events([("party_status", code, code, {"old": old, "new": new})
+                                 for code, old, new in edited], None)
     except Exception as e:
-        logger.exception("Error reading parties sheet: %s", e)
+        ok = False
+        RELOAD_ERRORS.inc(branch=label, table="parties")
+        logger.exception("[%s] Error reading parties: %s", label, e)
 
     try:
-        clients_data = clients_ws.get_all_records()
-        for row in clients_data:
-            cid = str(row.get("id", "")).strip()
-            if not cid:
-                continue
-            clients[cid] = {
-                "party": row.get("party", ""),
-                "mesta": row.get("mesta", ""),
-                "kub": row.get("kub", ""),
-                "kg": row.get("kg", ""),
-                "destination": row.get("destination", ""),
-                "date": row.get("date", ""),
-                "image": row.get("image", "")
-            }
+        new_clients = await storage.load_clients()
+        changed, clashes = apply_snapshot(clients, new_clients, cache_put_client, cache_drop_client, branch)
+        logger.info("[%s] clients synced: %d rows, %d changed", label, len(new_clients), changed)
+        if clashes:
+            logger.warning("[%s] %d client ids are also in another branch's table; ignored here", label, clashes)
     except Exception as e:
-        logger.exception("Error reading clients sheet: %s", e)
-
-# Initial load
-load_data()
-
-# ---------- Sheets write helpers ----------
-def save_party(code, status="Yangi"):
+        ok = False
+        RELOAD_ERRORS.inc(branch=label, table="clients")
+        logger.exception("[%s] Error reading clients: %s", label, e)
+    RELOAD_LATENCY.observe(time.perf_counter() - start, branch=label)
+    CACHE_ROWS.set(len(parties), table="parties")
+    CACHE_ROWS.set(len(clients), table="clients")
+    return ok
+
+async def sync_branch(branch: str, versions: dict) -> bool:
+    """Reload a branch unless its storage version is the one last loaded.
+    `versions` (branch -> version) is updated on success."""
+    version = await storages[branch].version()
+    if version is not None and versions.get(branch) == version:
+        return True
+    if await load_branch(branch):
+        versions[branch] = version
+        return True
+    return False
+
+async def sync_all(versions: dict) -> bool:
+    # branches are independent spreadsheets: read them all at once; branches still
+    # warming up are left to warm_branch()
+    names = [name for name in storages if branch_state.get(name) == "ready"]
+    results = await asyncio.gather(*(sync_branch(name, versions) for name in names), return_exceptions=True)
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            logger.error("[%s] Reload failed: %s", name or "-", result)
+    return all(result is True for result in results)
+
+# ---------- Write helpers ----------
+# Each helper returns True on success so handlers can tell the admin when a write failed.
+# The helper returns once the storage has applied the write (for Sheets: the batch
+# containing it); the in-memory cache is then updated in place (write-through)
+# instead of re-reading the tables. `actor` is the admin's Telegram id, kept in the event log.
+async def record_events(items, actor: Optional[int]):
+    # The change itself is already saved; a full disk must not turn it into an error.
     try:
-        parties_ws.append_row([code, status])
-        load_data()
+        await events.append_many(items, admin=actor)
+    except Exception as e:
+        logger.warning("Could not write %d events to the event log: %s", len(items), e)
+
+def client_fields(record: Client) -> dict:
+    return dict(zip(CLIENT_COLUMNS[1:], client_row("", record)[1:]))
+
+def party_branch(code: str, actor: Optional[int] = None) -> str:
+    """Branch a party is stored in; for a new code the branch its prefix names,
+    else the adding admin's own branch, else the first one."""
+    p = parties.get(code)
+    if p is not None:
+        return p.branch
+    return router.by_prefix(code) or (router.admin_branch(actor) if actor is not None else None) or router.default
+
+def client_branch(data: dict, actor: Optional[int] = None) -> str:
+    # a client is stored with its party
+    return party_branch(str(data.get("party") or "").strip(), actor)
+
+async def save_party(code, status="Yangi", actor: Optional[int] = None):
+    old = parties.get(code)
+    branch = party_branch(code, actor)
+    try:
+        await storages[branch].save_party(code, status)
+        cache_put_party(code, Party(status, branch))
     except Exception as e:
         logger.exception("Failed to save_party: %s", e)
+        return False
+    await record_events([("party_add", code, code, {"status": status, "old": old.status if old else None})], actor)
+    return True
 
-def delete_party(code):
+async def delete_party(code, actor: Optional[int] = None):
+    old = parties.get(code)
     try:
-        data = parties_ws.get_all_records()
-        # find row index (data rows start at row 2 in sheet)
-        for idx, row in enumerate(data, start=2):
-            if str(row.get("code", "")) == str(code):
-                parties_ws.delete_rows(idx)
-                break
-        load_data()
+        await storages[party_branch(code)].delete_party(code)
+        cache_drop_party(code)
     except Exception as e:
         logger.exception("Failed to delete_party: %s", e)
+        return False
+    if old is not None:
+        await record_events([("party_delete", code, code, {"status": old.status})], actor)
+    return True
 
-def update_party_status(code, status):
+async def update_party_status(code, status, actor: Optional[int] = None):
+    branch = party_branch(code)
     try:
-        data = parties_ws.get_all_records()
-        for idx, row in enumerate(data, start=2):
-            if str(row.get("code", "")) == str(code):
-                parties_ws.update_cell(idx, 2, status)
-                break
-        load_data()
+        await storages[branch].update_party_status(code, status)
+        old = parties.get(code)
+        cache_put_party(code, Party(status, branch))
     except Exception as e:
         logger.exception("Failed to update_party_status: %s", e)
+        return False
+    if old is None or old.status != status:
+        await record_events([("party_status", code, code, {"old": old.status if old else None, "new": status})],
+                            actor)
+        await notify_status_change(code, status)
+    return True
+
+async def notify_status_change(code, status):
+    """Queue one message per subscribed chat; the broadcaster sends them in the background."""
+    recipients = notifications.recipients(code, party_index.clients_of(code))
+    if not recipients:
+        return
+    messages = []
+    for chat_id, cids in recipients.items():
+        text = f"🔔 {code} partiyasi statusi o‘zgardi: {status}"
+        if cids:
+            text += "\n🆔 Yukingiz: " + ", ".join(sorted(cids)[:REPORT_MAX_IDS])
+        messages.append((chat_id, text))
+    try:
+        await notifications.enqueue(messages)
+        broadcaster.wake()
+        logger.info("Queued %d notifications for %s", len(messages), code)
+    except Exception as e:
+        logger.exception("Failed to queue notifications for %s: %s", code, e)
 
-def save_client(cid, data: dict):
+async def save_client(cid, data: dict, actor: Optional[int] = None):
+    record = client_record(data, client_branch(data, actor))
+    old = clients.get(cid)
     try:
-        clients_ws.append_row([
-            cid,
-            data.get("party", ""),
-            data.get("mesta", ""),
-            data.get("kub", ""),
-            data.get("kg", ""),
-            data.get("destination", ""),
-            data.get("date", ""),
-            data.get("image", "")
-        ])
-        load_data()
+        await storages[record.branch].save_client(cid, record)
+        if old is not None and old.branch != record.branch:
+            # moved to a party of another branch: the old branch's row goes
+            try:
+                await storages[old.branch].delete_client(cid)
+            except RowNotFound:
+                pass  # already gone; the new row is what matters
+        cache_put_client(cid, record)
     except Exception as e:
         logger.exception("Failed to save_client: %s", e)
+        return False
+    await record_events([("client_add", cid, record.party, {
+        "fields": client_fields(record), "old": client_fields(old) if old else None})], actor)
+    return True
+
+async def save_clients(items, actor: Optional[int] = None):
+    """Bulk import: one batched write per branch, all branches at once."""
+    by_branch: Dict[str, list] = {}
+    for cid, data in items:
+        record = client_record(data, client_branch(data, actor))
+        by_branch.setdefault(record.branch, []).append((cid, record))
+    results = await asyncio.gather(*(storages[branch].save_clients(records) for branch, records in by_branch.items()),
+                                   return_exceptions=True)
+    saved = []
+    for records, result in zip(by_branch.values(), results):
+        if isinstance(result, Exception):
+            # rows of a batch that did reach storage show up with the next reload
+            logger.error("Failed to save_clients (%d rows): %s", len(records), result, exc_info=result)
+            continue
+        for cid, record in records:
+            cache_put_client(cid, record)
+        saved += records
+    if saved:
+        await record_events([("client_add", cid, record.party, {"fields": client_fields(record), "old": None})
+                             for cid, record in saved], actor)
+    return len(saved) == len(items)
+
+async def save_image_file_id(cid, file_id):
+    # Only an optimization: on failure the URL keeps working and the next send retries.
+    record = clients.get(cid)
+    if record is None:
+        return False
+    try:
+        await storages[record.branch].update_client_field(cid, "image_file_id", file_id)
+        if cid in clients:
+            cache_put_client(cid, clients[cid].replace(image_file_id=file_id))
+        return True
+    except Exception as e:
+        logger.warning("Failed to save image file_id of %s: %s", cid, e)
+        return False
 
-def delete_client(cid):
+async def delete_client(cid, actor: Optional[int] = None):
+    old = clients.get(cid)
     try:
-        data = clients_ws.get_all_records()
-        for idx, row in enumerate(data, start=2):
-            if str(row.get("id", "")) == str(cid):
-                clients_ws.delete_rows(idx)
-                break
-        load_data()
+        await storages[old.branch if old is not None else router.default].delete_client(cid)
+        cache_drop_client(cid)
     except Exception as e:
         logger.exception("Failed to delete_client: %s", e)
+        return False
+    if old is not None:
+        # everything needed to put the client back
+        await record_events([("client_delete", cid, old.party, {"fields": client_fields(old)})], actor)
+    return True
 
 # ---------- FSM States ----------
 class ClientState(StatesGroup):
     waiting_party_code = State()
     waiting_client_code = State()
+    waiting_subscription = State()
 
 class AddClient(StatesGroup):
     waiting_id = State()
@@ -266,11 +556,18 @@ class UpdatePartyStatus(StatesGroup):
     waiting_code = State()
     waiting_status = State()
 
+class PartyReport(StatesGroup):
+    waiting_code = State()
+
+class ImportClients(StatesGroup):
+    waiting_file = State()
+
 # ---------- Keyboards ----------
 def client_menu():
     kb = [
         [KeyboardButton(text="🔍 Partiya bo‘yicha qidirish")],
         [KeyboardButton(text="🔍 Mijoz yukini tekshirish")],
+        [KeyboardButton(text="🔔 Obuna bo'lish"), KeyboardButton(text="🔕 Obunani bekor qilish")],
         [KeyboardButton(text="📞 Admin bilan bog'lanish")],
         [KeyboardButton(text="ℹ️ Yordam")]
     ]
@@ -280,26 +577,288 @@ def admin_menu():
     kb = [
         [KeyboardButton(text="➕ Partiya qo'shish"), KeyboardButton(text="➖ Partiya o'chirish")],
         [KeyboardButton(text="👤 Mijoz qo'shish"), KeyboardButton(text="➖ Mijozni o'chirish")],
-        [KeyboardButton(text="✏️ Partiya statusini yangilash")],
+        [KeyboardButton(text="✏️ Partiya statusini yangilash"), KeyboardButton(text="📦 Partiya hisoboti")],
         [KeyboardButton(text="📋 Barcha partiyalar"), KeyboardButton(text="📋 Barcha mijozlar")],
-        [KeyboardButton(text="⬅️ Ortga")]
+        [KeyboardButton(text="📊 Statistika"), KeyboardButton(text="📥 Mijozlarni import qilish")],
+        [KeyboardButton(text="🧾 O‘zgarishlar jurnali"), KeyboardButton(text="⬅️ Ortga")]
     ]
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 
 # ---------- Helper ----------
+WRITE_FAILED_TEXT = "⚠️ Ma'lumotni saqlashda xatolik. Qayta urinib ko‘ring."
+OTHER_BRANCH_TEXT = "⛔ Bu boshqa filialga tegishli, uni o‘zgartira olmaysiz."
+GLOBAL_ONLY_TEXT = "⛔ Bu bo‘lim faqat bosh adminlar uchun."
+LOADING_TEXT = "⏳ Ma'lumotlar yuklanmoqda, birozdan so‘ng qayta urinib ko‘ring."
+PARTLY_LOADED_TEXT = "⏳ Ba'zi filiallar ma'lumotlari hali yuklanmoqda, birozdan so‘ng qayta urinib ko‘ring."
+
+def not_found_text(text: str) -> str:
+    # a key of a branch that is still warming up is not missing, just not loaded yet
+    if any(state != "ready" for state in branch_state.values()):
+        return text + "\n" + PARTLY_LOADED_TEXT
+    return text
+REPORT_MAX_IDS = 100  # client ids listed in a party report
+STATS_MAX_ROWS = 12  # destinations / months listed in "📊 Statistika"
+TIMELINE_MAX = 5  # status changes shown under a party
+JOURNAL_SIZE = 10  # events listed in "🧾 O‘zgarishlar jurnali"
+REPLAY_PAGE = 500  # events read from disk at a time by /replay
+LOCAL_TZ = timezone(timedelta(hours=TZ_OFFSET))
+IMPORT_MAX_BYTES = 20 * 1024 * 1024  # Bot API does not let bots download bigger files
+IMPORT_MAX_ERRORS = 30  # rejected rows listed in the import summary
+
+def is_admin(event) -> bool:
+    # works for messages and callback queries alike; branch admins included
+    return is_admin_id(event.from_user.id)
+
+def is_admin_id(user_id) -> bool:
+    return str(user_id) in ADMIN_IDS or router.admin_branch(user_id) is not None
+
+def is_global_admin(event) -> bool:
+    # ADMIN_IDS: every branch, plus the company-wide tools (statistics, event log)
+    return str(event.from_user.id) in ADMIN_IDS
+
+def admin_scope(user_id) -> Optional[str]:
+    """Branch an admin is limited to; None for ADMIN_IDS (all branches).
+    Only meaningful for admins: check is_admin_id first, a non-admin also gets None."""
+    return None if str(user_id) in ADMIN_IDS else router.admin_branch(user_id)
+
+def can_edit(user_id, branch: str) -> bool:
+    """Branch admins may change only their own branch's data; non-admins nothing."""
+    if not is_admin_id(user_id):
+        return False
+    scope = admin_scope(user_id)
+    return scope is None or scope == branch
+
 async def send_long_message(chat_id: int, text: str, bot: Bot, chunk_size: int = 3000):
     for i in range(0, len(text), chunk_size):
         await bot.send_message(chat_id, text[i:i+chunk_size])
 
+# ---------- List views ----------
+class ListPage(CallbackData, prefix="list"):
+    view: str
+    page: int
+
+class ListExport(CallbackData, prefix="export"):
+    view: str
+
+LIST_VIEWS = {
+    "parties": PagedList(
+        "📋 Partiyalar", lambda: parties, lambda: cache_versions["parties"],
+        lambda code, p: f"- {code}: {p.status}",
+    ),
+    "clients": PagedList(
+        "📋 Mijozlar", lambda: clients, lambda: cache_versions["clients"],
+        lambda cid, c: f"- {cid}: {c.party}, {format_number(c.mesta)}mesta, {format_number(c.kg)}kg",
+    ),
+}
+
+_branch_lists: Dict[tuple, PagedList] = {}
+
+def list_view(view: str, user_id) -> PagedList:
+    """The list a user sees: a branch admin only gets their branch's rows."""
+    if not is_admin_id(user_id):
+        raise PermissionError("user %s is not an admin" % user_id)
+    branch = admin_scope(user_id)
+    if branch is None:
+        return LIST_VIEWS[view]
+    paged = _branch_lists.get((view, branch))
+    if paged is None:
+        full = LIST_VIEWS[view]
+        paged = _branch_lists[view, branch] = PagedList(
+            f"{full.title} ({branch})", full.source, full.version, full.render,
+            keep=lambda record: record.branch == branch)
+    return paged
+
+# view -> (source, csv header, row builder, file name)
+LIST_EXPORTS = {
+    "parties": (lambda: parties, PARTY_COLUMNS, lambda code, p: [code, p.status], "partiyalar.csv"),
+    "clients": (lambda: clients, CLIENT_COLUMNS, client_row, "mijozlar.csv"),
+}
+
+def list_keyboard(view: str, page: int, total: int):
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=ListPage(view=view, page=page - 1).pack()))
+    nav.append(InlineKeyboardButton(text=f"{page + 1}/{total}", callback_data=ListPage(view=view, page=page).pack()))
+    if page < total - 1:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=ListPage(view=view, page=page + 1).pack()))
+    export = [InlineKeyboardButton(text="📄 CSV yuklab olish", callback_data=ListExport(view=view).pack())]
+    return InlineKeyboardMarkup(inline_keyboard=[nav, export])
+
+async def send_list(message: types.Message, view: str):
+    text, page, total = list_view(view, message.from_user.id).page(0)
+    await message.answer(text, reply_markup=list_keyboard(view, page, total))
+
+# ---------- Lookups ----------
+class Suggestion(CallbackData, prefix="sug"):
+    kind: str  # "party" or "client"
+    key: str
+
+SUGGESTION_TEXT = "💡 Shuni nazarda tutdingizmi?"
+
+LOOKUPS = {"party": (parties, party_search), "client": (clients, client_search)}
+
+def resolve_key(kind: str, text: str):
+    """Key the user meant: exact match first, then "pp111" / "1111 " / Cyrillic look-alikes."""
+    cache, search = LOOKUPS[kind]
+    key = (text or "").strip()
+    if key in cache:
+        CACHE_LOOKUPS.inc(kind=kind, result="hit")
+        return key
+    key = search.find(key)
+    if key in cache:
+        CACHE_LOOKUPS.inc(kind=kind, result="normalized")
+        return key
+    CACHE_LOOKUPS.inc(kind=kind, result="miss")
+    return None
+
+def suggestion_keyboard(kind: str, text: str):
+    buttons = []
+    for key in LOOKUPS[kind][1].suggest(text or ""):
+        try:
+            data = Suggestion(kind=kind, key=key).pack()
+        except ValueError:
+            continue  # key has ":" or is too long for callback data
+        buttons.append([InlineKeyboardButton(text=key, callback_data=data)])
+    return InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+
+def party_status(code: str) -> str:
+    p = parties.get(code)
+    return p.status if p is not None else UNKNOWN_STATUS
+
+def event_time(ts: float) -> str:
+    return datetime.fromtimestamp(ts, LOCAL_TZ).strftime("%d.%m.%Y %H:%M")
+
+def event_status(e) -> str:
+    """Status a party_* event left the party in; "—" for a cell cleared in the sheet."""
+    if e.kind == "party_delete":
+        return "o‘chirildi"
+    return (e.data["new"] if e.kind == "party_status" else e.data["status"]) or "—"
+
+async def send_party_info(message: types.Message, code: str):
+    text = f"📦 Partiya: {code}\n📍 Status: {parties[code].status}"
+    try:
+        history = await events.party_history(code, TIMELINE_MAX)
+    except Exception as e:
+        logger.warning("Could not read the history of %s: %s", code, e)
+        history = []
+    if history:
+        lines = [f"- {event_time(e.ts)}: {event_status(e)}" for e in reversed(history)]
+        text += "\n\n📜 Tarix:\n" + "\n".join(lines)
+    await message.answer(text, reply_markup=client_menu())
+
+async def send_client_info(message: types.Message, code: str):
+    c = clients[code]
+    text = (
+        f"🆔 Kod: {code}\n"
+        f"📦 Partiya: {c.party}\n"
+        f"📍 Status: {party_status(c.party)}\n"
+        f"📦 Mesta: {format_number(c.mesta)}\n"
+        f"📦 Kub: {format_number(c.kub)}\n"
+        f"⚖️ Kg: {format_number(c.kg)}\n"
+        f"🛣 Joy: {c.destination}\n"
+        f"📅 Vaqt: {c.date}\n"
+    )
+    # a stored file_id is sent without Telegram downloading anything; the URL is the fallback
+    for photo in dict.fromkeys(p for p in (c.image_file_id, c.image) if p):
+        try:
+            sent = await message.answer_photo(photo, caption=text)
+        except Exception as e:
+            logger.warning("Could not send image of client %s: %s", code, e)
+            continue
+        if sent.photo and photo != c.image_file_id:
+            await save_image_file_id(code, sent.photo[-1].file_id)
+        return
+    await message.answer(text)
+
 # ---------- Bot init ----------
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+def create_fsm_storage():
+    """Returns (storage, events_isolation) for the Dispatcher."""
+    if FSM_STORAGE.startswith(("redis://", "rediss://")):
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
+        except ImportError:
+            raise SystemExit("FSM_STORAGE=redis:// requires the 'redis' package (pip install redis)")
+        fsm = RedisStorage.from_url(FSM_STORAGE, state_ttl=FSM_TTL, data_ttl=FSM_TTL,
+                                    key_builder=DefaultKeyBuilder(with_destiny=True))
+        # per-user lock shared by all instances
+        return fsm, fsm.create_isolation()
+    if FSM_STORAGE == "memory":
+        return MemoryStorage(), SimpleEventIsolation()
+    if FSM_STORAGE == "sqlite":
+        return SQLiteFSMStorage(FSM_SQLITE_PATH, ttl=FSM_TTL), SimpleEventIsolation()
+    raise SystemExit("FSM_STORAGE must be 'sqlite', 'memory' or a redis:// URL")
+
+if TELEGRAM_API_URL:
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=BOT_TOKEN)
+# Registered first, so it wraps the metrics middleware below: latency metrics
+# then measure Telegram itself, not the time spent queued here.
+bot.session.middleware(SendScheduler(global_rate=TELEGRAM_RATE, on_wait=SEND_WAIT.observe,
+                                     on_retry_after=lambda seconds: RETRY_AFTER.inc()))
+fsm_storage, fsm_isolation = create_fsm_storage()
+# Isolation serializes updates of one user, so two quick messages can't both
+# read-modify-write the same conversation data.
+dp = Dispatcher(storage=fsm_storage, events_isolation=fsm_isolation)
+broadcaster = Broadcaster(notifications, lambda chat_id, text: bot.send_message(chat_id, text),
+                          rate=NOTIFY_RATE, on_sent=lambda result: NOTIFICATIONS.inc(result=result))
+
+# ---------- Middlewares ----------
+if THROTTLE_RATE > 0:
+    throttling = ThrottlingMiddleware(
+        Buckets(THROTTLE_RATE, THROTTLE_BURST), Buckets(THROTTLE_RATE * 3, THROTTLE_BURST * 3),
+        "⏳ Juda tez! Iltimos, biroz kuting.",
+        on_throttled=lambda scope, action: THROTTLED.inc(scope=scope, action=action),
+        exempt=lambda user: is_admin_id(user.id),
+    )
+    # Outer middlewares run in registration order; re-registering the FSM one
+    # puts flood control in front of the per-user isolation lock.
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(throttling)
+    dp.update.outer_middleware(dp.fsm)
+
+@dp.message.outer_middleware()
+async def readiness_middleware(handler, event: types.Message, data):
+    # Until warm_up() has loaded the data every lookup would say "topilmadi"
+    # and writes would have no storage yet; /start only shows the menu.
+    if data_ready.is_set() or event.text == "/start":
+        return await handler(event, data)
+    await event.answer(LOADING_TEXT)
+
+async def handler_metrics_middleware(handler, event, data):
+    # inner middleware: runs once the handler is chosen, so it can be named
+    name = data["handler"].callback.__name__
+    start = time.perf_counter()
+    try:
+        return await handler(event, data)
+    except Exception:
+        HANDLER_ERRORS.inc(handler=name)
+        raise
+    finally:
+        HANDLER_LATENCY.observe(time.perf_counter() - start, handler=name)
+
+dp.message.middleware(handler_metrics_middleware)
+dp.callback_query.middleware(handler_metrics_middleware)
+
+async def telegram_metrics_middleware(make_request, bot, method):
+    name = method.__api_method__
+    start = time.perf_counter()
+    try:
+        return await make_request(bot, method)
+    except Exception:
+        TELEGRAM_ERRORS.inc(method=name)
+        raise
+    finally:
+        # getUpdates is a long poll; its duration says nothing about Telegram's latency
+        if name != "getUpdates":
+            TELEGRAM_LATENCY.observe(time.perf_counter() - start, method=name)
+
+bot.session.middleware(telegram_metrics_middleware)
 
 # ---------- Handlers ----------
 @dp.message(F.text == "/start")
 async def start_cmd(message: types.Message):
-    user_id_str = str(message.from_user.id)
-    if user_id_str in ADMIN_IDS:
+    if is_admin(message):
         await message.answer("👋 Admin panelga xush kelibsiz!", reply_markup=admin_menu())
     else:
         await message.answer("👋 Xush kelibsiz!\nLogistika botga hush kelibsiz!", reply_markup=client_menu())
@@ -312,13 +871,13 @@ async def ask_party_code(message: types.Message, state: FSMContext):
 
 @dp.message(ClientState.waiting_party_code)
 async def show_party_info(message: types.Message, state: FSMContext):
-    code = message.text.strip()
-    if code not in parties:
-        await message.answer("❌ Bunday partiya topilmadi.\n✍️ Qayta urinib ko‘ring:")
+    code = resolve_key("party", message.text)
+    if code is None:
+        hint = suggestion_keyboard("party", message.text)
+        text = not_found_text("❌ Bunday partiya topilmadi.\n✍️ Qayta urinib ko‘ring:")
+        await message.answer(text + "\n" + SUGGESTION_TEXT if hint else text, reply_markup=hint)
         return
-    p = parties[code]
-    text = f"📦 Partiya: {code}\n📍 Status: {p.get('status','')}"
-    await message.answer(text, reply_markup=client_menu())
+    await send_party_info(message, code)
     await state.clear()
 
 @dp.message(F.text == "🔍 Mijoz yukini tekshirish")
@@ -328,31 +887,28 @@ async def ask_client_code(message: types.Message, state: FSMContext):
 
 @dp.message(ClientState.waiting_client_code)
 async def show_client_info(message: types.Message, state: FSMContext):
-    code = message.text.strip()
-    if code not in clients:
-        await message.answer("❌ Bunday mijoz topilmadi.")
+    code = resolve_key("client", message.text)
+    if code is None:
+        hint = suggestion_keyboard("client", message.text)
+        text = not_found_text("❌ Bunday mijoz topilmadi.")
+        await message.answer(text + "\n" + SUGGESTION_TEXT if hint else text, reply_markup=hint)
         await state.clear()
         return
-    c = clients[code]
-    party = c.get("party")
-    status = parties.get(party, {}).get("status", "Noma’lum")
-    text = (
-        f"🆔 Kod: {code}\n"
-        f"📦 Partiya: {party}\n"
-        f"📍 Status: {status}\n"
-        f"📦 Mesta: {c.get('mesta')}\n"
-        f"📦 Kub: {c.get('kub')}\n"
-        f"⚖️ Kg: {c.get('kg')}\n"
-        f"🛣 Joy: {c.get('destination')}\n"
-        f"📅 Vaqt: {c.get('date')}\n"
-    )
-    if c.get("image"):
-        try:
-            await message.answer_photo(c.get("image"), caption=text)
-        except Exception:
-            await message.answer(text)
+    await send_client_info(message, code)
+    await state.clear()
+
+@dp.callback_query(Suggestion.filter())
+async def pick_suggestion(callback: types.CallbackQuery, callback_data: Suggestion, state: FSMContext):
+    await callback.answer()
+    cache = LOOKUPS[callback_data.kind][0] if callback_data.kind in LOOKUPS else {}
+    if callback_data.key not in cache:
+        # deleted since the suggestion was shown
+        await callback.message.answer("❌ Topilmadi.")
+        return
+    if callback_data.kind == "party":
+        await send_party_info(callback.message, callback_data.key)
     else:
-        await message.answer(text)
+        await send_client_info(callback.message, callback_data.key)
     await state.clear()
 
 @dp.message(F.text == "📞 Admin bilan bog'lanish")
@@ -366,39 +922,92 @@ async def help_info(message: types.Message):
         "ℹ️ Yordam:\n\n"
         "🔍 Partiya bo‘yicha qidirish — partiya kodini kiriting\n"
         "🔍 Mijoz yukini tekshirish — mijoz kodini kiriting\n"
+        "🔔 Obuna bo'lish — partiya statusi o‘zgarsa xabar olasiz\n"
         "📞 Admin bilan bog'lanish — admin bilan aloqa\n"
     )
 
+@dp.message(F.text == "🔔 Obuna bo'lish")
+async def subscribe_start(message: types.Message, state: FSMContext):
+    await message.answer("🔑 Mijoz kodini yoki partiya kodini kiriting:")
+    await state.set_state(ClientState.waiting_subscription)
+
+@dp.message(ClientState.waiting_subscription)
+async def subscribe_key(message: types.Message, state: FSMContext):
+    for kind in ("client", "party"):
+        key = resolve_key(kind, message.text)
+        if key is not None:
+            break
+    else:
+        await message.answer("❌ Bunday mijoz yoki partiya topilmadi.", reply_markup=client_menu())
+        await state.clear()
+        return
+    label = f"🆔 {key}" if kind == "client" else f"📦 {key}"
+    if await notifications.subscribe(message.chat.id, kind, key):
+        await message.answer(f"✅ Obuna bo‘ldingiz: {label}\nStatus o‘zgarsa xabar yuboramiz.",
+                             reply_markup=client_menu())
+    else:
+        await message.answer(f"ℹ️ Siz allaqachon obuna bo‘lgansiz: {label}", reply_markup=client_menu())
+    await state.clear()
+
+@dp.message(F.text == "🔕 Obunani bekor qilish")
+async def unsubscribe(message: types.Message):
+    removed = await notifications.unsubscribe_all(message.chat.id)
+    if removed:
+        keys = ", ".join(sorted(key for _, key in removed))
+        await message.answer(f"🔕 Obunalar bekor qilindi: {keys}", reply_markup=client_menu())
+    else:
+        await message.answer("ℹ️ Sizda obunalar yo‘q.", reply_markup=client_menu())
+
 # Admin handlers
 @dp.message(F.text == "➕ Partiya qo'shish")
 async def add_party_start(message: types.Message, state: FSMContext):
+    if not is_admin(message):
+        return
     await message.answer("✍️ Yangi partiya kodini kiriting:")
     await state.set_state(AddParty.waiting_code)
 
 @dp.message(AddParty.waiting_code)
 async def add_party_code(message: types.Message, state: FSMContext):
+    if not is_admin(message):
+        await state.clear()
+        return
     code = message.text.strip()
-    save_party(code)
-    await message.answer(f"✅ Partiya qo‘shildi: {code}", reply_markup=admin_menu())
+    if not can_edit(message.from_user.id, party_branch(code, message.from_user.id)):
+        await message.answer(OTHER_BRANCH_TEXT, reply_markup=admin_menu())
+    elif await save_party(code, actor=message.from_user.id):
+        await message.answer(f"✅ Partiya qo‘shildi: {code}", reply_markup=admin_menu())
+    else:
+        await message.answer(WRITE_FAILED_TEXT, reply_markup=admin_menu())
     await state.clear()
 
 @dp.message(F.text == "➖ Partiya o'chirish")
 async def delete_party_start(message: types.Message, state: FSMContext):
+    if not is_admin(message):
+        return
     await message.answer("✍️ O‘chiriladigan partiya kodini kiriting:")
     await state.set_state(DeleteParty.waiting_code)
 
 @dp.message(DeleteParty.waiting_code)
 async def delete_party_code(message: types.Message, state: FSMContext):
+    if not is_admin(message):
+        await state.clear()
+        return
     code = message.text.strip()
-    if code in parties:
-        delete_party(code)
-        await message.answer(f"✅ Partiya o‘chirildi: {code}", reply_markup=admin_menu())
+    if code in parties and not can_edit(message.from_user.id, parties[code].branch):
+        await message.answer(OTHER_BRANCH_TEXT, reply_markup=admin_menu())
+    elif code in parties:
+        if await delete_party(code, actor=message.from_user.id):
+            await message.answer(f"✅ Partiya o‘chirildi: {code}", reply_markup=admin_menu())
+        else:
+            await message.answer(WRITE_FAILED_TEXT, reply_markup=admin_menu())
     else:
         await message.answer("❌ Bunday partiya topilmadi")
     await state.clear()
 
 @dp.message(F.text == "✏️ Partiya statusini yangilash")
 async def update_status_start(message: types.Message, state: FSMContext):
+    if not is_admin(message):
+        return
     await message.answer("✍️ Statusini yangilash uchun partiya kodini kiriting:")
     await state.set_state(UpdatePartyStatus.waiting_code)
 
@@ -410,30 +1019,49 @@ async def update_status_code(message: types.Message, state: FSMContext):
 
 @dp.message(UpdatePartyStatus.waiting_status)
 async def update_status_finish(message: types.Message, state: FSMContext):
+    if not is_admin(message):
+        await state.clear()
+        return
     data = await state.get_data()
     code = data["code"]
     status = message.text.strip()
-    if code in parties:
-        update_party_status(code, status)
-        await message.answer(f"✅ {code} status yangilandi: {status}", reply_markup=admin_menu())
+    if code in parties and not can_edit(message.from_user.id, parties[code].branch):
+        await message.answer(OTHER_BRANCH_TEXT, reply_markup=admin_menu())
+    elif code in parties:
+        if await update_party_status(code, status, actor=message.from_user.id):
+            await message.answer(f"✅ {code} status yangilandi: {status}", reply_markup=admin_menu())
+        else:
+            await message.answer(WRITE_FAILED_TEXT, reply_markup=admin_menu())
     else:
         await message.answer("❌ Bunday partiya topilmadi")
     await state.clear()
 
 @dp.message(F.text == "👤 Mijoz qo'shish")
 async def add_client_start(message: types.Message, state: FSMContext):
+    if not is_admin(message):
+        return
     await message.answer("✍️ Mijoz ID sini kiriting:")
     await state.set_state(AddClient.waiting_id)
 
 @dp.message(AddClient.waiting_id)
 async def add_client_id(message: types.Message, state: FSMContext):
-    await state.update_data(id=message.text.strip())
+    cid = message.text.strip()
+    if cid in clients and not can_edit(message.from_user.id, clients[cid].branch):
+        await message.answer(OTHER_BRANCH_TEXT, reply_markup=admin_menu())
+        await state.clear()
+        return
+    await state.update_data(id=cid)
     await message.answer("✍️ Partiya kodini kiriting:")
     await state.set_state(AddClient.waiting_party)
 
 @dp.message(AddClient.waiting_party)
 async def add_client_party(message: types.Message, state: FSMContext):
-    await state.update_data(party=message.text.strip())
+    party = message.text.strip()
+    if not can_edit(message.from_user.id, party_branch(party, message.from_user.id)):
+        await message.answer(OTHER_BRANCH_TEXT, reply_markup=admin_menu())
+        await state.clear()
+        return
+    await state.update_data(party=party)
     await message.answer("✍️ Mesta sonini kiriting:")
     await state.set_state(AddClient.waiting_mesta)
 
@@ -464,11 +1092,14 @@ async def add_client_destination(message: types.Message, state: FSMContext):
 @dp.message(AddClient.waiting_date)
 async def add_client_date(message: types.Message, state: FSMContext):
     await state.update_data(date=message.text.strip())
-    await message.answer("✍️ Yuk rasmi (URL) kiriting yoki o'tkazib yuboring:")
+    await message.answer("✍️ Yuk rasmini yuboring yoki rasm URL manzilini kiriting (yoki o'tkazib yuboring):")
     await state.set_state(AddClient.waiting_image)
 
 @dp.message(AddClient.waiting_image)
 async def add_client_image(message: types.Message, state: FSMContext):
+    if not is_admin(message):
+        await state.clear()
+        return
     data = await state.get_data()
     cid = data["id"]
     new_data = {
@@ -480,73 +1111,574 @@ async def add_client_image(message: types.Message, state: FSMContext):
         "date": data["date"],
         "image": message.text.strip() if message.text else ""
     }
-    save_client(cid, new_data)
-    await message.answer(f"✅ Mijoz qo‘shildi: {cid}", reply_markup=admin_menu())
+    if message.photo:
+        # uploaded photo: its file_id is all that is needed to send it again
+        new_data["image_file_id"] = message.photo[-1].file_id
+    if await save_client(cid, new_data, actor=message.from_user.id):
+        await message.answer(f"✅ Mijoz qo‘shildi: {cid}", reply_markup=admin_menu())
+    else:
+        await message.answer(WRITE_FAILED_TEXT, reply_markup=admin_menu())
     await state.clear()
 
 @dp.message(F.text == "➖ Mijozni o'chirish")
 async def delete_client_start(message: types.Message, state: FSMContext):
+    if not is_admin(message):
+        return
     await message.answer("✍️ O‘chiriladigan mijoz ID sini kiriting:")
     await state.set_state(DeleteClient.waiting_code)
 
 @dp.message(DeleteClient.waiting_code)
 async def delete_client_code(message: types.Message, state: FSMContext):
+    if not is_admin(message):
+        await state.clear()
+        return
     cid = message.text.strip()
-    if cid in clients:
-        delete_client(cid)
-        await message.answer(f"✅ Mijoz o‘chirildi: {cid}", reply_markup=admin_menu())
+    if cid in clients and not can_edit(message.from_user.id, clients[cid].branch):
+        await message.answer(OTHER_BRANCH_TEXT, reply_markup=admin_menu())
+    elif cid in clients:
+        if await delete_client(cid, actor=message.from_user.id):
+            await message.answer(f"✅ Mijoz o‘chirildi: {cid}", reply_markup=admin_menu())
+        else:
+            await message.answer(WRITE_FAILED_TEXT, reply_markup=admin_menu())
     else:
         await message.answer("❌ Bunday mijoz topilmadi")
     await state.clear()
 
+@dp.message(F.text == "📥 Mijozlarni import qilish")
+async def import_clients_start(message: types.Message, state: FSMContext):
+    if not is_admin(message):
+        return
+    await message.answer(
+        "📎 Mijozlar jadvalini .csv yoki .xlsx fayl qilib yuboring.\n"
+        "Birinchi qatorda ustun nomlari: id, party, mesta, kub, kg, destination, date, image\n"
+        "(id va party majburiy).")
+    await state.set_state(ImportClients.waiting_file)
+
+@dp.message(ImportClients.waiting_file, F.document)
+async def import_clients_file(message: types.Message, state: FSMContext):
+    doc = message.document
+    suffix = os.path.splitext(doc.file_name or "")[1].lower()
+    if suffix not in (".csv", ".xlsx"):
+        await message.answer("❌ Faqat .csv yoki .xlsx fayl qabul qilinadi.")
+        return
+    if (doc.file_size or 0) > IMPORT_MAX_BYTES:
+        await message.answer("❌ Fayl juda katta (20 MB dan oshmasin).")
+        return
+    await state.clear()
+    fd, path = tempfile.mkstemp(prefix="import-", suffix=suffix)
+    os.close(fd)
+    try:
+        await bot.download(doc, destination=path)
+        # parsing runs off the event loop; ids are checked against the live cache
+        result = await asyncio.to_thread(read_clients, path, clients, IMPORT_MAX_ROWS)
+    except ImportFormatError as e:
+        await message.answer(f"❌ {e}", reply_markup=admin_menu())
+        return
+    except Exception as e:
+        logger.exception("Client import failed: %s", e)
+        await message.answer("⚠️ Faylni o‘qib bo‘lmadi.", reply_markup=admin_menu())
+        return
+    finally:
+        os.remove(path)
+    # a client may have been added while the file was being read
+    accepted = []
+    for cid, data in result.accepted:
+        if cid in clients:
+            result.rejected.append((0, f"{cid}: bunday ID allaqachon mavjud"))
+        elif not can_edit(message.from_user.id, client_branch(data, message.from_user.id)):
+            result.rejected.append((0, f"{cid}: {data.get('party')} boshqa filial partiyasi"))
+        else:
+            accepted.append((cid, data))
+    if accepted and not await save_clients(accepted, actor=message.from_user.id):
+        await message.answer(WRITE_FAILED_TEXT, reply_markup=admin_menu())
+        return
+    text = f"📥 Import yakunlandi\n✅ Qo‘shildi: {len(accepted)}\n❌ Rad etildi: {len(result.rejected)}"
+    if result.rejected:
+        lines = [f"{line}-qator: {reason}" if line else reason
+                 for line, reason in result.rejected[:IMPORT_MAX_ERRORS]]
+        if len(result.rejected) > IMPORT_MAX_ERRORS:
+            lines.append(f"… va yana {len(result.rejected) - IMPORT_MAX_ERRORS} ta")
+        text += "\n\n" + "\n".join(lines)
+    await message.answer(text[:4000], reply_markup=admin_menu())
+
+@dp.message(ImportClients.waiting_file)
+async def import_clients_not_file(message: types.Message, state: FSMContext):
+    if message.text == "⬅️ Ortga":
+        await state.clear()
+        await message.answer("⬅️ Bekor qilindi", reply_markup=admin_menu())
+        return
+    await message.answer("📎 Iltimos, .csv yoki .xlsx faylni hujjat sifatida yuboring.")
+
+@dp.message(F.text == "📦 Partiya hisoboti")
+async def party_report_start(message: types.Message, state: FSMContext):
+    if not is_admin(message):
+        return
+    await message.answer("✍️ Hisobot uchun partiya kodini kiriting:")
+    await state.set_state(PartyReport.waiting_code)
+
+@dp.message(PartyReport.waiting_code)
+async def party_report(message: types.Message, state: FSMContext):
+    code = message.text.strip()
+    summary = party_index.summary(code)
+    if code not in parties and summary is None:
+        await message.answer("❌ Bunday partiya topilmadi")
+        await state.clear()
+        return
+    ids = sorted(party_index.clients_of(code))
+    text = f"📦 Partiya: {code}\n"
+    if len(BRANCHES) > 1:
+        text += f"🏢 Filial: {party_branch(code)}\n"
+    text += (
+        f"📍 Status: {party_status(code)}\n"
+        f"👥 Mijozlar: {summary.clients if summary else 0}\n"
+        f"📦 Mesta: {format_number(summary.mesta) if summary else 0}\n"
+        f"📦 Kub: {format_number(summary.kub) if summary else 0}\n"
+        f"⚖️ Kg: {format_number(summary.kg) if summary else 0}\n"
+    )
+    if ids:
+        shown = ", ".join(ids[:REPORT_MAX_IDS])
+        more = f" (+{len(ids) - REPORT_MAX_IDS})" if len(ids) > REPORT_MAX_IDS else ""
+        text += f"🆔 {shown}{more}"
+    await send_long_message(message.chat.id, text, bot)
+    await state.clear()
+
+def totals_line(t: Totals) -> str:
+    return (f"{t.clients} mijoz, {format_number(t.mesta)} mesta, "
+            f"{format_number(t.kub)} kub, {format_number(t.kg)} kg")
+
+def stats_text() -> str:
+    # everything below reads the incrementally kept aggregates; nothing scans clients
+    lines = ["📊 Statistika", "👥 Jami: " + totals_line(stats_index.total()), "", "📍 Status bo‘yicha:"]
+    for status, t in sorted(stats_index.by_status.items(), key=lambda item: -item[1].clients):
+        lines.append(f"- {status or '—'}: {totals_line(t)}")
+    destinations = sorted(stats_index.by_destination.items(), key=lambda item: -item[1].clients)
+    lines += ["", f"🛣 Manzil bo‘yicha (eng ko‘p {STATS_MAX_ROWS} ta):"]
+    for destination, t in destinations[:STATS_MAX_ROWS]:
+        lines.append(f"- {destination or '—'}: {totals_line(t)}")
+    months = sorted((m for m in stats_index.by_month if m), reverse=True)[:STATS_MAX_ROWS]
+    if months:
+        lines += ["", "📅 Oylar bo‘yicha:"]
+        for month in months:
+            lines.append(f"- {month}: {totals_line(stats_index.by_month[month])}")
+        lines.append(f"📅 {months[-1]} — {months[0]}: {totals_line(stats_index.months(months[-1], months[0]))}")
+    undated = stats_index.by_month.get("")
+    if undated:
+        lines.append(f"📅 Sanasiz: {totals_line(undated)}")
+    lines += ["", "📅 Oraliq bo‘yicha: /stats 2024-01 2024-03"]
+    return "\n".join(lines)
+
+def parse_month(text: str) -> str:
+    """"2024-03", "2024.3" or "03.2024" -> "2024-03"; "" if it is not a month."""
+    return month_of(text) or month_of("01." + text)
+
+def stats_range_text(first: str, last: str) -> str:
+    if first > last:
+        first, last = last, first
+    lines = ["📊 Statistika: " + (first if first == last else f"{first} — {last}")]
+    for month in sorted(m for m in stats_index.by_month if m and first <= m <= last):
+        lines.append(f"- {month}: {totals_line(stats_index.by_month[month])}")
+    lines.append("👥 Jami: " + totals_line(stats_index.months(first, last)))
+    return "\n".join(lines)
+
+@dp.message(F.text == "📊 Statistika")
+async def show_stats(message: types.Message):
+    if not is_admin(message):
+        return
+    if not is_global_admin(message):
+        await message.answer(GLOBAL_ONLY_TEXT)
+        return
+    if not clients:
+        await message.answer("❌ Mijozlar mavjud emas")
+        return
+    await send_long_message(message.chat.id, stats_text(), bot)
+
+@dp.message(F.text.startswith("/stats"))
+async def stats_command(message: types.Message):
+    """/stats 2024-01 2024-03: totals of a range of months; /stats 2024-03: one month."""
+    if not is_admin(message):
+        return
+    if not is_global_admin(message):
+        await message.answer(GLOBAL_ONLY_TEXT)
+        return
+    args = message.text.split()[1:]
+    months = [parse_month(arg) for arg in args]
+    if not args:
+        await send_long_message(message.chat.id, stats_text(), bot)
+    elif len(args) > 2 or not all(months):
+        await message.answer("✍️ Masalan: /stats 2024-01 2024-03 yoki /stats 03.2024")
+    else:
+        await send_long_message(message.chat.id, stats_range_text(months[0], months[-1]), bot)
+
+# ---------- Event log: journal, undo, replay ----------
+class UndoEvent(CallbackData, prefix="undo"):
+    seq: int
+
+def describe_event(e) -> str:
+    who = f"admin {e.admin}" if e.admin is not None else "jadval"
+    if e.kind == "party_add":
+        what = f"📦 {e.key} qo‘shildi ({event_status(e)})"
+    elif e.kind == "party_status":
+        what = f"📍 {e.key}: {e.data['old'] or '—'} → {event_status(e)}"
+    elif e.kind == "party_delete":
+        what = f"🗑 {e.key} partiya o‘chirildi"
+    elif e.kind == "client_add":
+        what = f"👤 {e.key} mijoz qo‘shildi ({e.party})"
+    else:
+        what = f"🗑 {e.key} mijoz o‘chirildi ({e.party})"
+    return f"#{e.seq} {event_time(e.ts)} {who}: {what}"
+
+def client_has(cid, fields: dict) -> bool:
+    """Whether the cached client still holds `fields` (as logged by client_fields).
+    Compares fields only: the cached record also carries its branch, which events don't."""
+    return cid in clients and client_fields(clients[cid]) == fields
+
+async def undo_event(e, actor: int) -> Optional[bool]:
+    """Write the inverse of event `e`. None if the data has changed since then,
+    so undoing would overwrite a later change."""
+    kind, key, data = e.kind, e.key, e.data
+    if kind == "party_add":
+        if key not in parties or parties[key].status != data["status"]:
+            return None
+        if data.get("old") is not None:
+            return await update_party_status(key, data["old"], actor)
+        return await delete_party(key, actor)
+    if kind == "party_status":
+        if key not in parties or parties[key].status != data["new"] or data["old"] is None:
+            return None
+        return await update_party_status(key, data["old"], actor)
+    if kind == "party_delete":
+        if key in parties:
+            return None
+        return await save_party(key, data["status"], actor)
+    if kind == "client_add":
+        if not client_has(key, data["fields"]):
+            return None
+        if data.get("old"):
+            return await save_client(key, data["old"], actor)
+        return await delete_client(key, actor)
+    if kind == "client_delete":
+        if key in clients:
+            return None
+        return await save_client(key, data["fields"], actor)
+    return None
+
+async def redo_event(e, actor: int) -> Optional[bool]:
+    """Bring the data to the state event `e` left it in. None if it is already there."""
+    kind, key, data = e.kind, e.key, e.data
+    if kind == "party_add":
+        if key not in parties:
+            return await save_party(key, data["status"], actor)
+        if parties[key].status != data["status"]:
+            return await update_party_status(key, data["status"], actor)
+    elif kind == "party_status":
+        if key in parties and parties[key].status != data["new"]:
+            return await update_party_status(key, data["new"], actor)
+    elif kind == "party_delete":
+        if key in parties:
+            return await delete_party(key, actor)
+    elif kind == "client_add":
+        if not client_has(key, data["fields"]):
+            return await save_client(key, data["fields"], actor)
+    elif kind == "client_delete":
+        if key in clients:
+            return await delete_client(key, actor)
+    return None
+
+def undo_result_text(seq: int, result: Optional[bool]) -> str:
+    if result is None:
+        return f"⚠️ #{seq} dan keyin ma'lumot o‘zgargan yoki allaqachon qaytarilgan."
+    return f"↩️ #{seq} bekor qilindi." if result else WRITE_FAILED_TEXT
+
+def command_seq(text: str) -> Optional[int]:
+    """12 from "/undo 12" or "/undo #12"."""
+    parts = (text or "").split()
+    if len(parts) == 2 and parts[1].lstrip("#").isdigit():
+        return int(parts[1].lstrip("#"))
+    return None
+
+@dp.message(F.text == "🧾 O‘zgarishlar jurnali")
+async def show_journal(message: types.Message):
+    if not is_admin(message):
+        return
+    if not is_global_admin(message):
+        await message.answer(GLOBAL_ONLY_TEXT)
+        return
+    recent = list(reversed(await events.recent(JOURNAL_SIZE)))
+    if not recent:
+        await message.answer("🧾 Jurnal bo‘sh")
+        return
+    text = "🧾 Oxirgi o‘zgarishlar:\n" + "\n".join(describe_event(e) for e in recent)
+    text += "\n\n↩️ Bekor qilish: tugma yoki /undo <raqam>\n🔁 Qayta qo‘llash: /replay <raqam>"
+    buttons = [InlineKeyboardButton(text=f"↩️ #{e.seq}", callback_data=UndoEvent(seq=e.seq).pack())
+               for e in recent]
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons[i:i + 5] for i in range(0, len(buttons), 5)])
+    await message.answer(text[:4000], reply_markup=keyboard)
+
+@dp.callback_query(UndoEvent.filter())
+async def undo_button(callback: types.CallbackQuery, callback_data: UndoEvent):
+    if not is_global_admin(callback):
+        await callback.answer()
+        return
+    e = await events.get(callback_data.seq)
+    if e is None:
+        await callback.answer("❌ Topilmadi.")
+        return
+    await callback.answer()
+    await callback.message.answer(undo_result_text(e.seq, await undo_event(e, callback.from_user.id)))
+
+@dp.message(F.text.startswith("/undo"))
+async def undo_cmd(message: types.Message):
+    if not is_global_admin(message):
+        return
+    seq = command_seq(message.text)
+    e = await events.get(seq) if seq else None
+    if e is None:
+        await message.answer("✍️ Masalan: /undo 12 (raqam jurnaldan)")
+        return
+    await message.answer(undo_result_text(seq, await undo_event(e, message.from_user.id)))
+
+@dp.message(F.text.startswith("/replay"))
+async def replay_cmd(message: types.Message):
+    """Re-apply the log from the given event on, e.g. after the sheet was restored from a backup.
+    Parties and clients already in the state the log ends with are left alone."""
+    if not is_global_admin(message):
+        return
+    seq = command_seq(message.text)
+    if not seq or seq > events.last_seq:
+        await message.answer("✍️ Masalan: /replay 12 (shu raqamdan boshlab hammasi qayta qo‘llanadi)")
+        return
+    # Only the last event of each party/client matters: intermediate statuses are not
+    # written again (nor notified), and a second replay finds nothing to do.
+    latest = {}
+    last = events.last_seq  # events written by the replay itself are not replayed
+    while seq <= last:
+        batch = await events.since(seq, min(REPLAY_PAGE, last - seq + 1))
+        for e in batch:
+            latest[e.kind.split("_")[0], e.key] = e
+        seq += len(batch)
+    applied = skipped = failed = 0
+    for e in sorted(latest.values(), key=lambda e: e.seq):
+        result = await redo_event(e, message.from_user.id)
+        if result is None:
+            skipped += 1
+        elif result:
+            applied += 1
+        else:
+            failed += 1
+    await message.answer(f"🔁 Qayta qo‘llandi: {applied}\n⏭ O‘zgarishsiz: {skipped}\n⚠️ Xatolik: {failed}",
+                         reply_markup=admin_menu())
+
 @dp.message(F.text == "📋 Barcha partiyalar")
 async def list_parties(message: types.Message):
+    if not is_admin(message):
+        return
     if not parties:
         await message.answer("❌ Partiyalar mavjud emas")
         return
-    text = "📋 Partiyalar:\n"
-    for code, data in parties.items():
-        text += f"- {code}: {data.get('status','')}\n"
-    await send_long_message(message.chat.id, text, bot)
+    await send_list(message, "parties")
 
 @dp.message(F.text == "📋 Barcha mijozlar")
 async def list_clients(message: types.Message):
+    if not is_admin(message):
+        return
     if not clients:
         await message.answer("❌ Mijozlar mavjud emas")
         return
-    text = "📋 Mijozlar:\n"
-    for cid, c in clients.items():
-        text += f"- {cid}: {c.get('party','')}, {c.get('mesta','')}mesta, {c.get('kg','')}kg\n"
-    await send_long_message(message.chat.id, text, bot)
+    await send_list(message, "clients")
 
-# Run bot + http server for Render ping
-async def run_bot():
-    logger.info("Starting aiogram polling")
-    await dp.start_polling(bot)
+@dp.callback_query(ListPage.filter())
+async def list_page(callback: types.CallbackQuery, callback_data: ListPage):
+    if not is_admin(callback) or callback_data.view not in LIST_VIEWS:
+        await callback.answer()
+        return
+    text, page, total = list_view(callback_data.view, callback.from_user.id).page(callback_data.page)
+    try:
+        await callback.message.edit_text(text, reply_markup=list_keyboard(callback_data.view, page, total))
+    except TelegramBadRequest:
+        pass  # same page pressed again: "message is not modified"
+    await callback.answer()
+
+@dp.callback_query(ListExport.filter())
+async def export_list(callback: types.CallbackQuery, callback_data: ListExport):
+    if not is_admin(callback) or callback_data.view not in LIST_EXPORTS:
+        await callback.answer()
+        return
+    source, header, to_row, filename = LIST_EXPORTS[callback_data.view]
+    await callback.answer("⏳ Fayl tayyorlanmoqda...")
+    # Records are replaced, never mutated, so a shallow snapshot is safe to write from a thread.
+    items = list(source().items())
+    branch = admin_scope(callback.from_user.id)
+    if branch is not None:
+        items = [(key, record) for key, record in items if record.branch == branch]
+    path = await asyncio.to_thread(export_csv, items, header, to_row)
+    try:
+        await callback.message.answer_document(FSInputFile(path, filename=filename))
+    finally:
+        os.remove(path)
+
+# ---------- HTTP server (health, readiness, webhook) ----------
+# One aiohttp server on the event loop serves Render's health ping and, in
+# webhook mode, Telegram's updates. Webhook updates go into a bounded queue
+# drained by UPDATE_WORKERS tasks; any replica behind a load balancer can take them.
+update_queue: "asyncio.Queue[types.Update]" = asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE)
+
+async def health(request: web.Request):
+    return web.Response(text="Bot is running on Render!")
+
+async def readiness(request: web.Request):
+    # 503 until the first data snapshot is loaded; then one line per branch still warming up
+    lines = ["%s: %s" % (name or "-", state) for name, state in branch_state.items() if state != "ready"]
+    if data_ready.is_set():
+        return web.Response(text="\n".join(["ready"] + lines))
+    return web.Response(status=503, text="\n".join(["loading"] + lines))
+
+async def metrics(request: web.Request):
+    UPDATE_QUEUE_DEPTH.set(update_queue.qsize())
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+async def telegram_webhook(request: web.Request):
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        return web.Response(status=401)
+    try:
+        update = types.Update.model_validate(await request.json(), context={"bot": bot})
+    except Exception:
+        return web.Response(status=400)
+    try:
+        update_queue.put_nowait(update)
+    except asyncio.QueueFull:
+        # Telegram redelivers updates that were not answered with 2xx
+        logger.warning("Update queue full, asking Telegram to retry update %s", update.update_id)
+        return web.Response(status=503)
+    return web.Response()
+
+async def update_worker():
+    while True:
+        update = await update_queue.get()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            logger.exception("Failed to handle update %s: %s", update.update_id, e)
+        finally:
+            update_queue.task_done()
+
+def create_web_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/", health)
+    app.router.add_get("/ready", readiness)
+    app.router.add_get("/metrics", metrics)
+    if WEBHOOK_URL:
+        app.router.add_post(WEBHOOK_PATH, telegram_webhook)
+    return app
 
 async def run_server():
     PORT = int(os.environ.get("PORT", "10000"))
-    class Handler(BaseHTTPRequestHandler):
-        def do_GET(self):
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b"Bot is running on Render!")
-    server = HTTPServer(("0.0.0.0", PORT), Handler)
-    loop = asyncio.get_event_loop()
-    # run server forever in threadpool
-    await loop.run_in_executor(None, server.serve_forever)
+    runner = web.AppRunner(create_web_app())
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+    logger.info("HTTP server listening on port %s", PORT)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+async def run_bot():
+    if not WEBHOOK_URL:
+        logger.info("Starting aiogram polling")
+        # a webhook left over from webhook mode would make getUpdates fail
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+        return
+    workers = [asyncio.create_task(update_worker()) for _ in range(UPDATE_WORKERS)]
+    try:
+        # Every replica sets the same URL; the webhook is deliberately not deleted
+        # on shutdown so the other replicas keep receiving updates.
+        await bot.set_webhook(
+            WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info("Webhook set to %s%s", WEBHOOK_URL, WEBHOOK_PATH)
+        await asyncio.Event().wait()
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await bot.session.close()
+
+async def warm_branch(branch: Branch, versions: dict, tried: asyncio.Event):
+    """Connect one branch's storage and load its first snapshot, retrying with backoff
+    until both work. `tried` is set after the first attempt, whatever its outcome."""
+    name, label = branch.name, branch.name or "-"
+    delay = 1.0
+    while True:
+        try:
+            if name not in storages:
+                branch_state[name] = "connecting"
+                storages[name] = await create_storage(branch)
+            branch_state[name] = "loading"
+            # a table that failed is read again on the retry: its version was not recorded
+            if await sync_branch(name, versions):
+                branch_state[name] = "ready"
+                BRANCH_READY.set(1, branch=label)
+                tried.set()
+                return
+            logger.error("[%s] First load incomplete, retrying in %.0fs", label, delay)
+        except Exception as e:
+            logger.exception("[%s] Storage connection failed, retrying in %.0fs: %s", label, delay, e)
+        tried.set()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 60.0)
+
+_warm_tasks: Dict[str, asyncio.Task] = {}
+
+async def warm_up():
+    """Connect every branch's storage and load the first snapshots, retrying with backoff.
+    Returns (with data_ready set) once every branch has loaded or failed its first attempt
+    and at least one has loaded; the others keep retrying in the background, so one
+    unreachable spreadsheet doesn't keep the whole bot loading. Until then handlers
+    answer LOADING_TEXT and /ready returns 503.
+    Returns the storage versions loaded (branch -> version), shared with the retries."""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    versions = {}
+    tried = {b.name: asyncio.Event() for b in BRANCHES}
+    for b in BRANCHES:
+        BRANCH_READY.set(0, branch=b.name or "-")
+        _warm_tasks[b.name] = asyncio.create_task(warm_branch(b, versions, tried[b.name]))
+    await asyncio.gather(*(event.wait() for event in tried.values()))
+    while not any(state == "ready" for state in branch_state.values()):
+        await asyncio.wait(_warm_tasks.values(), return_when=asyncio.FIRST_COMPLETED)
+    data_ready.set()
+    pending = [name or "-" for name, state in branch_state.items() if state != "ready"]
+    logger.info("Data ready in %.2fs: %d branches, %d parties, %d clients%s",
+                loop.time() - started, len(BRANCHES) - len(pending), len(parties), len(clients),
+                "; still loading: " + ", ".join(pending) if pending else "")
+    return versions
 
 async def main():
-    # reload data from sheets periodically in background
+    # reconcile with storage periodically in background; a branch whose version
+    # is unchanged is not read again
     async def reload_loop():
+        versions = await warm_up()
         while True:
+            await asyncio.sleep(RELOAD_INTERVAL)
             try:
-                load_data()
+                await sync_all(versions)
             except Exception as e:
                 logger.exception("Error loading data: %s", e)
-            await asyncio.sleep(60)  # reload each 60 seconds
 
-    await asyncio.gather(run_bot(), run_server(), reload_loop())
+    await notifications.start()
+    await events.start()
+    try:
+        # the broadcaster also picks up messages left unsent by the previous run
+        await asyncio.gather(run_bot(), run_server(), reload_loop(), broadcaster.run())
+    finally:
+        await notifications.close()
+        await events.close()
+        for storage in storages.values():
+            await storage.close()
+        await fsm_storage.close()
+        for repo in sheets_repos.values():
+            repo.shutdown()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,247 @@
+# notify.py
+# Partiya statusi o'zgarganda obuna bo'lgan mijozlarga xabar yuborish.
+# Obunalar va yuborilmagan xabarlar SQLite faylida saqlanadi, shuning uchun
+# bot qayta ishga tushganda yuborish to'xtagan joyidan davom etadi.
+
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+logger = logging.getLogger("logistic-bot.notify")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    chat_id INTEGER NOT NULL,
+    kind    TEXT NOT NULL,
+    key     TEXT NOT NULL,
+    PRIMARY KEY (chat_id, kind, key)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id    INTEGER NOT NULL,
+    text       TEXT NOT NULL,
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox(not_before, id);
+"""
+
+
+class NotificationStore:
+    """Subscriptions ("party"/"client" key per chat) and the outbox of messages to send.
+
+    Subscriptions are also kept in memory, so working out the recipients of a
+    status change needs no query. All SQLite work runs on one dedicated thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="notify")
+        self._db: Optional[sqlite3.Connection] = None
+        self._subscribers: Dict[Tuple[str, str], Set[int]] = {}  # (kind, key) -> chat ids
+        self._by_chat: Dict[int, Set[Tuple[str, str]]] = {}
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    async def start(self):
+        rows = await self._run(self._open)
+        for chat_id, kind, key in rows:
+            self._remember(chat_id, kind, key)
+        logger.info("Loaded %d subscriptions", len(rows))
+
+    async def close(self):
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=True)
+
+    # ----- subscriptions -----
+    def subscriptions(self, chat_id: int) -> Set[Tuple[str, str]]:
+        return self._by_chat.get(chat_id, set())
+
+    async def subscribe(self, chat_id: int, kind: str, key: str) -> bool:
+        """False if the chat was already subscribed to it."""
+        if (kind, key) in self.subscriptions(chat_id):
+            return False
+        await self._run(self._execute, "INSERT OR IGNORE INTO subscriptions VALUES (?, ?, ?)", (chat_id, kind, key))
+        self._remember(chat_id, kind, key)
+        return True
+
+    async def unsubscribe_all(self, chat_id: int) -> Set[Tuple[str, str]]:
+        await self._run(self._execute, "DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+        removed = self._by_chat.pop(chat_id, set())
+        for sub in removed:
+            chats = self._subscribers.get(sub)
+            if chats is not None:
+                chats.discard(chat_id)
+                if not chats:
+                    del self._subscribers[sub]
+        return removed
+
+    def recipients(self, party: str, client_ids: Set[str]) -> Dict[int, List[str]]:
+        """chat id -> the subscribed client ids among `client_ids` ([] for party subscribers)."""
+        subs = self._subscribers
+        out: Dict[int, List[str]] = {chat: [] for chat in subs.get(("party", party), ())}
+        # walk whichever side is smaller: the party's clients or the subscriptions
+        if len(client_ids) <= len(subs):
+            subscribed = [cid for cid in client_ids if ("client", cid) in subs]
+        else:
+            subscribed = [key for kind, key in subs if kind == "client" and key in client_ids]
+        for cid in subscribed:
+            for chat in subs[("client", cid)]:
+                out.setdefault(chat, []).append(cid)
+        return out
+
+    # ----- outbox -----
+    async def enqueue(self, messages: List[Tuple[int, str]]):
+        await self._run(self._executemany, "INSERT INTO outbox(chat_id, text) VALUES (?, ?)", messages)
+
+    async def due(self, limit: int) -> List[Tuple[int, int, str, int]]:
+        return await self._run(self._select,
+                               "SELECT id, chat_id, text, attempts FROM outbox WHERE not_before <= ? "
+                               "ORDER BY id LIMIT ?", (time.time(), limit))
+
+    async def next_due(self) -> Optional[float]:
+        rows = await self._run(self._select, "SELECT MIN(not_before) FROM outbox", ())
+        return rows[0][0] if rows else None
+
+    async def pending(self) -> int:
+        return (await self._run(self._select, "SELECT COUNT(*) FROM outbox", ()))[0][0]
+
+    async def done(self, ids: Iterable[int]):
+        await self._run(self._executemany, "DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+    async def postpone(self, rows: Iterable[Tuple[int, int, float]]):
+        """rows of (id, attempts, not_before)."""
+        await self._run(self._executemany, "UPDATE outbox SET attempts = ?, not_before = ? WHERE id = ?",
+                        [(attempts, not_before, i) for i, attempts, not_before in rows])
+
+    # ----- blocking helpers (run on the notify thread) -----
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(_SCHEMA)
+        self._db = db
+        return db.execute("SELECT chat_id, kind, key FROM subscriptions").fetchall()
+
+    def _execute(self, sql, params):
+        with self._db:
+            self._db.execute(sql, params)
+
+    def _executemany(self, sql, rows):
+        with self._db:
+            self._db.executemany(sql, rows)
+
+    def _select(self, sql, params):
+        return self._db.execute(sql, params).fetchall()
+
+    def _remember(self, chat_id, kind, key):
+        self._subscribers.setdefault((kind, key), set()).add(chat_id)
+        self._by_chat.setdefault(chat_id, set()).add((kind, key))
+
+
+class Broadcaster:
+    """Drains the outbox within Telegram's limits.
+
+    At most `rate` messages per second overall and one per `per_chat` seconds
+    to the same chat; a message for a chat that is not ready yet is postponed
+    rather than waited for. A RetryAfter from Telegram pauses all sending for
+    the time it asks. Messages leave the outbox once sent, so after a restart
+    sending resumes with what is left (a message sent just before a crash may
+    go out twice). Chats that blocked the bot are unsubscribed.
+    """
+
+    def __init__(self, store: NotificationStore, send: Callable[[int, str], Awaitable],
+                 rate: float = 25.0, per_chat: float = 1.0, batch: int = 50, max_attempts: int = 5,
+                 on_sent: Optional[Callable[[str], None]] = None):
+        self.store = store
+        self.send = send
+        self.interval = 1.0 / rate
+        self.per_chat = per_chat
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.on_sent = on_sent or (lambda result: None)
+        self._wakeup = asyncio.Event()
+        self._last_sent: Dict[int, float] = {}
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                sent = await self._drain_once()
+            except Exception as e:
+                logger.exception("Broadcast round failed: %s", e)
+                sent = 0
+            if sent:
+                continue
+            self._wakeup.clear()  # before the query, so an enqueue during it still wakes us
+            next_due = await self.store.next_due()
+            timeout = 60.0 if next_due is None else min(60.0, max(0.05, next_due - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _drain_once(self) -> int:
+        rows = await self.store.due(self.batch)
+        done, postponed = [], []
+        next_slot = time.monotonic()
+        try:
+            for msg_id, chat_id, text, attempts in rows:
+                now = time.monotonic()
+                ready_at = self._last_sent.get(chat_id, 0.0) + self.per_chat
+                if ready_at > now:
+                    postponed.append((msg_id, attempts, time.time() + ready_at - now))
+                    continue
+                if next_slot > now:
+                    await asyncio.sleep(next_slot - now)
+                try:
+                    await self.send(chat_id, text)
+                except TelegramRetryAfter as e:
+                    logger.warning("Telegram asked to wait %ss, pausing broadcast", e.retry_after)
+                    await asyncio.sleep(e.retry_after)
+                    break  # this message is still due; the next round sends it
+                except (TelegramForbiddenError, TelegramBadRequest) as e:
+                    # blocked the bot / chat gone: nothing will ever be delivered there
+                    logger.info("Dropping notifications for chat %s: %s", chat_id, e)
+                    await self.store.unsubscribe_all(chat_id)
+                    done.append(msg_id)
+                    self.on_sent("dropped")
+                    continue
+                except Exception as e:
+                    attempts += 1
+                    if attempts >= self.max_attempts:
+                        logger.warning("Giving up on notification %s to %s: %s", msg_id, chat_id, e)
+                        done.append(msg_id)
+                        self.on_sent("failed")
+                    else:
+                        postponed.append((msg_id, attempts, time.time() + min(300.0, 5.0 * 2 ** attempts)))
+                    continue
+                finally:
+                    next_slot = time.monotonic() + self.interval
+                self._last_sent[chat_id] = time.monotonic()
+                done.append(msg_id)
+                self.on_sent("sent")
+        finally:
+            if done:
+                await self.store.done(done)
+            if postponed:
+                await self.store.postpone(postponed)
+            self._forget_idle_chats()
+        return len(done)
+
+    def _forget_idle_chats(self):
+        if len(self._last_sent) > 10000:
+            cutoff = time.monotonic() - self.per_chat
+            self._last_sent = {c: t for c, t in self._last_sent.items() if t > cutoff}
@@ -0,0 +1,90 @@
+# paging.py
+# "Barcha partiyalar" / "Barcha mijozlar" ro'yxatlari uchun sahifalash va CSV eksport.
+# Butun ro'yxat bitta katta matnga yig'ilmaydi: faqat so'ralgan sahifa render qilinadi
+# va ma'lumot o'zgarmaguncha keshda saqlanadi.
+
+import csv
+import os
+import tempfile
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Telegram message limit is 4096 characters; leave room for the header line
+MAX_PAGE_CHARS = 3800
+
+
+class PagedList:
+    """Pages of one cached dict, rendered on demand and kept until the dict changes.
+
+    `source()` returns the dict and `version()` a counter bumped on every change
+    of it. Taking the key list is one C-level copy; only the requested page is
+    rendered, so a page costs O(page_size) however large the dict is.
+    `keep(record)`, if given, limits the list to matching records (one branch's rows).
+    """
+
+    def __init__(self, title: str, source: Callable[[], dict], version: Callable[[], int],
+                 render: Callable[[str, dict], str], page_size: int = 50,
+                 keep: Optional[Callable[[object], bool]] = None):
+        self.title = title
+        self.source = source
+        self.version = version
+        self.render = render
+        self.page_size = page_size
+        self.keep = keep
+        self._seen = None
+        self._keys: List[str] = []
+        self._pages: Dict[int, str] = {}
+
+    def _refresh(self):
+        version = self.version()
+        if version != self._seen:
+            data = self.source()
+            self._keys = list(data) if self.keep is None else [k for k, r in data.items() if self.keep(r)]
+            self._pages = {}
+            self._seen = version
+
+    def page_count(self) -> int:
+        self._refresh()
+        return max(1, -(-len(self._keys) // self.page_size))
+
+    def page(self, number: int) -> Tuple[str, int, int]:
+        """(text, page number actually shown, total pages); `number` is clamped."""
+        total = self.page_count()
+        number = min(max(number, 0), total - 1)
+        text = self._pages.get(number)
+        if text is None:
+            data = self.source()
+            start = number * self.page_size
+            lines = [f"{self.title} ({number + 1}/{total}):"]
+            size = len(lines[0])
+            for key in self._keys[start:start + self.page_size]:
+                record = data.get(key)
+                if record is None:
+                    continue
+                line = self.render(key, record)
+                if size + len(line) + 1 > MAX_PAGE_CHARS:
+                    lines.append("…")
+                    break
+                lines.append(line)
+                size += len(line) + 1
+            text = self._pages[number] = "\n".join(lines)
+        return text, number, total
+
+
+def export_csv(items: Iterable[Tuple[str, dict]], header: Sequence[str],
+               to_row: Callable[[str, dict], Sequence]) -> str:
+    """Write rows one by one to a temporary CSV file and return its path.
+
+    Memory use does not grow with the number of rows. The caller deletes the file.
+    utf-8-sig makes Excel open Cyrillic/Uzbek text correctly.
+    """
+    fd, path = tempfile.mkstemp(prefix="export-", suffix=".csv")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for key, record in items:
+                writer.writerow(to_row(key, record))
+    except Exception:
+        os.unlink(path)
+        raise
+    return path
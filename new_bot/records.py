@@ -0,0 +1,154 @@
+# records.py
+# Keshdagi partiya va mijoz yozuvlari: lug'at o'rniga __slots__ li ixcham obyektlar.
+# Sonlar (mesta/kub/kg) bir marta float'ga aylantiriladi, takrorlanuvchi satrlar (status, partiya,
+# manzil, sana) intern qilinadi, shuning uchun 100k+ qatorda xotira ancha kam ketadi.
+
+import math
+import sys
+from typing import Dict, List, Optional, Sequence, Union
+
+PARTY_COLUMNS = ["code", "status"]
+# image_file_id: Telegram file_id of the image, so repeat sends need no download
+CLIENT_COLUMNS = ["id", "party", "mesta", "kub", "kg", "destination", "date", "image", "image_file_id"]
+NUMBER_FIELDS = ("mesta", "kub", "kg")
+
+# float, None for an empty cell, or the text as typed if it isn't a number ("12 ta")
+Number = Union[float, str, None]
+
+
+def _text(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def _shared(value) -> str:
+    # statuses, party codes, destinations and dates repeat across thousands of rows
+    return sys.intern(_text(value))
+
+
+def to_number(value) -> Number:
+    """Cell -> float; accepts "1,5" and "1 500". Empty -> None; other text is kept as is,
+    including "nan", "inf" and overflowing values like "1e400", which float() would accept."""
+    if isinstance(value, (int, float)) and math.isfinite(value):
+        return float(value)
+    text = _text(value)
+    if not text:
+        return None
+    try:
+        number = float(text.replace(" ", "").replace(",", "."))
+    except ValueError:
+        return text
+    return number if math.isfinite(number) else text
+
+
+def format_number(value: Number) -> str:
+    """Inverse of to_number, for messages and for writing back to the sheet."""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        value = round(value, 3)  # also hides float drift in summed totals ("-0.000")
+        if value == int(value):
+            return str(int(value))
+        return ("%.3f" % value).rstrip("0").rstrip(".")
+    return value
+
+
+class Party:
+    __slots__ = ("status", "branch")
+
+    def __init__(self, status="", branch=""):
+        self.status = _shared(status)
+        self.branch = _shared(branch)  # storage shard it lives in (see branches.py); not a sheet column
+
+    def __eq__(self, other):
+        return isinstance(other, Party) and self.status == other.status and self.branch == other.branch
+
+    def __repr__(self):
+        return "Party(status=%r, branch=%r)" % (self.status, self.branch)
+
+
+class Client:
+    """One client row. Records in the cache are replaced, never mutated (see `replace`)."""
+
+    __slots__ = ("party", "mesta", "kub", "kg", "destination", "date", "image", "image_file_id", "branch")
+
+    def __init__(self, party="", mesta=None, kub=None, kg=None, destination="", date="", image="",
+                 image_file_id="", branch=""):
+        self.party = _shared(party)
+        self.mesta = to_number(mesta)
+        self.kub = to_number(kub)
+        self.kg = to_number(kg)
+        self.destination = _shared(destination)
+        self.date = _shared(date)
+        self.image = _text(image)
+        self.image_file_id = _text(image_file_id)
+        self.branch = _shared(branch)
+
+    def replace(self, **changes) -> "Client":
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return Client(**values)
+
+    def __eq__(self, other):
+        return isinstance(other, Client) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return "Client(%s)" % ", ".join("%s=%r" % (name, getattr(self, name)) for name in self.__slots__)
+
+
+def client_record(data, branch="") -> Client:
+    """Client from a dict of column -> value (a handler's FSM data, an imported row)."""
+    return Client(**{col: data.get(col, "") for col in CLIENT_COLUMNS[1:]}, branch=branch)
+
+
+def client_row(cid, record: Client) -> list:
+    """Sheet/CSV row of a client, in CLIENT_COLUMNS order."""
+    return [cid] + [format_number(getattr(record, col)) if col in NUMBER_FIELDS else getattr(record, col)
+                    for col in CLIENT_COLUMNS[1:]]
+
+
+def _positions(header: Sequence[str], columns: List[str]) -> List[Optional[int]]:
+    names = [_text(name) for name in header]
+    return [names.index(col) if col in names else None for col in columns]
+
+
+def parse_parties(values: List[list], branch: str = "") -> Dict[str, Party]:
+    """`values` as returned by Worksheet.get_all_values(): header row first."""
+    if not values:
+        return {}
+    code_at, status_at = _positions(values[0], PARTY_COLUMNS)
+    parties = {}
+    if code_at is None:
+        return parties
+    for row in values[1:]:
+        code = _text(row[code_at]) if code_at < len(row) else ""
+        if code:
+            parties[code] = Party(row[status_at] if status_at is not None and status_at < len(row) else "", branch)
+    return parties
+
+
+def parse_clients(values: List[list], branch: str = "") -> Dict[str, Client]:
+    """Same for the clients sheet; one pass, no per-row dict."""
+    if not values:
+        return {}
+    positions = _positions(values[0], CLIENT_COLUMNS)
+    id_at, fields = positions[0], positions[1:]
+    clients = {}
+    if id_at is None:
+        return clients
+    for row in values[1:]:
+        width = len(row)
+        cid = _text(row[id_at]) if id_at < width else ""
+        if cid:
+            clients[cid] = Client(*[row[i] if i is not None and i < width else "" for i in fields], branch=branch)
+    return clients
+
+
+def row_keys(values: List[list], column: str) -> List[str]:
+    """Key column of every data row, blank rows included (for RowIndex.rebuild)."""
+    if not values:
+        return []
+    at = _positions(values[0], [column])[0]
+    if at is None:
+        return [""] * (len(values) - 1)
+    return [_text(row[at]) if at < len(row) else "" for row in values[1:]]
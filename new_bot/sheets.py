@@ -0,0 +1,356 @@
+# sheets.py
+# Google Sheets uchun async qatlam.
+# gspread sinxron kutubxona: har bir chaqiruv cheklangan thread pool'da bajariladi,
+# shuning uchun sekin Sheets so'rovi boshqa chatlarning javoblarini to'xtatib qo'ymaydi.
+
+import asyncio
+import logging
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import groupby
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from gspread.exceptions import APIError
+from gspread.utils import rowcol_to_a1
+
+from metrics import SHEETS_CALLS, SHEETS_ERRORS, SHEETS_LATENCY
+from records import row_keys
+
+logger = logging.getLogger("logistic-bot.sheets")
+
+
+class SheetsRepository:
+    """Runs blocking gspread calls off the event loop.
+
+    Calls share a bounded thread pool (so a burst of admin writes cannot
+    exhaust threads or the API quota) and every call is awaited with a timeout.
+    On timeout or cancellation the awaiting handler is released immediately;
+    a call that already started in a worker thread is left to finish there.
+    """
+
+    def __init__(self, max_workers: int = 4, timeout: float = 30.0):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sheets")
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        op = getattr(func, "__name__", "call")
+        SHEETS_CALLS.inc(op=op)
+        start = loop.time()
+        fut = loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(fut, self.timeout)
+        except asyncio.TimeoutError:
+            SHEETS_ERRORS.inc(op=op, error="timeout")
+            raise
+        except APIError as e:
+            SHEETS_ERRORS.inc(op=op, error=str(e.code))
+            raise
+        except Exception as e:
+            SHEETS_ERRORS.inc(op=op, error=type(e).__name__)
+            raise
+        finally:
+            SHEETS_LATENCY.observe(loop.time() - start, op=op)
+
+    def lock(self, ws) -> asyncio.Lock:
+        # Mutations of one worksheet are serialized: a delete computes its row
+        # number from the current sheet layout, so two of them must not interleave.
+        key = getattr(ws, "title", str(id(ws)))
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RowIndex:
+    """Maps a key (party code / client id) to its 1-based row number in a worksheet.
+
+    Rebuilt from every full read of the sheet and kept in step with the bot's own
+    appends and deletes, so a single-row mutation needs no sheet download.
+    Keys are stored in row order: ``delete_rows`` moves every row below the
+    deleted one up by one, and :meth:`deleted` applies the same shift.
+    If a key occurs twice, the first row wins, as in the old linear scan.
+    """
+
+    def __init__(self, first_row: int = 2):
+        self.first_row = first_row  # row 1 is the header
+        self._keys: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self.stale = True
+
+    def rebuild(self, keys: Iterable[Optional[str]]):
+        self._keys = [k or None for k in keys]
+        self._rows = {}
+        for pos, key in enumerate(self._keys):
+            if key is not None and key not in self._rows:
+                self._rows[key] = pos + self.first_row
+        self.stale = False
+
+    def get(self, key: str) -> Optional[int]:
+        if self.stale:
+            return None
+        return self._rows.get(key)
+
+    def appended(self, key: str, row: Optional[int]):
+        expected = len(self._keys) + self.first_row
+        if self.stale or row is None or row < expected:
+            # We can't tell where the row landed; the next lookup rescans the sheet.
+            self.stale = True
+            return
+        # Sheets may append below blank rows the bot never saw; pad for them.
+        self._keys.extend([None] * (row - expected))
+        self._keys.append(key)
+        self._rows.setdefault(key, row)
+
+    def deleted(self, row: int):
+        pos = row - self.first_row
+        if self.stale or not 0 <= pos < len(self._keys):
+            self.stale = True
+            return
+        key = self._keys.pop(pos)
+        if key is not None and self._rows.get(key) == row:
+            del self._rows[key]
+        for i in range(pos, len(self._keys)):
+            k = self._keys[i]
+            if k is None:
+                continue
+            current = self._rows.get(k)
+            # rows below moved up by one; a duplicate of the deleted key becomes the first one
+            if current is None or current == i + self.first_row + 1:
+                self._rows[k] = i + self.first_row
+
+
+_UPDATED_RANGE_ROW = re.compile(r"![A-Z]*(\d+)")
+
+
+def appended_row(response) -> Optional[int]:
+    """First row number of an ``append_row(s)`` result, from ``updates.updatedRange`` ("clients!A5:H7")."""
+    try:
+        updated = response["updates"]["updatedRange"]
+    except (TypeError, KeyError):
+        return None
+    match = _UPDATED_RANGE_ROW.search(updated)
+    return int(match.group(1)) if match else None
+
+
+def is_retryable(exc: BaseException, idempotent: bool = True) -> bool:
+    """Quota (429) errors are worth retrying: Sheets rejected the request. Server-side (5xx)
+    errors only for calls that can safely run twice: a 500 may arrive after an append or a
+    row delete was committed, and repeating it would add the rows again or delete the rows
+    that moved up. Anything else is a real failure."""
+    if not isinstance(exc, APIError):
+        return False
+    return exc.code == 429 or (idempotent and exc.code >= 500)
+
+
+class _Op:
+    __slots__ = ("kind", "key", "values", "col", "future")
+
+    def __init__(self, kind: str, key: str, values=None, col: int = 0):
+        self.kind = kind
+        self.key = key
+        self.values = values
+        self.col = col
+        self.future: Optional[asyncio.Future] = None
+
+
+class SheetWriter:
+    """Collects mutations of one worksheet and applies them in batches.
+
+    Operations queued within ``window`` seconds are flushed together, keeping
+    their order: a run of appends becomes one ``append_rows``, a run of cell
+    updates one ``batch_update`` (repeated updates of the same cell are merged,
+    the last value wins) and a run of deletes one spreadsheet ``batch_update``
+    with ``deleteDimension`` requests; an upsert rewrites the key's row in place or
+    appends it if the key is not in the sheet. Quota and 5xx errors are retried with
+    exponential backoff; appends and row deletes only on quota errors, see
+    :func:`is_retryable`. Each ``append``/``update``/``delete`` call returns once
+    its operation is applied: True if it touched a row, False if the key was
+    not found. If the batch failed, the call raises the error.
+    """
+
+    def __init__(self, repo: SheetsRepository, ws, index: RowIndex, key_field: str,
+                 window: float = 0.3, max_batch: int = 500, max_retries: int = 5):
+        self.repo = repo
+        self.ws = ws
+        self.index = index
+        self.key_field = key_field
+        self.window = window
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self._pending: List[_Op] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    # ----- public API -----
+    async def append(self, key: str, values: list) -> bool:
+        return await self._submit(_Op("append", key, values=values))
+
+    async def update(self, key: str, col: int, value) -> bool:
+        return await self._submit(_Op("update", key, values=value, col=col))
+
+    async def delete(self, key: str) -> bool:
+        return await self._submit(_Op("delete", key))
+
+    async def upsert(self, key: str, values: list) -> bool:
+        return await self._submit(_Op("upsert", key, values=values))
+
+    async def upsert_many(self, rows: Iterable[Tuple[str, list]]) -> List[bool]:
+        # queued together, so new keys go out as one append_rows per max_batch rows
+        futures = [self._submit(_Op("upsert", key, values=values)) for key, values in rows]
+        return list(await asyncio.gather(*futures))
+
+    async def find_row(self, key: str, rescan: bool = True) -> Optional[int]:
+        """Row number of `key`. Falls back to one full read (which also rebuilds the
+        index) when the index is stale or, with `rescan`, when the key is unknown,
+        e.g. the row was typed into the sheet by hand.
+        Must be called with the worksheet lock held."""
+        row = self.index.get(key)
+        if row is None and (rescan or self.index.stale):
+            # get_all_values, not get_all_records: the latter turns ids like "0123" into 123
+            values = await self._call(self.ws.get_all_values)
+            self.index.rebuild(row_keys(values, self.key_field))
+            row = self.index.get(key)
+        return row
+
+    async def stop(self):
+        """Flush what is queued and stop the background task."""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    # ----- internals -----
+    def _submit(self, op: _Op) -> asyncio.Future:
+        op.future = asyncio.get_running_loop().create_future()
+        self._pending.append(op)
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return op.future
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if not self._closing:
+                await asyncio.sleep(self.window)
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            if not self._pending:
+                self._wakeup.clear()
+            if batch:
+                await self._flush(batch)
+            if self._closing and not self._pending:
+                return
+
+    async def _call(self, func: Callable[..., Any], *args, idempotent: bool = True, **kwargs) -> Any:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.repo.call(func, *args, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e, idempotent):
+                    raise
+                delay = min(30.0, 0.5 * 2 ** attempt) + random.uniform(0, 0.5)
+                logger.warning("Sheets %s failed (%s), retrying in %.1fs", getattr(func, "__name__", func), e, delay)
+                await asyncio.sleep(delay)
+
+    async def _flush(self, batch: List[_Op]):
+        async with self.repo.lock(self.ws):
+            for kind, group in groupby(batch, key=lambda op: op.kind):
+                ops = list(group)
+                try:
+                    results = await getattr(self, "_apply_" + kind)(ops)
+                except Exception as e:
+                    logger.exception("Failed to apply %d %s operation(s) to %s", len(ops), kind, self.ws.title)
+                    for op in ops:
+                        if not op.future.done():
+                            op.future.set_exception(e)
+                    continue
+                for op, ok in zip(ops, results):
+                    if not op.future.done():
+                        op.future.set_result(ok)
+
+    async def _append_rows(self, rows: List[list]):
+        try:
+            return await self._call(self.ws.append_rows, rows, idempotent=False)
+        except Exception:
+            # the rows may have landed anyway; don't trust row numbers until the next full read
+            self.index.stale = True
+            raise
+
+    async def _apply_append(self, ops: List[_Op]) -> List[bool]:
+        resp = await self._append_rows([op.values for op in ops])
+        first = appended_row(resp)
+        for i, op in enumerate(ops):
+            self.index.appended(op.key, first + i if first is not None else None)
+        return [True] * len(ops)
+
+    async def _apply_update(self, ops: List[_Op]) -> List[bool]:
+        cells: Dict[Tuple[int, int], Any] = {}
+        results = []
+        for op in ops:
+            row = await self.find_row(op.key)
+            results.append(row is not None)
+            if row is not None:
+                cells[(row, op.col)] = op.values  # later updates of the same cell win
+        if cells:
+            data = [{"range": rowcol_to_a1(r, c), "values": [[v]]} for (r, c), v in cells.items()]
+            await self._call(self.ws.batch_update, data)
+        return results
+
+    async def _apply_upsert(self, ops: List[_Op]) -> List[bool]:
+        latest: Dict[str, list] = {}
+        for op in ops:
+            latest[op.key] = op.values  # later upserts of the same key win
+        cells = []
+        new_rows: List[Tuple[str, list]] = []
+        for key, values in latest.items():
+            row = await self.find_row(key, rescan=False)
+            if row is None:
+                new_rows.append((key, values))
+            else:
+                rng = "%s:%s" % (rowcol_to_a1(row, 1), rowcol_to_a1(row, len(values)))
+                cells.append({"range": rng, "values": [values]})
+        if cells:
+            await self._call(self.ws.batch_update, cells)
+        if new_rows:
+            resp = await self._append_rows([values for _, values in new_rows])
+            first = appended_row(resp)
+            for i, (key, _) in enumerate(new_rows):
+                self.index.appended(key, first + i if first is not None else None)
+        return [True] * len(ops)
+
+    async def _apply_delete(self, ops: List[_Op]) -> List[bool]:
+        rows: Dict[str, Optional[int]] = {}
+        for op in ops:
+            if op.key not in rows:
+                rows[op.key] = await self.find_row(op.key)
+        # bottom-up, so deleting one row doesn't move the others in the same request
+        targets = sorted({r for r in rows.values() if r is not None}, reverse=True)
+        if targets:
+            requests = [{
+                "deleteDimension": {
+                    "range": {"sheetId": self.ws.id, "dimension": "ROWS", "startIndex": r - 1, "endIndex": r}
+                }
+            } for r in targets]
+            try:
+                # not idempotent: repeating a delete that did land removes the rows that moved up
+                await self._call(self.ws.spreadsheet.batch_update, {"requests": requests}, idempotent=False)
+            except Exception:
+                # on a 5xx or timeout the rows may be gone anyway; re-read before trusting row numbers
+                self.index.stale = True
+                raise
+            for r in targets:
+                self.index.deleted(r)
+        seen = set()
+        results = []
+        for op in ops:
+            results.append(rows[op.key] is not None and op.key not in seen)
+            seen.add(op.key)
+        return results
@@ -0,0 +1,416 @@
+# storage.py
+# Ma'lumotlar saqlash qatlami: Google Sheets yoki lokal SQLite.
+# Bot faqat Storage interfeysi bilan ishlaydi; backend STORAGE_BACKEND orqali tanlanadi.
+
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from records import (
+    CLIENT_COLUMNS, Client, Party, client_row, parse_clients, parse_parties, row_keys
+)
+from sheets import RowIndex, SheetsRepository, SheetWriter
+
+logger = logging.getLogger("logistic-bot.storage")
+
+
+class RowNotFound(LookupError):
+    """The key to change has no row in the sheet (e.g. the row was removed by hand)."""
+
+
+class Storage:
+    """What the bot needs from a backend. All methods raise on failure."""
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def version(self):
+        """Opaque marker that changes when the data changed outside this process.
+        None means "unknown", and the caller should reload."""
+        return None
+
+    async def load_parties(self) -> Dict[str, Party]:
+        raise NotImplementedError
+
+    async def load_clients(self) -> Dict[str, Client]:
+        raise NotImplementedError
+
+    async def save_party(self, code, status):
+        raise NotImplementedError
+
+    async def delete_party(self, code):
+        raise NotImplementedError
+
+    async def update_party_status(self, code, status):
+        raise NotImplementedError
+
+    async def save_client(self, cid, record: Client):
+        raise NotImplementedError
+
+    async def save_clients(self, items: List[Tuple[str, Client]]):
+        """Add many clients at once (bulk import)."""
+        for cid, record in items:
+            await self.save_client(cid, record)
+
+    async def delete_client(self, cid):
+        raise NotImplementedError
+
+    async def update_client_field(self, cid, field: str, value):
+        raise NotImplementedError
+
+
+class SheetsStorage(Storage):
+    """Google Sheets as the source of truth (the original setup)."""
+
+    def __init__(self, repo: SheetsRepository, sh, parties_ws, clients_ws, window: float = 0.3, branch: str = ""):
+        self.repo = repo
+        self.branch = branch  # loaded records are tagged with it
+        self.sh = sh
+        self.parties_ws = parties_ws
+        self.clients_ws = clients_ws
+        # code/id -> sheet row number, so deletes and status updates hit one row directly
+        self.party_rows = RowIndex()
+        self.client_rows = RowIndex()
+        # Background batching writers; loads take the same per-sheet lock, so a
+        # reload never interleaves with a flush and the row index stays consistent.
+        self.parties_writer = SheetWriter(repo, parties_ws, self.party_rows, "code", window=window)
+        self.clients_writer = SheetWriter(repo, clients_ws, self.client_rows, "id", window=window)
+
+    async def close(self):
+        await self.parties_writer.stop()
+        await self.clients_writer.stop()
+
+    async def version(self):
+        # Drive modifiedTime: one small metadata request instead of downloading both worksheets
+        try:
+            return await self.repo.call(self.sh.get_lastUpdateTime)
+        except Exception as e:
+            logger.warning("Could not read spreadsheet modifiedTime: %s", e)
+            return None
+
+    # get_all_values, not get_all_records: plain lists of cell text, no dict per row,
+    # and ids like "0123" are not turned into numbers on the way
+    async def load_parties(self) -> Dict[str, Party]:
+        async with self.repo.lock(self.parties_ws):
+            values = await self.repo.call(self.parties_ws.get_all_values)
+            self.party_rows.rebuild(row_keys(values, "code"))
+        return parse_parties(values, self.branch)
+
+    async def load_clients(self) -> Dict[str, Client]:
+        async with self.repo.lock(self.clients_ws):
+            values = await self.repo.call(self.clients_ws.get_all_values)
+            self.client_rows.rebuild(row_keys(values, "id"))
+        return parse_clients(values, self.branch)
+
+    async def save_party(self, code, status):
+        await self.parties_writer.upsert(code, [code, status])
+
+    async def delete_party(self, code):
+        if not await self.parties_writer.delete(code):
+            raise RowNotFound("party %s has no row in %s" % (code, self.parties_ws.title))
+
+    async def update_party_status(self, code, status):
+        if not await self.parties_writer.update(code, 2, status):
+            raise RowNotFound("party %s has no row in %s" % (code, self.parties_ws.title))
+
+    async def save_client(self, cid, record: Client):
+        await self.clients_writer.upsert(cid, client_row(cid, record))
+
+    async def save_clients(self, items: List[Tuple[str, Client]]):
+        await self.clients_writer.upsert_many((cid, client_row(cid, record)) for cid, record in items)
+
+    async def delete_client(self, cid):
+        if not await self.clients_writer.delete(cid):
+            raise RowNotFound("client %s has no row in %s" % (cid, self.clients_ws.title))
+
+    async def update_client_field(self, cid, field: str, value):
+        await self.clients_writer.update(cid, CLIENT_COLUMNS.index(field) + 1, value)
+
+    async def replicate(self, table: str, key: str, record):
+        """Make the sheet row of `key` match `record` (None = the row must not exist)."""
+        writer = self.parties_writer if table == "parties" else self.clients_writer
+        if record is None:
+            await writer.delete(key)
+        elif table == "parties":
+            await writer.upsert(key, [key, record.status])
+        else:
+            await writer.upsert(key, client_row(key, record))
+
+
+class SheetsMirror:
+    """Lazily connected Sheets export for SQLiteStorage.
+
+    `connect` is only awaited when there is something to replicate, so the bot
+    starts and serves lookups even if Google is unreachable.
+    """
+
+    def __init__(self, connect: Callable[[], Awaitable[SheetsStorage]]):
+        self._connect = connect
+        self._sheets: Optional[SheetsStorage] = None
+
+    async def sheets(self) -> SheetsStorage:
+        if self._sheets is None:
+            self._sheets = await self._connect()
+        return self._sheets
+
+    async def close(self):
+        if self._sheets is not None:
+            await self._sheets.close()
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS parties (
+    code   TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS clients (
+    id          TEXT PRIMARY KEY,
+    party       TEXT NOT NULL DEFAULT '',
+    mesta       TEXT NOT NULL DEFAULT '',
+    kub         TEXT NOT NULL DEFAULT '',
+    kg          TEXT NOT NULL DEFAULT '',
+    destination TEXT NOT NULL DEFAULT '',
+    date        TEXT NOT NULL DEFAULT '',
+    image       TEXT NOT NULL DEFAULT '',
+    image_file_id TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS clients_party ON clients(party);
+-- keys changed locally and not yet copied to Sheets; ver guards against
+-- dropping a key that was changed again while it was being replicated
+CREATE TABLE IF NOT EXISTS sheets_outbox (
+    tbl TEXT NOT NULL,
+    key TEXT NOT NULL,
+    ver INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (tbl, key)
+);
+"""
+# columns in Client() argument order, whatever order ALTER TABLE left them in
+_SELECT_CLIENTS = "SELECT %s FROM clients" % ", ".join(CLIENT_COLUMNS)
+
+
+class SQLiteStorage(Storage):
+    """Local SQLite file as the source of truth, with Google Sheets as an optional export.
+
+    All statements run on one dedicated thread, which owns the connection.
+    Every write marks its key in ``sheets_outbox`` in the same transaction. A
+    background task copies the current local row of each marked key to Sheets,
+    so replication survives Sheets outages and restarts, and replaying it twice is harmless.
+    """
+
+    def __init__(self, path: str, mirror: Optional[SheetsMirror] = None, batch_size: int = 500, branch: str = ""):
+        self.path = path
+        self.branch = branch
+        self.mirror = mirror
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = asyncio.Lock()
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    async def _write(self, func, *args):
+        # The lock makes "write, then update the cache" atomic with respect to
+        # load_*: the caller updates the cache right after we return, without awaiting.
+        async with self._lock:
+            await self._run(func, *args)
+        if self.mirror is not None:
+            self._dirty.set()
+
+    # ----- lifecycle -----
+    async def start(self):
+        await self._run(self._open)
+        if self.mirror is None:
+            return
+        if await self._run(self._is_empty):
+            # First start on an empty database: import the existing sheets once.
+            # Without them the bot would serve an empty database, and its first write
+            # would make the file non-empty, so the import would never happen: fail
+            # instead and let the caller retry.
+            try:
+                sheets = await self.mirror.sheets()
+                parties = await sheets.load_parties()
+                clients = await sheets.load_clients()
+                await self._run(self._seed, parties, clients)
+            except Exception:
+                await self.close()
+                raise
+            logger.info("SQLite seeded from Sheets: %d parties, %d clients", len(parties), len(clients))
+        self._dirty.set()
+        self._task = asyncio.create_task(self._replicate_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.mirror is not None:
+            await self.mirror.close()
+        if self._db is not None:
+            await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
+
+    async def version(self):
+        # changes only when another connection (process) committed to the file
+        return await self._run(lambda: self._db.execute("PRAGMA data_version").fetchone()[0])
+
+    # ----- Storage API -----
+    async def load_parties(self) -> Dict[str, Party]:
+        async with self._lock:
+            rows = await self._run(self._select, "SELECT code, status FROM parties ORDER BY rowid")
+        return {row[0]: Party(row[1], self.branch) for row in rows}
+
+    async def load_clients(self) -> Dict[str, Client]:
+        async with self._lock:
+            rows = await self._run(self._select, _SELECT_CLIENTS + " ORDER BY rowid")
+        return {row[0]: Client(*row[1:], branch=self.branch) for row in rows}
+
+    async def save_party(self, code, status):
+        await self._write(self._execute, "parties", code,
+                          "INSERT INTO parties(code, status) VALUES (?, ?) "
+                          "ON CONFLICT(code) DO UPDATE SET status = excluded.status", (code, status))
+
+    async def delete_party(self, code):
+        await self._write(self._execute, "parties", code, "DELETE FROM parties WHERE code = ?", (code,), True)
+
+    async def update_party_status(self, code, status):
+        await self._write(self._execute, "parties", code,
+                          "UPDATE parties SET status = ? WHERE code = ?", (status, code), True)
+
+    async def save_client(self, cid, record: Client):
+        await self._write(self._execute, "clients", cid,
+                          "INSERT OR REPLACE INTO clients(%s) VALUES (%s)"
+                          % (", ".join(CLIENT_COLUMNS), ", ".join("?" * len(CLIENT_COLUMNS))),
+                          tuple(client_row(cid, record)))
+
+    async def save_clients(self, items: List[Tuple[str, Client]]):
+        await self._write(self._insert_clients, items)
+
+    async def delete_client(self, cid):
+        await self._write(self._execute, "clients", cid, "DELETE FROM clients WHERE id = ?", (cid,), True)
+
+    async def update_client_field(self, cid, field: str, value):
+        if field not in CLIENT_COLUMNS[1:]:
+            raise ValueError("unknown client field %r" % field)
+        await self._write(self._execute, "clients", cid,
+                          "UPDATE clients SET %s = ? WHERE id = ?" % field, (str(value), cid))
+
+    # ----- replication to Sheets -----
+    async def _replicate_loop(self):
+        delay = 1.0
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            try:
+                done = await self._replicate_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Sheets mirror failed (%s), retrying in %.0fs", e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 300.0)
+                self._dirty.set()
+                continue
+            delay = 1.0
+            if done >= self.batch_size:
+                self._dirty.set()
+
+    async def _replicate_batch(self) -> int:
+        pending = await self._run(self._pending_changes, self.batch_size)
+        if not pending:
+            return 0
+        sheets = await self.mirror.sheets()
+        results = await asyncio.gather(
+            *(sheets.replicate(tbl, key, record) for tbl, key, _, record in pending),
+            return_exceptions=True,
+        )
+        applied = [(tbl, key, ver) for (tbl, key, ver, _), r in zip(pending, results)
+                   if not isinstance(r, BaseException)]
+        await self._run(self._mark_replicated, applied)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
+        return len(pending)
+
+    # ----- blocking helpers (run on the SQLite thread) -----
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(_SCHEMA)
+        # databases created before a column was added to CLIENT_COLUMNS
+        existing = {row["name"] for row in db.execute("PRAGMA table_info(clients)")}
+        for col in CLIENT_COLUMNS:
+            if col not in existing:
+                db.execute("ALTER TABLE clients ADD COLUMN %s TEXT NOT NULL DEFAULT ''" % col)
+        self._db = db
+
+    def _is_empty(self) -> bool:
+        db = self._db
+        return (db.execute("SELECT 1 FROM parties LIMIT 1").fetchone() is None
+                and db.execute("SELECT 1 FROM clients LIMIT 1").fetchone() is None)
+
+    def _select(self, sql, params=()) -> List[sqlite3.Row]:
+        return self._db.execute(sql, params).fetchall()
+
+    def _execute(self, table, key, sql, params, must_exist: bool = False):
+        with self._db:
+            if self._db.execute(sql, params).rowcount == 0 and must_exist:
+                # same as SheetsStorage: a change that touched nothing is an error
+                raise RowNotFound("%s has no row in %s" % (key, table))
+            if self.mirror is not None:
+                self._mark_dirty(table, key)
+
+    def _mark_dirty(self, table, key):
+        self._db.execute(
+            "INSERT INTO sheets_outbox(tbl, key) VALUES (?, ?) "
+            "ON CONFLICT(tbl, key) DO UPDATE SET ver = ver + 1", (table, key))
+
+    def _insert_clients(self, items):
+        # one transaction for the whole import
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO clients(%s) VALUES (%s)"
+                % (", ".join(CLIENT_COLUMNS), ", ".join("?" * len(CLIENT_COLUMNS))),
+                [tuple(client_row(cid, record)) for cid, record in items])
+            if self.mirror is not None:
+                for cid, _ in items:
+                    self._mark_dirty("clients", cid)
+
+    def _seed(self, parties: Dict[str, Party], clients: Dict[str, Client]):
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO parties(code, status) VALUES (?, ?)",
+                                 [(code, p.status) for code, p in parties.items()])
+            self._db.executemany(
+                "INSERT OR REPLACE INTO clients(%s) VALUES (%s)"
+                % (", ".join(CLIENT_COLUMNS), ", ".join("?" * len(CLIENT_COLUMNS))),
+                [tuple(client_row(cid, c)) for cid, c in clients.items()])
+
+    def _pending_changes(self, limit) -> List[Tuple[str, str, int, object]]:
+        out = []
+        rows = self._db.execute("SELECT tbl, key, ver FROM sheets_outbox LIMIT ?", (limit,)).fetchall()
+        for row in rows:
+            if row["tbl"] == "parties":
+                cur = self._db.execute("SELECT status FROM parties WHERE code = ?", (row["key"],)).fetchone()
+                record = Party(cur[0]) if cur else None
+            else:
+                cur = self._db.execute(_SELECT_CLIENTS + " WHERE id = ?", (row["key"],)).fetchone()
+                record = Client(*cur[1:]) if cur else None
+            out.append((row["tbl"], row["key"], row["ver"], record))
+        return out
+
+    def _mark_replicated(self, applied):
+        with self._db:
+            self._db.executemany("DELETE FROM sheets_outbox WHERE tbl = ? AND key = ? AND ver = ?", applied)
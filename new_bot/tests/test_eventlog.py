@@ -0,0 +1,147 @@
+import asyncio
+import os
+import struct
+
+import pytest
+
+from eventlog import EventLog
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def open_log(directory, **kwargs):
+    log = EventLog(str(directory), **kwargs)
+    await log.start()
+    return log
+
+
+async def write(directory, count, **kwargs):
+    log = await open_log(directory, **kwargs)
+    for i in range(count):
+        await log.append("party_status", "PP1", "PP1", {"old": str(i), "new": str(i + 1)}, admin=1)
+    await log.close()
+
+
+def sizes(directory):
+    return {name: os.path.getsize(os.path.join(directory, name)) for name in sorted(os.listdir(directory))}
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    run(write(tmp_path, 3))
+    (segment,) = os.listdir(tmp_path)
+    path = tmp_path / segment
+    intact = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(b"\x40\x00\x00\x00\x01\x02")  # a header and no payload: a crash mid-append
+
+    async def check():
+        log = await open_log(tmp_path)
+        assert not log.read_only and log.last_seq == 3
+        assert os.path.getsize(path) == intact
+        event = await log.append("party_add", "PP2", "PP2", {"status": "Yangi"})
+        assert event.seq == 4
+        assert [e.seq for e in await log.party_history("PP1")] == [1, 2, 3]
+        await log.close()
+
+    run(check())
+
+
+def set_length(path, record, length):
+    """Overwrite the length field of the `record`-th record (1-based) of a segment."""
+    with open(path, "r+b") as f:
+        offset = 0
+        for _ in range(record - 1):
+            f.seek(offset)
+            offset += 8 + struct.unpack("<I", f.read(4))[0]
+        f.seek(offset)
+        f.write(struct.pack("<I", length))
+
+
+def test_damaged_length_is_not_taken_for_a_torn_tail(tmp_path):
+    run(write(tmp_path, 5))
+    (segment,) = os.listdir(tmp_path)
+    path = tmp_path / segment
+    size = os.path.getsize(path)
+    set_length(path, 2, 0x7F000000)
+
+    async def check():
+        log = await open_log(tmp_path)
+        assert log.read_only and log.last_seq == 1
+        with pytest.raises(RuntimeError):
+            await log.append("party_add", "PP2", "PP2", {})
+        await log.close()
+
+    run(check())
+    assert os.listdir(tmp_path) == [segment] and os.path.getsize(path) == size
+
+
+def test_cut_off_tail_is_kept_aside(tmp_path):
+    # a length that still looks plausible but runs past the end is cut off like a torn
+    # record; the bytes are moved to a .torn file, so the events can be recovered
+    run(write(tmp_path, 5))
+    (segment,) = os.listdir(tmp_path)
+    path = tmp_path / segment
+    original = path.read_bytes()
+    set_length(path, 2, len(original))
+    damaged = path.read_bytes()
+
+    async def check():
+        log = await open_log(tmp_path)
+        assert log.last_seq == 1
+        await log.close()
+
+    run(check())
+    (torn,) = [name for name in os.listdir(tmp_path) if name.endswith(".torn")]
+    assert path.read_bytes() + (tmp_path / torn).read_bytes() == damaged
+
+
+def test_bad_checksum_at_the_end_is_truncated(tmp_path):
+    run(write(tmp_path, 3))
+    (segment,) = os.listdir(tmp_path)
+    path = tmp_path / segment
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+
+    async def check():
+        log = await open_log(tmp_path)
+        assert not log.read_only and log.last_seq == 2
+        assert (await log.append("party_add", "PP2", "PP2", {})).seq == 3
+        await log.close()
+
+    run(check())
+
+
+@pytest.mark.parametrize("damage", ["flip", "gap"])
+def test_damage_before_the_tail_makes_the_log_read_only(tmp_path, damage):
+    run(write(tmp_path, 12, segment_bytes=200))
+    before = sizes(tmp_path)
+    assert len(before) > 3
+    first, second = sorted(before)[:2]
+    if damage == "flip":
+        # a flipped byte in the middle of the first segment
+        with open(tmp_path / first, "r+b") as f:
+            f.seek(20)
+            byte = f.read(1)
+            f.seek(20)
+            f.write(bytes([byte[0] ^ 0xFF]))
+    else:
+        os.remove(tmp_path / second)
+        del before[second]
+
+    async def check():
+        log = await open_log(tmp_path, segment_bytes=200)
+        assert log.read_only
+        assert log.last_seq == (0 if damage == "flip" else int(second[:-4]) - 1)
+        with pytest.raises(RuntimeError):
+            await log.append("party_add", "PP2", "PP2", {})
+        if log.last_seq:
+            assert (await log.get(1)).data == {"old": "0", "new": "1"}
+        await log.close()
+
+    run(check())
+    assert sizes(tmp_path) == before  # nothing truncated or appended
@@ -0,0 +1,99 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+import fsm_storage  # noqa: E402
+from aiogram.fsm.storage.base import DefaultKeyBuilder, StorageKey  # noqa: E402
+
+from fsm_storage import SQLiteFSMStorage  # noqa: E402
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+OTHER = StorageKey(bot_id=1, chat_id=20, user_id=20)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(fsm_storage.time, "time", clock.time)
+    return clock
+
+
+def run_fsm(tmp_path, body, **kwargs):
+    async def run():
+        storage = SQLiteFSMStorage(str(tmp_path / "fsm.db"), **kwargs)
+        try:
+            await body(storage)
+        finally:
+            await storage.close()
+
+    asyncio.run(run())
+
+
+def test_state_and_data_survive_reopening(tmp_path, clock):
+    async def write(storage):
+        await storage.set_state(KEY, "AddClient:waiting_kub")
+        await storage.set_data(KEY, {"id": "0123", "party": "ПП1"})
+
+    async def read(storage):
+        assert await storage.get_state(KEY) == "AddClient:waiting_kub"
+        assert await storage.get_data(KEY) == {"id": "0123", "party": "ПП1"}
+        assert await storage.get_state(OTHER) is None and await storage.get_data(OTHER) == {}
+
+    run_fsm(tmp_path, write)
+    run_fsm(tmp_path, read)
+
+
+def test_expired_conversation_is_not_returned(tmp_path, clock):
+    async def body(storage):
+        await storage.set_state(KEY, "AddClient:waiting_kub")
+        await storage.set_data(KEY, {"id": "1"})
+        clock.now += 59
+        assert await storage.get_state(KEY) == "AddClient:waiting_kub"
+        clock.now += 2  # 61 s since the last write
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_data(KEY) == {}
+
+    run_fsm(tmp_path, body, ttl=60)
+
+
+def test_new_state_after_expiry_resets_old_data(tmp_path, clock):
+    async def body(storage):
+        await storage.set_state(KEY, "AddClient:waiting_kub")
+        await storage.set_data(KEY, {"id": "1", "party": "PP1"})
+        clock.now += 120
+        await storage.set_state(KEY, "DeleteClient:waiting_code")
+        assert await storage.get_data(KEY) == {}
+        # and the other way round: new data after expiry drops the old state
+        await storage.set_state(OTHER, "AddParty:waiting_code")
+        clock.now += 120
+        await storage.set_data(OTHER, {"x": 1})
+        assert await storage.get_state(OTHER) is None
+        assert await storage.get_data(OTHER) == {"x": 1}
+
+    run_fsm(tmp_path, body, ttl=60)
+
+
+def test_finished_and_expired_rows_are_deleted(tmp_path, clock):
+    async def body(storage):
+        await storage.set_state(KEY, "AddClient:waiting_kub")
+        await storage.set_state(OTHER, "AddParty:waiting_code")
+        await storage.set_state(KEY, None)  # state.clear()
+        await storage.set_data(KEY, {})
+        clock.now += 120  # OTHER expires; the next write collects it
+        await storage.set_state(KEY, "AddParty:waiting_code")
+
+    run_fsm(tmp_path, body, ttl=60, gc_interval=0)
+    with sqlite3.connect(str(tmp_path / "fsm.db")) as db:
+        keys = db.execute("SELECT key FROM fsm").fetchall()
+    assert keys == [(DefaultKeyBuilder(with_destiny=True).build(KEY),)]
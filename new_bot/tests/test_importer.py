@@ -0,0 +1,71 @@
+import pytest
+
+from importer import ImportFormatError, read_clients
+
+
+def write(tmp_path, text, encoding="utf-8", name="clients.csv"):
+    path = tmp_path / name
+    path.write_bytes(text.encode(encoding))
+    return str(path)
+
+
+def test_cp1251_with_semicolons(tmp_path):
+    # what Excel saves on a Russian/Uzbek Windows
+    path = write(tmp_path, "ID;Party;Mesta;Kub;Kg;Destination\r\n"
+                           "1;PP1;2;0,5;40;Ташкент\r\n"
+                           "2;PP1;1 500;1;1;Самарканд\r\n", encoding="cp1251")
+    result = read_clients(path, existing=set())
+    assert result.rejected == []
+    assert result.accepted == [
+        ("1", {"party": "PP1", "mesta": "2", "kub": "0,5", "kg": "40", "destination": "Ташкент"}),
+        ("2", {"party": "PP1", "mesta": "1 500", "kub": "1", "kg": "1", "destination": "Самарканд"}),
+    ]
+
+
+def test_utf8_with_bom_and_commas(tmp_path):
+    path = write(tmp_path, "﻿party,id,destination\nPP1,7,Xiva\n\n")
+    result = read_clients(path, existing=set())
+    assert result.accepted == [("7", {"party": "PP1", "destination": "Xiva"})]
+
+
+def test_rejected_rows(tmp_path):
+    path = write(tmp_path, "id,party,kg\n"
+                           "1,PP1,10\n"
+                           "1,PP2,10\n"  # repeated in the file
+                           "5,PP1,10\n"  # already in the cache
+                           ",PP1,10\n"
+                           "6,,10\n"
+                           "7,PP1,o'n\n"
+                           "8,PP1,nan\n")
+    result = read_clients(path, existing={"5"})
+    assert [cid for cid, _ in result.accepted] == ["1"]
+    assert [line for line, _ in result.rejected] == [3, 4, 5, 6, 7, 8]
+    reasons = [reason for _, reason in result.rejected]
+    assert "takrorlangan" in reasons[0] and "mavjud" in reasons[1]
+    assert "son emas: kg" in reasons[4] and "son emas: kg" in reasons[5]
+
+
+def test_max_rows(tmp_path):
+    body = "".join("%d,PP1\n" % i for i in range(4))
+    assert len(read_clients(write(tmp_path, "id,party\n" + body), set(), max_rows=4).accepted) == 4
+    with pytest.raises(ImportFormatError):
+        read_clients(write(tmp_path, "id,party\n" + body + "9,PP1\n"), set(), max_rows=4)
+
+
+@pytest.mark.parametrize("text", ["", "\n\n", "kod,partiya\n1,PP1\n"])
+def test_missing_header(tmp_path, text):
+    with pytest.raises(ImportFormatError):
+        read_clients(write(tmp_path, text), set())
+
+
+def test_xlsx(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    import datetime
+
+    wb = openpyxl.Workbook()
+    wb.active.append(["id", "party", "mesta", "date"])
+    wb.active.append([123.0, "PP1", 2, datetime.datetime(2024, 3, 5)])
+    path = str(tmp_path / "clients.xlsx")
+    wb.save(path)
+    result = read_clients(path, existing=set())
+    assert result.accepted == [("123", {"party": "PP1", "mesta": "2", "date": "05.03.2024"})]
@@ -0,0 +1,133 @@
+import pytest
+
+from indexes import PartyIndex, SearchIndex, StatsIndex, month_of, normalize_key
+from records import Client
+
+UNKNOWN = "Noma’lum"
+
+
+def client(party, mesta=1.0, kub=1.0, kg=10.0, destination="Toshkent", date="05.03.2024"):
+    return Client(party, mesta, kub, kg, destination, date)
+
+
+def totals(t):
+    return None if t is None else (t.clients, t.mesta, t.kub, t.kg)
+
+
+def search_of(*keys):
+    index = SearchIndex()
+    for key in keys:
+        index.add(key)
+    return index
+
+
+# ---------- SearchIndex ----------
+def test_normalize_key_maps_cyrillic_lookalikes():
+    assert normalize_key(" РР 111 ") == "pp111"  # Cyrillic Р, typed on a Russian keyboard
+    assert normalize_key("ＰＰ１１１") == "pp111"  # full-width forms
+
+
+def test_find_ignores_case_spaces_and_lookalikes():
+    index = search_of("PP111", "1111")
+    assert index.find("рр111") == "PP111"
+    assert index.find(" pp 111") == "PP111"
+    assert index.find("1111 ") == "1111"
+    assert index.find("PP112") is None
+
+
+def test_find_refuses_ambiguous_keys():
+    index = search_of("PP1", "pp1")
+    assert index.find("PP1") is None
+    index.remove("pp1")
+    assert index.find("pp1") == "PP1"
+
+
+def test_suggest_ranks_prefix_matches_first():
+    index = search_of("AP12", "PP1234", "ZZ99")
+    # "AP12" is closer by edit distance, but "PP1234" starts with what was typed
+    assert index.suggest("рр12") == ["PP1234", "AP12"]
+
+
+def test_suggest_finds_typos():
+    index = search_of("PP111", "PP222", "TK111")
+    assert index.suggest("PP11")[0] == "PP111"
+    assert index.suggest("PX111")[:2] == ["PP111", "TK111"]  # one edit away, then two
+    assert index.suggest("") == []
+
+
+def test_remove_drops_key_from_suggestions():
+    index = search_of("PP1234", "PP1235")
+    index.remove("PP1234")
+    index.remove("PP9999")  # unknown keys are ignored
+    assert index.suggest("PP123") == ["PP1235"]
+    assert index.find("PP1234") is None
+    assert len(index) == 1
+    index.remove("PP1235")
+    assert index.suggest("PP123") == [] and index._grams == {}
+
+
+# ---------- PartyIndex ----------
+def test_party_index_add_replace_remove():
+    index = PartyIndex()
+    index.add("1", client("PP1", 2.0, 0.5, 20.0))
+    index.add("2", client("PP1", "12 ta", 1.0, 5.0))  # text amounts count as 0
+    assert index.clients_of("PP1") == {"1", "2"}
+    assert totals(index.summary("PP1")) == (2, 2.0, 1.5, 25.0)
+    index.add("2", client("PP2", 3.0, 1.0, 5.0))  # moved to another party
+    assert index.clients_of("PP1") == {"1"}
+    assert totals(index.summary("PP1")) == (1, 2.0, 0.5, 20.0)
+    assert totals(index.summary("PP2")) == (1, 3.0, 1.0, 5.0)
+    index.remove("1")
+    index.remove("1")  # twice is harmless
+    assert index.clients_of("PP1") == set() and index.summary("PP1") is None
+
+
+# ---------- StatsIndex ----------
+@pytest.mark.parametrize("date, month", [
+    ("05.03.2024", "2024-03"), ("5/3/2024", "2024-03"), ("2024-03-05", "2024-03"), ("13.13.2024", ""), ("", ""),
+])
+def test_month_of(date, month):
+    assert month_of(date) == month
+
+
+def test_stats_client_add_replace_remove():
+    stats = StatsIndex(UNKNOWN)
+    stats.set_party("PP1", "Yangi")
+    stats.add_client("1", client("PP1", 2.0, destination="Toshkent", date="05.03.2024"))
+    stats.add_client("2", client("PP1", 3.0, destination="Samarqand", date="2024-04-01"))
+    assert totals(stats.by_status["Yangi"]) == (2, 5.0, 2.0, 20.0)
+    assert set(stats.by_destination) == {"Toshkent", "Samarqand"}
+    stats.add_client("2", client("PP1", 4.0, destination="Toshkent", date="2024-03-09"))
+    assert totals(stats.by_destination["Toshkent"]) == (2, 6.0, 2.0, 20.0)
+    assert set(stats.by_destination) == {"Toshkent"} and set(stats.by_month) == {"2024-03"}
+    stats.remove_client("1")
+    assert totals(stats.total()) == (1, 4.0, 1.0, 10.0)
+    stats.remove_client("2")
+    assert stats.by_status == {} and stats.by_month == {} and totals(stats.total()) == (0, 0.0, 0.0, 0.0)
+
+
+def test_stats_party_status_moves_its_totals():
+    stats = StatsIndex(UNKNOWN)
+    stats.add_client("1", client("PP1", 2.0))  # party not known yet
+    assert set(stats.by_status) == {UNKNOWN}
+    stats.set_party("PP1", "Yangi")
+    stats.set_party("PP2", "Yangi")  # no clients: nothing to move
+    stats.add_client("2", client("PP2", 3.0))
+    assert totals(stats.by_status["Yangi"]) == (2, 5.0, 2.0, 20.0)
+    stats.set_party("PP1", "Keldi")
+    assert totals(stats.by_status["Keldi"]) == (1, 2.0, 1.0, 10.0)
+    assert totals(stats.by_status["Yangi"]) == (1, 3.0, 1.0, 10.0)
+    stats.remove_party("PP1")
+    assert "Keldi" not in stats.by_status
+    assert totals(stats.by_status[UNKNOWN]) == (1, 2.0, 1.0, 10.0)
+    assert totals(stats.total()) == (2, 5.0, 2.0, 20.0)
+
+
+def test_stats_months_range():
+    stats = StatsIndex(UNKNOWN)
+    for cid, date in enumerate(["05.01.2024", "05.02.2024", "05.03.2024", "05.04.2024", "sana yo'q"]):
+        stats.add_client(str(cid), client("PP1", 1.0, date=date))
+    assert stats.months("2024-02", "2024-03").clients == 2
+    assert stats.months("2024-03").clients == 2
+    assert stats.months().clients == 4  # the undated row is in no month
+    assert stats.total().clients == 5
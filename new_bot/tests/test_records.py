@@ -0,0 +1,18 @@
+import pytest
+
+from records import format_number, to_number
+
+
+@pytest.mark.parametrize("cell, number", [("1,5", 1.5), ("1 500", 1500.0), (" 2 ", 2.0), (3, 3.0), ("", None)])
+def test_to_number(cell, number):
+    assert to_number(cell) == number
+
+
+@pytest.mark.parametrize("cell", ["nan", "inf", "-Infinity", "1e400", "12 ta"])
+def test_non_numbers_stay_text(cell):
+    assert to_number(cell) == cell
+    assert format_number(to_number(cell)) == cell
+
+
+def test_non_finite_float_stays_text():
+    assert to_number(float("inf")) == "inf"
@@ -0,0 +1,168 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("gspread")
+
+import requests  # noqa: E402
+from gspread.exceptions import APIError  # noqa: E402
+
+from sheets import RowIndex, SheetsRepository, SheetWriter, is_retryable  # noqa: E402
+
+
+def api_error(code):
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({"error": {"code": code, "message": "x", "status": "X"}}).encode()
+    return APIError(response)
+
+
+def index_of(*keys):
+    index = RowIndex()
+    index.rebuild(keys)
+    return index
+
+
+# ---------- RowIndex ----------
+def test_deleted_shifts_rows_below():
+    index = index_of("a", "b", "c", "d")
+    index.deleted(3)  # "b"
+    assert [index.get(k) for k in "abcd"] == [2, None, 3, 4]
+
+
+def test_deleted_promotes_duplicate_of_deleted_key():
+    index = index_of("a", "b", "a", "c")
+    assert index.get("a") == 2
+    index.deleted(2)
+    assert index.get("a") == 3  # the former row 4, moved up
+    assert index.get("b") == 2
+    assert index.get("c") == 4
+
+
+def test_deleted_keeps_blank_rows_in_place():
+    index = index_of("a", "", "b")
+    index.deleted(2)
+    assert index.get("b") == 3
+
+
+def test_deleted_out_of_range_marks_stale():
+    index = index_of("a")
+    index.deleted(10)
+    assert index.stale and index.get("a") is None
+
+
+def test_appended_at_expected_row():
+    index = index_of("a", "b")
+    index.appended("c", 4)
+    assert index.get("c") == 4
+
+
+def test_appended_below_blank_rows_pads():
+    index = index_of("a")
+    index.appended("b", 5)  # rows 3 and 4 are blank
+    assert index.get("b") == 5
+    index.deleted(3)
+    assert index.get("b") == 4
+
+
+def test_appended_duplicate_keeps_first_row():
+    index = index_of("a")
+    index.appended("a", 3)
+    assert index.get("a") == 2
+
+
+@pytest.mark.parametrize("row", [None, 2])
+def test_appended_unknown_or_overlapping_row_marks_stale(row):
+    index = index_of("a", "b")
+    index.appended("c", row)
+    assert index.stale
+
+
+# ---------- retries ----------
+def test_is_retryable():
+    assert is_retryable(api_error(429)) and is_retryable(api_error(429), idempotent=False)
+    assert is_retryable(api_error(503))
+    assert not is_retryable(api_error(503), idempotent=False)
+    assert not is_retryable(api_error(400))
+    assert not is_retryable(ValueError())
+
+
+class CommitThenFail:
+    """A worksheet whose append_rows stores the rows and then answers 500."""
+    title = "clients"
+
+    def __init__(self):
+        self.rows = []
+
+    def append_rows(self, values, **kwargs):
+        self.rows.extend(values)
+        raise api_error(500)
+
+
+def test_append_is_not_retried_after_server_error():
+    ws = CommitThenFail()
+    repo = SheetsRepository(max_workers=1)
+    index = index_of("1")
+
+    async def run():
+        writer = SheetWriter(repo, ws, index, "id", window=0)
+        with pytest.raises(APIError):
+            await writer.append("2", ["2", "PP1"])
+        await writer.stop()
+
+    try:
+        asyncio.run(run())
+    finally:
+        repo.shutdown()
+    assert ws.rows == [["2", "PP1"]]  # written once, not duplicated by a retry
+    assert index.stale
+
+
+def test_delete_is_not_retried_after_server_error():
+    from benchmarks.fakes import FakeSpreadsheet
+
+    ws = FakeSpreadsheet(parties=[["PP1", "a"], ["PP2", "b"], ["PP3", "c"]]).worksheet("parties")
+    apply = ws.spreadsheet.batch_update
+
+    def commit_then_fail(body):
+        apply(body)
+        raise api_error(500)
+
+    ws.spreadsheet.batch_update = commit_then_fail
+    repo = SheetsRepository(max_workers=1)
+    index = index_of("PP1", "PP2", "PP3")
+
+    async def run():
+        writer = SheetWriter(repo, ws, index, "code", window=0)
+        with pytest.raises(APIError):
+            await writer.delete("PP1")
+        await writer.stop()
+
+    try:
+        asyncio.run(run())
+    finally:
+        repo.shutdown()
+    assert ws._values == [["code", "status"], ["PP2", "b"], ["PP3", "c"]]  # PP2 not deleted by a retry
+    assert index.stale
+
+
+class ValuesSheet:
+    """A worksheet that only answers get_all_values, as cell text."""
+    title = "clients"
+
+    def __init__(self, values):
+        self.values = values
+
+    def get_all_values(self):
+        return self.values
+
+
+def test_find_row_rescan_keeps_leading_zeros():
+    ws = ValuesSheet([["id", "party"], ["0123", "PP1"], ["77", "PP2"]])
+    repo = SheetsRepository(max_workers=1)
+    writer = SheetWriter(repo, ws, RowIndex(), "id", window=0)
+    try:
+        assert asyncio.run(writer.find_row("0123")) == 2
+    finally:
+        repo.shutdown()
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("gspread")
+
+from benchmarks.fakes import FakeSpreadsheet  # noqa: E402
+from records import Client  # noqa: E402
+from sheets import SheetsRepository  # noqa: E402
+from storage import RowNotFound, SheetsMirror, SheetsStorage, SQLiteStorage  # noqa: E402
+
+
+def run_storage(sh, body):
+    repo = SheetsRepository(max_workers=1)
+
+    async def run():
+        storage = SheetsStorage(repo, sh, sh.worksheet("parties"), sh.worksheet("clients"), window=0)
+        try:
+            await storage.load_parties()
+            await storage.load_clients()
+            await body(storage)
+        finally:
+            await storage.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        repo.shutdown()
+
+
+def test_save_twice_keeps_one_row():
+    sh = FakeSpreadsheet(parties=[["PP1", "Yangi"]], clients=[["0123", "PP1", "1", "1", "1", "A", "D", "", ""]])
+
+    async def body(storage):
+        await storage.save_party("PP1", "Keldi")
+        await storage.save_party("PP2", "Yangi")
+        await storage.save_client("0123", Client("PP2", 2.0, 1.0, 1.0, "B", "D", "", ""))
+
+    run_storage(sh, body)
+    assert sh.worksheet("parties")._values[1:] == [["PP1", "Keldi"], ["PP2", "Yangi"]]
+    assert [row[:2] for row in sh.worksheet("clients")._values[1:]] == [["0123", "PP2"]]
+
+
+@pytest.mark.parametrize("method", ["delete_party", "update_party_status", "delete_client"])
+def test_missing_row_raises(method):
+    sh = FakeSpreadsheet(parties=[["PP1", "Yangi"]])
+
+    async def body(storage):
+        args = ("PP9", "Keldi") if method == "update_party_status" else ("PP9",)
+        with pytest.raises(RowNotFound):
+            await getattr(storage, method)(*args)
+
+    run_storage(sh, body)
+    assert sh.worksheet("parties")._values[1:] == [["PP1", "Yangi"]]
+
+
+def test_sqlite_seeding_failure_is_retried(tmp_path):
+    sh = FakeSpreadsheet(parties=[["PP1", "Yangi"]], clients=[["0123", "PP1", "1", "1", "1", "A", "D", "", ""]])
+    repo = SheetsRepository(max_workers=1)
+    path = str(tmp_path / "bot.db")
+
+    async def unreachable():
+        raise ConnectionError("sheets down")
+
+    async def connect():
+        return SheetsStorage(repo, sh, sh.worksheet("parties"), sh.worksheet("clients"), window=0)
+
+    async def run():
+        with pytest.raises(ConnectionError):
+            await SQLiteStorage(path, mirror=SheetsMirror(unreachable)).start()
+        storage = SQLiteStorage(path, mirror=SheetsMirror(connect))
+        await storage.start()
+        try:
+            return await storage.load_parties(), await storage.load_clients()
+        finally:
+            await storage.close()
+
+    try:
+        parties, clients = asyncio.run(run())
+    finally:
+        repo.shutdown()
+    assert list(parties) == ["PP1"] and list(clients) == ["0123"]
+
+
+@pytest.mark.parametrize("method", ["delete_party", "update_party_status", "delete_client"])
+def test_sqlite_missing_row_raises(tmp_path, method):
+    async def run():
+        storage = SQLiteStorage(str(tmp_path / "bot.db"))
+        await storage.start()
+        try:
+            await storage.save_party("PP1", "Yangi")
+            args = ("PP9", "Keldi") if method == "update_party_status" else ("PP9",)
+            with pytest.raises(RowNotFound):
+                await getattr(storage, method)(*args)
+            await storage.update_party_status("PP1", "Keldi")
+            assert {code: p.status for code, p in (await storage.load_parties()).items()} == {"PP1": "Keldi"}
+        finally:
+            await storage.close()
+
+    asyncio.run(run())
@@ -0,0 +1,118 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+import throttle  # noqa: E402
+from aiogram.types import Chat, Message, Update, User  # noqa: E402
+
+from throttle import Buckets, ThrottlingMiddleware  # noqa: E402
+
+
+# ---------- Buckets ----------
+def test_bucket_allows_burst_then_refills():
+    buckets = Buckets(rate=1.0, burst=3)
+    assert [buckets.take("u", now=0.0) for _ in range(4)] == [True, True, True, False]
+    assert buckets.wait_time("u", now=0.0) == pytest.approx(1.0)
+    assert buckets.wait_time("u", now=0.5) == pytest.approx(0.5)
+    assert buckets.take("u", now=1.0) and not buckets.take("u", now=1.0)
+    assert buckets.take("other", now=1.0)  # keys are independent
+
+
+def test_bucket_never_stores_more_than_burst():
+    buckets = Buckets(rate=10.0, burst=2)
+    buckets.take("u", now=0.0)
+    assert [buckets.take("u", now=100.0) for _ in range(3)] == [True, True, False]
+
+
+def test_full_buckets_are_pruned():
+    buckets = Buckets(rate=1.0, burst=1, max_size=2)
+    buckets.take("a", now=0.0)
+    buckets.take("b", now=0.0)
+    buckets.take("c", now=5.0)  # a and b have refilled by now: forgotten
+    assert set(buckets._state) == {"c"}
+
+
+# ---------- ThrottlingMiddleware ----------
+class Clock:
+    now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttle.time, "monotonic", clock.monotonic)
+    return clock
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    sent = []
+
+    async def answer(self, text, **kwargs):
+        sent.append((self.chat.id, text))
+
+    monkeypatch.setattr(Message, "answer", answer)
+    return sent
+
+
+def update(user_id, chat_id=None):
+    chat_id = chat_id or user_id
+    user = User(id=user_id, is_bot=False, first_name="u")
+    chat = Chat(id=chat_id, type="private" if chat_id == user_id else "group")
+    message = Message(message_id=1, date=0, chat=chat, from_user=user, text="/start")
+    return Update(update_id=1, message=message), {"event_from_user": user, "event_chat": chat}
+
+
+def feed(middleware, user_id, count, chat_id=None):
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event)
+
+    async def run():
+        for _ in range(count):
+            event, data = update(user_id, chat_id)
+            await middleware(handler, event, data)
+
+    asyncio.run(run())
+    return len(handled)
+
+
+def make_middleware(**kwargs):
+    actions = Counter()
+    middleware = ThrottlingMiddleware(Buckets(1.0, 3), Buckets(1.0, 5), "sekinroq",
+                                      on_throttled=lambda scope, action: actions.update([(scope, action)]),
+                                      **kwargs)
+    return middleware, actions
+
+
+def test_flood_is_warned_once_then_dropped(clock, replies):
+    middleware, actions = make_middleware(warn_every=30.0)
+    assert feed(middleware, 7, 10) == 3  # the burst
+    assert replies == [(7, "sekinroq")]
+    assert actions == {("user", "warned"): 1, ("user", "dropped"): 6}
+    clock.now += 1.0
+    assert feed(middleware, 7, 2) == 1  # one token back; the rest still silent
+    assert len(replies) == 1
+    clock.now += 30.0
+    assert feed(middleware, 7, 5) == 3
+    assert len(replies) == 2  # warned again after warn_every
+
+
+def test_group_budget_is_shared(clock, replies):
+    middleware, actions = make_middleware()
+    passed = sum(feed(middleware, user_id, 2, chat_id=-100) for user_id in (1, 2, 3, 4))
+    assert passed == 5
+    assert set(actions) == {("chat", "warned"), ("chat", "dropped")}
+
+
+def test_exempt_users_pass(clock, replies):
+    middleware, _ = make_middleware(exempt=lambda user: user.id == 1)
+    assert feed(middleware, 1, 20) == 20
+    assert replies == []
@@ -0,0 +1,176 @@
+# throttle.py
+# Flood nazorati: foydalanuvchi/chat bo'yicha token-bucket cheklovi (kiruvchi yangilanishlar)
+# va Telegramga chiquvchi so'rovlarning markaziy rejalashtiruvchisi (global va chat limitlari, retry_after).
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Chat, TelegramObject, Update, User
+
+logger = logging.getLogger("logistic-bot.throttle")
+
+
+class Buckets:
+    """Token buckets keyed by user/chat id: `rate` tokens per second, at most `burst` stored.
+
+    A bucket is two floats in a dict; full buckets are forgotten now and then,
+    so memory follows the number of recently active ids.
+    """
+
+    def __init__(self, rate: float, burst: float, max_size: int = 50000):
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+        self._state: Dict[Any, list] = {}  # key -> [tokens, last refill time]
+
+    def _refill(self, key, now: float) -> list:
+        state = self._state.get(key)
+        if state is None:
+            if len(self._state) >= self.max_size:
+                self._prune(now)
+            state = self._state[key] = [self.burst, now]
+        elif now > state[1]:
+            state[0] = min(self.burst, state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+        return state
+
+    def take(self, key, now: Optional[float] = None) -> bool:
+        """Use one token if there is one."""
+        state = self._refill(key, time.monotonic() if now is None else now)
+        if state[0] >= 1.0:
+            state[0] -= 1.0
+            return True
+        return False
+
+    def wait_time(self, key, now: Optional[float] = None) -> float:
+        """Seconds until `key` has a token (0 if it has one now)."""
+        state = self._refill(key, time.monotonic() if now is None else now)
+        return 0.0 if state[0] >= 1.0 else (1.0 - state[0]) / self.rate
+
+    def _prune(self, now: float):
+        full = [k for k, (tokens, stamp) in self._state.items()
+                if tokens + (now - stamp) * self.rate >= self.burst]
+        for k in full:
+            del self._state[k]
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Update outer middleware dropping updates from users/chats over their budget.
+
+    It has to sit before the FSM middleware: event isolation serializes one
+    user's updates behind a lock, so further down a flood would just queue up
+    (and be let through at whatever pace the handlers run) instead of being cut.
+    A dropped update gets a short "slow down" reply (a callback query gets a
+    notice instead) at most once per `warn_every` seconds per user; the rest
+    are dropped silently, so an abuser costs us next to no outgoing messages.
+    `exempt(user)` can let e.g. admins through.
+    """
+
+    def __init__(self, user: Buckets, chat: Buckets, warning: str,
+                 on_throttled: Callable[[str, str], None] = lambda scope, action: None,
+                 exempt: Callable[[User], bool] = lambda user: False, warn_every: float = 30.0):
+        self.user = user
+        self.chat = chat
+        self.warning = warning
+        self.on_throttled = on_throttled
+        self.exempt = exempt
+        self.warn_every = warn_every
+        self._warned: Dict[int, float] = {}  # user id -> when last warned
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        # filled in by aiogram's UserContextMiddleware, which runs before us
+        user: Optional[User] = data.get("event_from_user")
+        chat: Optional[Chat] = data.get("event_chat")
+        if user is None or self.exempt(user):
+            return await handler(event, data)
+        now = time.monotonic()
+        scope = None
+        if not self.user.take(user.id, now):
+            scope = "user"
+        elif chat is not None and chat.id != user.id and not self.chat.take(chat.id, now):
+            scope = "chat"  # a group as a whole, private chats are covered by the user bucket
+        if scope is None:
+            return await handler(event, data)
+        if now - self._warned.get(user.id, -self.warn_every) < self.warn_every:
+            self.on_throttled(scope, "dropped")
+            return None
+        if len(self._warned) > 50000:
+            self._warned = {u: t for u, t in self._warned.items() if now - t < self.warn_every}
+        self._warned[user.id] = now
+        self.on_throttled(scope, "warned")
+        if isinstance(event, Update) and event.callback_query is not None:
+            await event.callback_query.answer(self.warning)
+        elif isinstance(event, Update) and event.message is not None:
+            await event.message.answer(self.warning)
+        return None
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Bot session middleware pacing every outgoing request that targets a chat.
+
+    A request waits until both the global bucket (Telegram allows about 30
+    messages per second per bot) and its chat's bucket (about 1 per second in a
+    private chat, 20 per minute in a group) have a token, so bursts from
+    handlers, lists and broadcasts queue up here instead of turning into 429s.
+    When Telegram still answers with retry_after, that chat is paused for that
+    long and the request is retried, up to `max_retry_after` seconds in total.
+    Requests without a chat (getUpdates, answerCallbackQuery, ...) pass straight through.
+    """
+
+    def __init__(self, global_rate: float = 30.0, private_rate: float = 1.0, private_burst: float = 3.0,
+                 group_rate: float = 20 / 60, group_burst: float = 3.0, max_retry_after: float = 60.0,
+                 on_wait: Callable[[float], None] = lambda seconds: None,
+                 on_retry_after: Callable[[float], None] = lambda seconds: None):
+        # Telegram counts messages per second, so the global budget gets no burst:
+        # a full bucket plus a second of refill would be twice the limit
+        self.global_bucket = Buckets(global_rate, 1.0)
+        self.private = Buckets(private_rate, private_burst)
+        self.groups = Buckets(group_rate, group_burst)
+        self.max_retry_after = max_retry_after
+        self.on_wait = on_wait
+        self.on_retry_after = on_retry_after
+        self._paused_until: Dict[Any, float] = {}  # chat id -> monotonic time
+
+    async def acquire(self, chat_id) -> float:
+        """Wait for a send slot; returns the seconds waited."""
+        started = time.monotonic()
+        chat_buckets = self.groups if isinstance(chat_id, str) or (chat_id or 0) < 0 else self.private
+        while True:
+            now = time.monotonic()
+            wait = max(self._paused_until.get(chat_id, 0.0) - now,
+                       self.global_bucket.wait_time(None, now),
+                       chat_buckets.wait_time(chat_id, now))
+            if wait <= 0:
+                self.global_bucket.take(None, now)
+                chat_buckets.take(chat_id, now)
+                return now - started
+            await asyncio.sleep(wait)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        waited_for_flood = 0.0
+        while True:
+            waited = await self.acquire(chat_id)
+            if waited > 0:
+                self.on_wait(waited)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.on_retry_after(e.retry_after)
+                waited_for_flood += e.retry_after
+                if waited_for_flood > self.max_retry_after:
+                    raise
+                logger.warning("Flood control on %s for chat %s, retrying in %ss",
+                               method.__api_method__, chat_id, e.retry_after)
+                now = time.monotonic()
+                if len(self._paused_until) > 1000:
+                    self._paused_until = {c: t for c, t in self._paused_until.items() if t > now}
+                self._paused_until[chat_id] = now + e.retry_after